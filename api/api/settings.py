@@ -87,6 +87,33 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+
+# Responses of closed sessions are cached, until the cache is full as they don't change.
+# Use a shared backend (e.g. memcached) when running several API processes.
+# MAX_ENTRIES bounds the number of responses, not their size: responses larger than
+# CACHE_MAX_RESPONSE_SIZE bytes (pickled) are not cached, e.g. pages of thousands of
+# iterations. The in-memory cache holds at most 200 x 512KB = 100MB by default, by process.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", "streamer"),
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "200"))},
+    }
+}
+# A page of 1000 iterations takes about 350KB
+CACHE_MAX_RESPONSE_SIZE = int(os.getenv("CACHE_MAX_RESPONSE_SIZE", str(512 * 1024)))
+
+# Storage
+# The API downloads the images of the sessions to render them. As the storage URLs are
+# chosen by the clients, images are only fetched from these hosts (host:port, comma separated).
+STORAGE_HOSTS = [
+    host.strip().lower() for host in os.getenv("STORAGE_HOSTS", "localhost:4572").split(",") if host.strip()
+]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
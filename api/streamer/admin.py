@@ -1,7 +1,8 @@
 from django.contrib import admin
 
-from .models import StreamerSession, SingleStreamIteration
+from .models import Storage, StreamerSession, SingleStreamIteration
 
 # Register the models for admin
+admin.site.register(Storage)
 admin.site.register(StreamerSession)
 admin.site.register(SingleStreamIteration)
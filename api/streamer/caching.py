@@ -0,0 +1,68 @@
+import pickle
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def session_version(stream_session):
+    """Version of the data of a session, which changes with its last modification"""
+    return f'{stream_session.id}-{int(stream_session.last_modified.timestamp() * 1000000)}'
+
+
+def session_response(request, stream_session, endpoint, build_response):
+    """
+    Returns the response of an endpoint of a session, with validators so that clients
+    can poll it with conditional requests.
+
+    - Every response has an ETag, from the last modification of the session. A conditional
+      request gets a 304 while nothing changed.
+    - Only the responses of closed sessions have a Last-Modified header, and If-Modified-Since
+      is ignored for open sessions: it has a resolution of a second, in which an open session
+      may get new iterations.
+    - The responses of closed sessions are cached, as they don't change. They are keyed by
+      the version of the session, so new iterations invalidate them. Responses larger than
+      CACHE_MAX_RESPONSE_SIZE are not cached, as the cache only bounds their number.
+
+    :parameter
+    request: API Request
+    stream_session: the session of the response
+    endpoint: name of the endpoint, part of the cache key
+    build_response: function returning the response when it is not cached
+
+    :return:
+    Returns the response, from the cache if possible, or a 304 response.
+    """
+    # The URL holds the query parameters, e.g. the page, and the host of the next links
+    url_hash = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    version = session_version(stream_session)
+    etag = quote_etag(f'{version}-{endpoint}-{url_hash[:16]}')
+    last_modified = int(stream_session.last_modified.timestamp()) if not stream_session.is_open else None
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    if stream_session.is_open:
+        response = build_response()
+    else:
+        cache_key = f'streamer:session:{version}:{endpoint}:{url_hash}'
+        # Responses are cached pickled, so their size is known without pickling them twice
+        pickled_data = cache.get(cache_key)
+        if pickled_data is None:
+            response = build_response()
+            pickled_data = pickle.dumps(response.data, pickle.HIGHEST_PROTOCOL)
+            if len(pickled_data) <= settings.CACHE_MAX_RESPONSE_SIZE:
+                cache.set(cache_key, pickled_data)
+        else:
+            response = Response(pickle.loads(pickled_data))
+
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # Clients may keep the response, but must check it is still valid before using it
+    response['Cache-Control'] = 'no-cache'
+    return response
@@ -0,0 +1,30 @@
+# Generated by Django 2.1.7 on 2020-09-21 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0003_auto_20200918_0001'),
+    ]
+
+    operations = [
+        # Sessions created before are all finished
+        migrations.AddField(
+            model_name='streamersession',
+            name='is_open',
+            field=models.BooleanField(default=False, help_text='Whether this stream is still running.', verbose_name='Is open'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='streamersession',
+            name='is_open',
+            field=models.BooleanField(default=True, help_text='Whether this stream is still running.', verbose_name='Is open'),
+        ),
+        migrations.AlterField(
+            model_name='streamersession',
+            name='stop_time',
+            field=models.DateTimeField(default=None, editable=False, help_text='When this stream stopped.', null=True, verbose_name='Stop time'),
+        ),
+    ]
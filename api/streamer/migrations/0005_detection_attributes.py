@@ -0,0 +1,43 @@
+# Generated by Django 2.1.7 on 2020-09-23 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0004_streamersession_is_open'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='box_bottom',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Bounding box bottom'),
+        ),
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='box_left',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Bounding box left'),
+        ),
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='box_right',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Bounding box right'),
+        ),
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='box_top',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Bounding box top'),
+        ),
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='score',
+            field=models.FloatField(blank=True, null=True, verbose_name='Detection score'),
+        ),
+        migrations.AlterField(
+            model_name='singlestreamiteration',
+            name='output_frame_url',
+            field=models.URLField(blank=True, verbose_name='Output frame image URL'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.7 on 2020-09-24 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0005_detection_attributes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='input_frame_offset',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Input frame offset in segment'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.1.7 on 2020-09-25 10:12
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0006_singlestreamiteration_input_frame_offset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='streamersession',
+            name='metrics',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, help_text='Counters and stage latencies of the streamer for this stream.', null=True, verbose_name='Metrics'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 2.1.7 on 2020-09-25 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0007_streamersession_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='sequence',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Frame number in the session'),
+        ),
+        migrations.AddIndex(
+            model_name='singlestreamiteration',
+            index=models.Index(fields=['session', 'feedback', 'sequence'], name='iteration_session_feedback_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='singlestreamiteration',
+            index=models.Index(fields=['session', 'sequence'], name='iteration_session_sequence_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.1.7 on 2020-09-26 09:21
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0008_iteration_sequence_and_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='streamersession',
+            name='last_modified',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, help_text='When this stream or its iterations last changed.', verbose_name='Last modified'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.1.7 on 2020-09-27 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0009_streamersession_last_modified'),
+    ]
+
+    operations = [
+        # Existing sessions are left uncounted (null), new ones start from 0
+        migrations.AddField(
+            model_name='streamersession',
+            name='face_count',
+            field=models.PositiveIntegerField(editable=False, help_text='Number of iterations of this stream with a face detected.', null=True, verbose_name='Face count'),
+        ),
+        migrations.AddField(
+            model_name='streamersession',
+            name='frame_count',
+            field=models.PositiveIntegerField(editable=False, help_text='Number of iterations of this stream.', null=True, verbose_name='Frame count'),
+        ),
+        migrations.AlterField(
+            model_name='streamersession',
+            name='face_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of iterations of this stream with a face detected.', null=True, verbose_name='Face count'),
+        ),
+        migrations.AlterField(
+            model_name='streamersession',
+            name='frame_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Number of iterations of this stream.', null=True, verbose_name='Frame count'),
+        ),
+    ]
@@ -0,0 +1,127 @@
+# Generated by Django 2.1.7 on 2020-09-28 14:12
+
+from urllib.parse import urlsplit
+
+from django.db import migrations, models
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
+import django.db.models.deletion
+
+# The URL fields of the iterations, by key field
+URL_FIELDS = (
+    ('input_frame_key', 'input_frame_url'),
+    ('output_frame_key', 'output_frame_url'),
+    ('detected_face_key', 'detected_face_url'),
+)
+
+
+def storage_url(url):
+    """Base URL of the storage of an object URL, `<endpoint>/<bucket>/<key>`"""
+    parts = urlsplit(url)
+    bucket = parts.path.lstrip('/').split('/', 1)[0]
+    return f'{parts.scheme}://{parts.netloc}/{bucket}'
+
+
+def urls_to_keys(apps, schema_editor):
+    """
+    Give every session the storage of its iterations, and replace the URLs of its iterations
+    by their keys in that storage. URLs outside of it are kept whole as keys.
+    """
+    Storage = apps.get_model('streamer', 'Storage')
+    StreamerSession = apps.get_model('streamer', 'StreamerSession')
+    SingleStreamIteration = apps.get_model('streamer', 'SingleStreamIteration')
+
+    for stream_session in StreamerSession.objects.all():
+        iterations = SingleStreamIteration.objects.filter(session=stream_session)
+        first_url = iterations.order_by('id').values_list('input_frame_url', flat=True).first()
+        if not first_url:
+            continue
+
+        stream_session.storage, _ = Storage.objects.get_or_create(url=storage_url(first_url))
+        stream_session.save(update_fields=['storage'])
+
+        prefix = f'{stream_session.storage.url}/'
+        for key_field, url_field in URL_FIELDS:
+            iterations.filter(**{f'{url_field}__startswith': prefix}).update(
+                **{key_field: Substr(url_field, len(prefix) + 1)}
+            )
+            iterations.exclude(**{f'{url_field}__startswith': prefix}).update(**{key_field: F(url_field)})
+        # The iterations without a face had an `empty_image` URL
+        iterations.exclude(feedback='FACE_DETECTED').update(detected_face_key=None)
+        iterations.filter(detected_face_url='').update(detected_face_key=None)
+
+
+def keys_to_urls(apps, schema_editor):
+    StreamerSession = apps.get_model('streamer', 'StreamerSession')
+    SingleStreamIteration = apps.get_model('streamer', 'SingleStreamIteration')
+
+    for stream_session in StreamerSession.objects.select_related('storage'):
+        iterations = SingleStreamIteration.objects.filter(session=stream_session)
+        prefix = f'{stream_session.storage.url}/' if stream_session.storage else ''
+        iterations.filter(detected_face_key__isnull=True).update(detected_face_key='empty_image')
+        for key_field, url_field in URL_FIELDS:
+            relative = iterations.exclude(**{f'{key_field}__contains': '://'}).exclude(**{key_field: ''})
+            relative.update(**{url_field: Concat(Value(prefix), F(key_field))})
+            iterations.exclude(pk__in=relative.values('pk')).update(**{url_field: F(key_field)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0010_streamersession_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Storage',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('url', models.URLField(unique=True, verbose_name='Base URL')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='streamersession',
+            name='storage',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='sessions', to='streamer.Storage', verbose_name='Storage'),
+        ),
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='input_frame_key',
+            field=models.CharField(default='', max_length=255, verbose_name='Input frame image key'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='output_frame_key',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Output frame image key'),
+        ),
+        migrations.AddField(
+            model_name='singlestreamiteration',
+            name='detected_face_key',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='Detected face image key'),
+        ),
+        migrations.RunPython(urls_to_keys, keys_to_urls),
+        # Defaults to add the URL fields back when migrating backwards
+        migrations.AlterField(
+            model_name='singlestreamiteration',
+            name='detected_face_url',
+            field=models.URLField(default='', verbose_name='Detected face image URL'),
+        ),
+        migrations.AlterField(
+            model_name='singlestreamiteration',
+            name='input_frame_url',
+            field=models.URLField(default='', verbose_name='Input frame image URL'),
+        ),
+        migrations.RemoveField(
+            model_name='singlestreamiteration',
+            name='detected_face_url',
+        ),
+        migrations.RemoveField(
+            model_name='singlestreamiteration',
+            name='input_frame_url',
+        ),
+        migrations.RemoveField(
+            model_name='singlestreamiteration',
+            name='output_frame_url',
+        ),
+    ]
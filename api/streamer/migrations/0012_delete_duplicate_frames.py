@@ -0,0 +1,47 @@
+# Generated by Django 2.1.7 on 2020-09-30 09:41
+
+from django.db import migrations
+from django.db.models import Count, F, Min
+
+FACE_DETECTED = 'FACE_DETECTED'
+
+
+def delete_duplicate_frames(apps, schema_editor):
+    """
+    Keep the first iteration of every frame of a session only. The others were created by
+    batches sent again after their response was lost, they are uncounted from their session.
+    """
+    StreamerSession = apps.get_model('streamer', 'StreamerSession')
+    SingleStreamIteration = apps.get_model('streamer', 'SingleStreamIteration')
+
+    duplicated_frames = (
+        SingleStreamIteration.objects
+        .filter(sequence__isnull=False)
+        .values('session', 'sequence')
+        .annotate(first_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for frame in duplicated_frames:
+        duplicates = (
+            SingleStreamIteration.objects
+            .filter(session=frame['session'], sequence=frame['sequence'])
+            .exclude(id=frame['first_id'])
+        )
+        faces = duplicates.filter(feedback=FACE_DETECTED).count()
+        frames, _ = duplicates.delete()
+        # Sessions created before they were counted have no counters
+        StreamerSession.objects.filter(id=frame['session'], frame_count__isnull=False).update(
+            frame_count=F('frame_count') - frames,
+            face_count=F('face_count') - faces,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0011_iteration_object_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_frames, migrations.RunPython.noop),
+    ]
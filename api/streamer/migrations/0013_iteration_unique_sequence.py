@@ -0,0 +1,22 @@
+# Generated by Django 2.1.7 on 2020-09-30 09:42
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamer', '0012_delete_duplicate_frames'),
+    ]
+
+    operations = [
+        # The unique index reads the iterations of a session in frame order too
+        migrations.AlterUniqueTogether(
+            name='singlestreamiteration',
+            unique_together={('session', 'sequence')},
+        ),
+        migrations.RemoveIndex(
+            model_name='singlestreamiteration',
+            name='iteration_session_sequence_idx',
+        ),
+    ]
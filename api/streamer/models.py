@@ -1,9 +1,58 @@
 import uuid
+from urllib.parse import urlsplit
+
 from django.db import models
+from django.contrib.postgres.fields import JSONField
 from django.utils import timezone
 
 from . import constants
 
+# Schemes of the images the API links to, and fetches itself to render frames
+WEB_URL_SCHEMES = ('http', 'https')
+
+
+def is_web_url(key):
+    """Whether an object key is a full HTTP(S) URL rather than a key in a storage"""
+    return key is not None and urlsplit(key).scheme in WEB_URL_SCHEMES and '://' in key
+
+
+class Storage(models.Model):
+    """
+    Storage location of the images of sessions, e.g. a S3 bucket.
+
+    Attributes
+    ----------
+    url: URL
+        Base URL of the objects of the storage, e.g. `<S3 endpoint>/<bucket>`. The URL of an
+        object is the base URL followed by its key, so moving the storage only changes it.
+    """
+    id = models.AutoField(primary_key=True)
+    url = models.URLField("Base URL", unique=True)
+
+    def __str__(self):
+        return self.url
+
+    def save(self, *args, **kwargs):
+        # The responses cached for the sessions of the storage hold the URLs of their images,
+        # so moving the storage changes their sessions too
+        moved = self.pk is not None and not Storage.objects.filter(pk=self.pk, url=self.url).exists()
+        super().save(*args, **kwargs)
+        if moved:
+            self.sessions.update(last_modified=timezone.now())
+
+    def object_url(self, key):
+        """URL of an object from its key. Keys may also be full HTTP(S) URLs, e.g. in another storage."""
+        if key is None or is_web_url(key):
+            return key
+        return f'{self.url}/{key}'
+
+
+def object_url(storage, key):
+    """URL of an object of a storage, which may be None when the keys are full HTTP(S) URLs"""
+    if storage is None:
+        return key
+    return storage.object_url(key)
+
 
 class StreamerSession(models.Model):
     """
@@ -14,7 +63,23 @@ class StreamerSession(models.Model):
     start_time: datetime
         Time when the session was started
     stop_time: datetime
-        Time when the session finished
+        Time when the session finished, null while the session is running
+    is_open: bool
+        Whether the session is still running. Iterations are added to an open
+        session while it runs, and it is closed once the streamer stops.
+    storage: Foreign Key
+        Storage of the images of the session, which the keys of its iterations are relative to
+    metrics: dict
+        Summary of the metrics of the streamer for the session: its counters (frames
+        captured, detected, dropped, bytes uploaded...) and the latencies of its stages.
+        Null until the session is closed.
+    last_modified: datetime
+        Last time the session or its iterations changed. It versions the cached responses
+        of the session.
+    frame_count, face_count: int
+        Number of iterations of the session, and of those with a face detected, kept up to
+        date by the API as iterations are created or deleted. Null for sessions created
+        before they were counted, whose iterations are counted on request.
     """
     id = models.AutoField(primary_key=True)
     start_time = models.DateTimeField(
@@ -26,13 +91,81 @@ class StreamerSession(models.Model):
     stop_time = models.DateTimeField(
         "Stop time",
         editable=False,
-        default=timezone.now,
+        null=True,
+        default=None,
         help_text="When this stream stopped.",
     )
+    is_open = models.BooleanField(
+        "Is open",
+        default=True,
+        help_text="Whether this stream is still running.",
+    )
+    storage = models.ForeignKey(
+        'Storage',
+        related_name='sessions',
+        verbose_name="Storage",
+        null=True,
+        blank=True,
+        on_delete=models.PROTECT,
+    )
+    last_modified = models.DateTimeField(
+        "Last modified",
+        editable=False,
+        default=timezone.now,
+        help_text="When this stream or its iterations last changed.",
+    )
+    frame_count = models.PositiveIntegerField(
+        "Frame count",
+        null=True,
+        default=0,
+        editable=False,
+        help_text="Number of iterations of this stream.",
+    )
+    face_count = models.PositiveIntegerField(
+        "Face count",
+        null=True,
+        default=0,
+        editable=False,
+        help_text="Number of iterations of this stream with a face detected.",
+    )
+    metrics = JSONField(
+        "Metrics",
+        null=True,
+        blank=True,
+        help_text="Counters and stage latencies of the streamer for this stream.",
+    )
 
     def __str__(self):
         return f"Session #{self.id}"
 
+    @property
+    def storage_url(self):
+        """Base URL of the storage of the images of the session, None if their keys are full URLs"""
+        return self.storage.url if self.storage is not None else None
+
+    def close(self, metrics=None):
+        """Mark the session as finished, now, with the summary of its metrics if any"""
+        self.stop_time = self.last_modified = timezone.now()
+        self.is_open = False
+        update_fields = ['stop_time', 'is_open', 'last_modified']
+        if metrics is not None:
+            self.metrics = metrics
+            update_fields.append('metrics')
+        self.save(update_fields=update_fields)
+
+    def count_iterations(self, frames, faces):
+        """
+        Add to the counters of the session, e.g. -1 for a deleted iteration, and record that
+        its iterations changed, now. The counters are incremented by the database, so
+        concurrent requests don't lose updates.
+        """
+        self.last_modified = timezone.now()
+        StreamerSession.objects.filter(id=self.id).update(
+            frame_count=models.F('frame_count') + frames,
+            face_count=models.F('face_count') + faces,
+            last_modified=self.last_modified,
+        )
+
 
 class SingleStreamIteration(models.Model):
     """
@@ -49,12 +182,24 @@ class SingleStreamIteration(models.Model):
         Status of the frame
     session: Foreign Key
         Parent session related to this iteration
-    input_frame_url: URL
-        S3 URL for input frame
-    output_frame_url: URL
-        S3 URL for output frame
-    detected_face_url: URL
-        S3 URL for extracted face
+    sequence: int
+        Number of the frame in the session, which orders the iterations, unique in the
+        session. Null for iterations saved by older streamers, which are ordered by ID.
+    input_frame_key: str
+        Key of the input frame, or of the video segment containing it, in the storage of
+        the session
+    input_frame_offset: int
+        Frame number of the input frame in its video segment, null if the input frame
+        is saved as an image
+    output_frame_key: str
+        Key of the output frame. Only saved by older streamers, the output frame is
+        now rendered on request from the input frame and the bounding box.
+    detected_face_key: str
+        Key of the extracted face, null if there is no face
+    box_left, box_top, box_right, box_bottom: int
+        Bounding box of the detected face in the input frame, null if there is no face
+    score: float
+        Score of the detection of the face
     """
     id = models.AutoField(primary_key=True)
     unique_token = models.UUIDField(default=uuid.uuid4, unique=True)
@@ -69,9 +214,51 @@ class SingleStreamIteration(models.Model):
         # Delete the frames related if the stream session is deleted
         on_delete=models.CASCADE,
     )
-    input_frame_url = models.URLField(verbose_name="Input frame image URL")
-    output_frame_url = models.URLField(verbose_name="Output frame image URL")
-    detected_face_url = models.URLField(verbose_name="Detected face image URL")
+    sequence = models.PositiveIntegerField("Frame number in the session", null=True, blank=True)
+    input_frame_key = models.CharField("Input frame image key", max_length=255)
+    input_frame_offset = models.PositiveIntegerField("Input frame offset in segment", null=True, blank=True)
+    output_frame_key = models.CharField("Output frame image key", max_length=255, blank=True)
+    detected_face_key = models.CharField("Detected face image key", max_length=255, null=True, blank=True)
+    box_left = models.IntegerField("Bounding box left", null=True, blank=True)
+    box_top = models.IntegerField("Bounding box top", null=True, blank=True)
+    box_right = models.IntegerField("Bounding box right", null=True, blank=True)
+    box_bottom = models.IntegerField("Bounding box bottom", null=True, blank=True)
+    score = models.FloatField("Detection score", null=True, blank=True)
+
+    # Order of the iterations of a session. The ones without sequence come last, by ID.
+    FRAME_ORDER = (models.F('sequence').asc(nulls_last=True), 'id')
+
+    class Meta:
+        # A frame is saved once, even if its batch is sent again. Its unique index also reads
+        # the iterations of a session in frame order.
+        unique_together = (('session', 'sequence'),)
+        indexes = [
+            # The faces of a session are found in frame order by the index, their keys are read from the table
+            models.Index(fields=['session', 'feedback', 'sequence'], name='iteration_session_feedback_idx'),
+        ]
+
+    @property
+    def input_frame_url(self):
+        return object_url(self.session.storage, self.input_frame_key)
+
+    @property
+    def output_frame_url(self):
+        return object_url(self.session.storage, self.output_frame_key) if self.output_frame_key else ''
+
+    @property
+    def detected_face_url(self):
+        return object_url(self.session.storage, self.detected_face_key)
+
+    @property
+    def has_face(self):
+        return self.feedback == constants.FACE_DETECTED
+
+    @property
+    def bounding_box(self):
+        """(left, top, right, bottom) of the detected face, None if there is no face"""
+        if self.box_left is None:
+            return None
+        return self.box_left, self.box_top, self.box_right, self.box_bottom
 
     def __str__(self):
         return f'Iteration with UUID {str(self.unique_token)} for {str(self.session)}'
@@ -0,0 +1,107 @@
+import json
+import base64
+import binascii
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .models import SingleStreamIteration
+
+
+class IterationCursorPagination(CursorPagination):
+    """
+    Pages of iterations of every session, by ID. The cursor keeps the position in the
+    table, so every page is read from the primary key index, however deep.
+    """
+    ordering = 'id'
+    page_size = 1000
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+
+
+class SessionCursorPagination(CursorPagination):
+    """
+    Pages of sessions, by ID.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
+class FrameOrderPagination(BasePagination):
+    """
+    Keyset pagination of the iterations of one session, in frame order.
+
+    The cursor is the (sequence, id) of the last iteration of the previous page: the next
+    page starts right after it, with one query on the (session, sequence) index, whatever
+    its depth. Iterations without a sequence come last, by ID. Unlike offset pagination,
+    iterations received while paginating don't shift the pages.
+    """
+    page_size = 1000
+    page_size_query_param = 'page_size'
+    max_page_size = 10000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        queryset = queryset.order_by(*SingleStreamIteration.FRAME_ORDER)
+        if cursor is not None:
+            sequence, last_id = cursor
+            if sequence is None:
+                queryset = queryset.filter(sequence__isnull=True, id__gt=last_id)
+            else:
+                queryset = queryset.filter(
+                    Q(sequence__gt=sequence) | Q(sequence=sequence, id__gt=last_id) | Q(sequence__isnull=True)
+                )
+
+        # One more iteration tells whether there is a next page
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = (page[-1].sequence, page[-1].id)
+        return page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        encoded = base64.urlsafe_b64encode(json.dumps(self.next_cursor).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        """
+        :return:
+        Returns the (sequence, id) of the cursor, None for the first page.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            sequence, last_id = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+        except (TypeError, ValueError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(last_id, int) or not (sequence is None or isinstance(sequence, int)):
+            raise NotFound(self.invalid_cursor_message)
+        return sequence, last_id
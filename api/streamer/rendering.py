@@ -0,0 +1,220 @@
+import os
+import tempfile
+import functools
+import contextlib
+import threading
+import collections
+import urllib.parse
+import urllib.request
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+from . import constants
+from .models import is_web_url
+
+# Number of rendered output frames kept in memory, by each API process
+RENDER_CACHE_SIZE = 256
+
+# Number of video segments kept on disk, by each API process
+SEGMENT_CACHE_SIZE = 16
+
+
+def fetch_image(url, storage_url=None):
+    """
+    Download an image.
+
+    :parameter
+    url: URL of the image
+    storage_url: Base URL of the storage of the session of the image, the only place it
+    may be fetched from. None for the sessions without storage, whose keys are full URLs.
+
+    :return:
+    Returns the content of the image. Raises an OSError if the URL is not a HTTP(S) URL,
+    so that no local file is ever read, if its host is not in settings.STORAGE_HOSTS, so that
+    no internal service is ever requested, or if it is not in the storage.
+    """
+    if not is_web_url(url):
+        raise OSError(f'Only HTTP(S) images can be fetched, not {url}')
+    if storage_host(url) not in settings.STORAGE_HOSTS:
+        raise OSError(f'{url} is not in an allowed storage host')
+    if storage_url is not None and not url.startswith(f'{storage_url}/'):
+        raise OSError(f'{url} is not in the storage {storage_url}')
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return response.read()
+
+
+def storage_host(url):
+    """Host of a URL, with its port if it has one, as written in settings.STORAGE_HOSTS"""
+    parts = urllib.parse.urlsplit(url)
+    try:
+        port = parts.port
+    except ValueError:
+        return None
+    hostname = (parts.hostname or '').lower()
+    return f'{hostname}:{port}' if port is not None else hostname
+
+
+class SegmentCache:
+    """
+    Keeps the latest downloaded video segments in local files, as OpenCV can only read
+    videos from files. The least recently used segment is deleted when the cache is full,
+    once no request reads it anymore.
+    """
+
+    def __init__(self, size=SEGMENT_CACHE_SIZE):
+        self.size = size
+        self.directory = tempfile.mkdtemp(prefix='segments-')
+        self.paths = collections.OrderedDict()
+        # Number of requests reading each local copy, which is only deleted once nobody reads it
+        self.readers = collections.Counter()
+        self.evicted = set()
+        self.lock = threading.Lock()
+        # Concurrent misses of a segment download it once
+        self.download_locks = collections.defaultdict(threading.Lock)
+
+    @contextlib.contextmanager
+    def local_copy(self, url, storage_url=None):
+        """
+        Context manager giving the path of the local copy of the segment, downloaded from the
+        storage if it is not cached. The copy is kept at least until the block exits.
+        """
+        path = self._acquire(url, storage_url)
+        try:
+            yield path
+        finally:
+            with self.lock:
+                self.readers[path] -= 1
+                if not self.readers[path]:
+                    del self.readers[path]
+                    if path in self.evicted:
+                        self.evicted.remove(path)
+                        os.remove(path)
+
+    def _acquire(self, url, storage_url):
+        with self.lock:
+            path = self._read_cached(url)
+            if path is not None:
+                return path
+            download_lock = self.download_locks[url]
+
+        with download_lock:
+            with self.lock:
+                # Another request may have downloaded it meanwhile
+                path = self._read_cached(url)
+                if path is not None:
+                    return path
+            try:
+                content = fetch_image(url, storage_url)
+                segment_file, path = tempfile.mkstemp(suffix='.avi', dir=self.directory)
+                with os.fdopen(segment_file, 'wb') as segment_file:
+                    segment_file.write(content)
+            except Exception:
+                with self.lock:
+                    self.download_locks.pop(url, None)
+                raise
+
+            with self.lock:
+                self.download_locks.pop(url, None)
+                self.paths[url] = path
+                self.readers[path] += 1
+                while len(self.paths) > self.size:
+                    _, evicted_path = self.paths.popitem(last=False)
+                    if self.readers[evicted_path]:
+                        self.evicted.add(evicted_path)
+                    else:
+                        os.remove(evicted_path)
+        return path
+
+    def _read_cached(self, url):
+        """The path of the cached copy of the segment, counted as read, None if it is not cached"""
+        path = self.paths.get(url)
+        if path is not None:
+            self.paths.move_to_end(url)
+            self.readers[path] += 1
+        return path
+
+
+segment_cache = SegmentCache()
+
+
+def extract_frame(segment_url, offset, storage_url=None):
+    """
+    Extracts a single frame of a video segment.
+
+    :parameter
+    segment_url: URL of the video segment
+    offset: Frame number of the frame in the segment
+    storage_url: Base URL of the storage of the segment, see `fetch_image`
+
+    :return:
+    Returns the JPEG content of the frame.
+    """
+    with segment_cache.local_copy(segment_url, storage_url) as segment_path:
+        video_capture = cv2.VideoCapture(segment_path)
+        try:
+            video_capture.set(cv2.CAP_PROP_POS_FRAMES, offset)
+            ret, frame = video_capture.read()
+        finally:
+            video_capture.release()
+    if not ret:
+        raise OSError(f'Frame {offset} is not in the segment {segment_url}')
+    return cv2.imencode('.jpg', frame)[1].tobytes()
+
+
+def fetch_input_frame(input_frame_url, input_frame_offset=None, storage_url=None):
+    """
+    :return:
+    Returns the JPEG content of an input frame, saved as an image or in a video segment.
+    """
+    if input_frame_offset is None:
+        return fetch_image(input_frame_url, storage_url)
+    return extract_frame(input_frame_url, input_frame_offset, storage_url)
+
+
+def render_output_frame(input_image, feedback, bounding_box=None):
+    """
+    Draws the output frame of an iteration, exactly like the streamer does: the grayscale
+    input frame with the feedback on top, and the bounding box of the face if there is one.
+
+    :parameter
+    input_image: JPEG content of the input frame
+    feedback: Status of the frame
+    bounding_box: (left, top, right, bottom) of the face, None if there is no face
+
+    :return:
+    Returns the JPEG content of the output frame. Raises an OSError if the input frame is
+    not an image.
+    """
+    gray_frame = cv2.imdecode(np.frombuffer(input_image, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray_frame is None:
+        raise OSError('The input frame could not be decoded')
+
+    color = (0, 255, 0) if feedback == constants.FACE_DETECTED else (0, 0, 255)
+    output_frame = cv2.putText(
+        cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2RGB),
+        feedback,
+        (gray_frame.shape[1] // 2, 50),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        1,
+        color,
+        2,
+        cv2.LINE_AA,
+    )
+    if feedback == constants.FACE_DETECTED and bounding_box is not None:
+        left, top, right, bottom = bounding_box
+        output_frame = cv2.rectangle(output_frame, (left, top), (right, bottom), (0, 255, 0), 1)
+
+    return cv2.imencode('.jpg', output_frame)[1].tobytes()
+
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def render_iteration(input_frame_url, feedback, bounding_box=None, input_frame_offset=None, storage_url=None):
+    """
+    Renders the output frame of an iteration from its input frame URL.
+    The result only depends on the arguments, so the latest ones are cached.
+    """
+    return render_output_frame(
+        fetch_input_frame(input_frame_url, input_frame_offset, storage_url), feedback, bounding_box
+    )
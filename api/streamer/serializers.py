@@ -1,15 +1,141 @@
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
-from .models import StreamerSession, SingleStreamIteration
+from .models import Storage, StreamerSession, SingleStreamIteration, is_web_url
+
+
+def validate_object_key(key):
+    """
+    Keys are relative to the storage of their session. Full URLs are only accepted over
+    HTTP(S), as the API fetches some of these images to render frames.
+    """
+    if key and '://' in key and not is_web_url(key):
+        raise serializers.ValidationError('Expected a key in the storage of the session, or a HTTP(S) URL.')
 
 
 class StreamerSessionSerializer(serializers.ModelSerializer):
+    # The storage of the images is given by its base URL, and created on first use
+    storage_url = serializers.URLField(source='storage.url', required=False)
+
     class Meta:
         model = StreamerSession
         fields = "__all__"
+        # Sessions are closed with the close endpoint, which records the stop time and the metrics
+        read_only_fields = ('is_open', 'metrics', 'storage')
+
+    def create(self, validated_data):
+        return super().create(self.with_storage(validated_data))
+
+    def update(self, instance, validated_data):
+        # The cached responses of the session are versioned by its last modification, e.g. its
+        # storage builds the URLs of its images
+        validated_data['last_modified'] = timezone.now()
+        return super().update(instance, self.with_storage(validated_data))
+
+    @staticmethod
+    def with_storage(validated_data):
+        if 'storage' in validated_data:
+            validated_data['storage'], _ = Storage.objects.get_or_create(url=validated_data['storage']['url'])
+        return validated_data
 
 
 class StreamIterationSerializer(serializers.ModelSerializer):
+    # Iterations store the keys of their images, their URLs are built from the storage of
+    # their session
+    input_frame_url = serializers.ReadOnlyField()
+    output_frame_url = serializers.ReadOnlyField()
+    detected_face_url = serializers.ReadOnlyField()
+
     class Meta:
         model = SingleStreamIteration
         fields = "__all__"
+        extra_kwargs = {
+            key_field: {'validators': [validate_object_key]}
+            for key_field in ('input_frame_key', 'output_frame_key', 'detected_face_key')
+        }
+        # Older streamers send no sequence, several iterations of a session may have none
+        extra_kwargs['sequence'] = {'required': False}
+        validators = []
+
+    def validate(self, attrs):
+        session = attrs.get('session', getattr(self.instance, 'session', None))
+        sequence = attrs.get('sequence', getattr(self.instance, 'sequence', None))
+        if session is not None and sequence is not None:
+            iterations = SingleStreamIteration.objects.filter(session=session, sequence=sequence)
+            if self.instance is not None:
+                iterations = iterations.exclude(id=self.instance.id)
+            if iterations.exists():
+                raise serializers.ValidationError({'sequence': ['The session has an iteration with this sequence.']})
+        return attrs
+
+
+class StreamIterationListSerializer(serializers.ListSerializer):
+    """
+    Validates a list of iterations row by row and creates the valid ones at once.
+
+    Invalid rows don't fail the whole list: their errors are kept in `row_errors`,
+    by index in the list, and only the valid rows are saved.
+
+    Rows whose sequence the session already has, e.g. rows of a batch sent again after its
+    response was lost, are not created again: `row_iterations` holds the iteration of every
+    valid row, and `existing_rows` the rows whose iteration was created before.
+    """
+    # Number of rows inserted by each INSERT statement
+    batch_size = 500
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({
+                'non_field_errors': ['Expected a list of iterations.']
+            })
+
+        self.row_errors = {}
+        self.valid_indexes = []
+        rows = []
+        for index, item in enumerate(data):
+            try:
+                rows.append(self.child.run_validation(item))
+                self.valid_indexes.append(index)
+            except serializers.ValidationError as exc:
+                self.row_errors[index] = exc.detail
+        return rows
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        sequences = {attrs['sequence'] for attrs in validated_data if attrs.get('sequence') is not None}
+        # The rows are all of the session given to `save`
+        iterations_by_sequence = {
+            iteration.sequence: iteration
+            for iteration in model.objects.filter(session=validated_data[0]['session'], sequence__in=sequences)
+        } if sequences else {}
+
+        self.row_iterations = []
+        self.existing_rows = set()
+        iterations = []
+        for row, attrs in enumerate(validated_data):
+            sequence = attrs.get('sequence')
+            if sequence in iterations_by_sequence:
+                self.row_iterations.append(iterations_by_sequence[sequence])
+                self.existing_rows.add(row)
+                continue
+            iteration = model(**attrs)
+            if sequence is not None:
+                iterations_by_sequence[sequence] = iteration
+            self.row_iterations.append(iteration)
+            iterations.append(iteration)
+
+        # All or nothing, even when the rows take several INSERT statements
+        with transaction.atomic():
+            model.objects.bulk_create(iterations, batch_size=self.batch_size)
+        return iterations
+
+
+class BulkStreamIterationSerializer(StreamIterationSerializer):
+    """
+    Serializer for iterations sent in bulk for one session.
+    The session is given by the URL rather than by every row.
+    """
+    class Meta(StreamIterationSerializer.Meta):
+        read_only_fields = ('session',)
+        list_serializer_class = StreamIterationListSerializer
@@ -0,0 +1,69 @@
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import SingleStreamIteration
+from . import constants
+
+
+def count_legacy_iterations(stream_sessions):
+    """
+    Counts the iterations of the sessions created before they were counted, with a single
+    aggregate query for all of them.
+
+    :return:
+    Returns the (frame_count, face_count) of these sessions, by session ID.
+    """
+    legacy_ids = [stream_session.id for stream_session in stream_sessions if stream_session.frame_count is None]
+    if not legacy_ids:
+        return {}
+
+    counts = (
+        SingleStreamIteration.objects
+        .filter(session__in=legacy_ids)
+        .values('session')
+        .annotate(
+            frame_count=Count('id'),
+            face_count=Count('id', filter=Q(feedback=constants.FACE_DETECTED)),
+        )
+    )
+    counts_by_session = {session_id: (0, 0) for session_id in legacy_ids}
+    for count in counts:
+        counts_by_session[count['session']] = (count['frame_count'], count['face_count'])
+    return counts_by_session
+
+
+def session_summary(stream_session, frame_count, face_count):
+    """
+    :return:
+    Returns the summary statistics of a session. The duration of an open session is the
+    time since it started.
+    """
+    stop_time = stream_session.stop_time or timezone.now()
+    duration = (stop_time - stream_session.start_time).total_seconds()
+    return {
+        'session_id': stream_session.id,
+        'is_open': stream_session.is_open,
+        'start_time': stream_session.start_time,
+        'stop_time': stream_session.stop_time,
+        'duration_s': round(duration, 3),
+        'frame_count': frame_count,
+        'face_count': face_count,
+        'face_ratio': round(face_count / frame_count, 4) if frame_count else None,
+        'effective_fps': round(frame_count / duration, 3) if duration > 0 else None,
+    }
+
+
+def session_summaries(stream_sessions):
+    """
+    :return:
+    Returns the summaries of the sessions, in order, from their counters. The sessions
+    without counters cost one query for all of them.
+    """
+    legacy_counts = count_legacy_iterations(stream_sessions)
+    return [
+        session_summary(
+            stream_session,
+            *legacy_counts.get(stream_session.id, (stream_session.frame_count, stream_session.face_count))
+        )
+        for stream_session in stream_sessions
+    ]
@@ -1,10 +1,21 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from unittest import mock
+
+import cv2
+import numpy as np
 from rest_framework import status
 from rest_framework.test import APIClient
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 
-from .models import StreamerSession, SingleStreamIteration
+from .models import Storage, StreamerSession, SingleStreamIteration
 from .serializers import StreamerSessionSerializer, StreamIterationSerializer
-from .constants import FACE_DETECTED
+from .constants import FACE_DETECTED, NO_FACE_IN_FRAME
+from .rendering import fetch_image, render_iteration, SegmentCache
 
 # initialize the APIClient app
 client = APIClient()
@@ -27,6 +38,14 @@ class StreamingSessionTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, serializer.data)
 
+    def test_get_all_streamer_sessions_with_storage(self):
+        storage = Storage.objects.create(url='https://xyz.com')
+        StreamerSession.objects.update(storage=storage)
+        # The sessions are read with their storage
+        with self.assertNumQueries(1):
+            response = client.get("/api/stream-sessions/")
+        self.assertEqual([session['storage_url'] for session in response.data], ['https://xyz.com'] * 3)
+
     def test_get_single_streaming_session(self):
         response = client.get('/api/stream-sessions/1/')
         streamer_session = StreamerSession.objects.get(id=1)
@@ -34,38 +53,76 @@ class StreamingSessionTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, serializer.data)
 
+    def test_create_open_streaming_session(self):
+        response = client.post('/api/stream-sessions/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['is_open'])
+        self.assertIsNone(response.data['stop_time'])
+
+    def test_create_streaming_session_with_storage(self):
+        response = client.post('/api/stream-sessions/', {'storage_url': 'http://localhost:4572/testBucket'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['storage_url'], 'http://localhost:4572/testBucket')
+        # Sessions with the same storage share it
+        client.post('/api/stream-sessions/', {'storage_url': 'http://localhost:4572/testBucket'})
+        self.assertEqual(Storage.objects.get().sessions.count(), 2)
+
+    def test_close_streaming_session(self):
+        response = client.post('/api/stream-sessions/1/close')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['is_open'])
+        self.assertIsNotNone(response.data['stop_time'])
+        self.assertFalse(StreamerSession.objects.get(id=1).is_open)
+
+    def test_close_streaming_session_with_metrics(self):
+        metrics = {'counters': {'frames_captured': 120}, 'latencies': {'detection': {'count': 100, 'p50_ms': 2.5}}}
+        response = client.post('/api/stream-sessions/1/close', {'metrics': metrics}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['metrics'], metrics)
+        self.assertEqual(StreamerSession.objects.get(id=1).metrics, metrics)
+
+    def test_get_iterations_of_open_session(self):
+        SingleStreamIteration.objects.create(session=self.session_1)
+        response = client.get('/api/stream-sessions/1/iterations')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
 
 class SingleStreamIterationTest(TestCase):
     """
     Test module to test single stream iteration link
     """
     def setUp(self):
+        self.storage = Storage.objects.create(url='https://xyz.com')
         # create sessions
-        self.session_1 = StreamerSession.objects.create(id=1)
-        self.session_2 = StreamerSession.objects.create(id=2)
+        self.session_1 = StreamerSession.objects.create(id=1, storage=self.storage)
+        self.session_2 = StreamerSession.objects.create(id=2, storage=self.storage)
         # create iterations for sessions
+        # iterations may be received out of order, the second one is the first frame
         self.iteration_1 = SingleStreamIteration.objects.create(
             id=1,
             feedback=FACE_DETECTED,
-            input_frame_url='https://xyz.com/test.jpg',
-            output_frame_url='https://xyz.com/testoutput1.jpg',
-            detected_face_url='https://xyz.com/testdetected1.jpg',
+            sequence=2,
+            input_frame_key='test.jpg',
+            output_frame_key='testoutput1.jpg',
+            detected_face_key='testdetected1.jpg',
             session=self.session_1
         )
         self.iteration_2 = SingleStreamIteration.objects.create(
             id=2,
             feedback=FACE_DETECTED,
-            input_frame_url='https://xyz.com/test.jpg',
-            output_frame_url='https://xyz.com/testoutput2.jpg',
-            detected_face_url='https://xyz.com/testdetected2.jpg',
+            sequence=1,
+            input_frame_key='test.jpg',
+            output_frame_key='testoutput2.jpg',
+            detected_face_key='testdetected2.jpg',
             session=self.session_1
         )
         self.iteration_3 = SingleStreamIteration.objects.create(
             id=3,
             feedback=FACE_DETECTED,
-            input_frame_url='https://xyz.com/test.jpg',
-            output_frame_url='https://xyz.com/testoutput3.jpg',
-            detected_face_url='https://xyz.com/testdetected3.jpg',
+            input_frame_key='test.jpg',
+            output_frame_key='testoutput3.jpg',
+            detected_face_key='testdetected3.jpg',
             session=self.session_2
         )
         self.iteration_4 = SingleStreamIteration.objects.create(
@@ -79,7 +136,15 @@ class SingleStreamIterationTest(TestCase):
         stream_iterations = SingleStreamIteration.objects.all()
         serializer = StreamIterationSerializer(stream_iterations, many=True)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
+        self.assertIsNone(response.data['next'])
+
+    def test_get_all_iterations_by_pages(self):
+        response = client.get("/api/stream-iterations/", {'page_size': 3})
+        self.assertEqual([iteration['id'] for iteration in response.data['results']], [1, 2, 3])
+        response = client.get(response.data['next'])
+        self.assertEqual([iteration['id'] for iteration in response.data['results']], [4])
+        self.assertIsNone(response.data['next'])
 
     def test_get_single_stream_iteration(self):
         response = client.get('/api/stream-iterations/1/')
@@ -88,6 +153,21 @@ class SingleStreamIterationTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, serializer.data)
 
+    def test_get_iteration_urls_from_keys(self):
+        response = client.get('/api/stream-iterations/1/')
+        self.assertEqual(response.data['input_frame_url'], 'https://xyz.com/test.jpg')
+        self.assertEqual(response.data['detected_face_url'], 'https://xyz.com/testdetected1.jpg')
+
+        # Moving the storage only changes its URL
+        self.storage.url = 'https://abc.com/bucket'
+        self.storage.save()
+        response = client.get('/api/stream-iterations/1/')
+        self.assertEqual(response.data['input_frame_url'], 'https://abc.com/bucket/test.jpg')
+
+        # There is no detected face image without a face
+        response = client.get('/api/stream-iterations/4/')
+        self.assertIsNone(response.data['detected_face_url'])
+
     def test_get_extracted_faces_for_session_if_all_face_detected(self):
         response = client.get('/api/stream-sessions/1/faces')
         data = {
@@ -100,6 +180,37 @@ class SingleStreamIterationTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, data)
 
+    def test_get_iterations_in_frame_order(self):
+        response = client.get('/api/stream-sessions/1/iterations')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([iteration['id'] for iteration in response.data['results']], [2, 1])
+
+    def test_get_iterations_by_pages_in_frame_order(self):
+        # iterations of older streamers have no sequence, they come last
+        SingleStreamIteration.objects.create(id=5, session=self.session_1)
+        SingleStreamIteration.objects.create(id=6, sequence=3, session=self.session_1)
+
+        ids = []
+        url = '/api/stream-sessions/1/iterations?page_size=2'
+        while url is not None:
+            response = client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            ids.extend(iteration['id'] for iteration in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, [2, 1, 6, 5])
+
+    def test_get_iterations_with_invalid_cursor(self):
+        response = client.get('/api/stream-sessions/1/iterations', {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_export_iterations_as_ndjson(self):
+        response = client.get('/api/stream-sessions/1/iterations/export')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [2, 1])
+
     def test_get_extracted_faces_for_session_if_some_face_detected(self):
         response = client.get('/api/stream-sessions/2/faces')
         data = {
@@ -110,3 +221,429 @@ class SingleStreamIterationTest(TestCase):
         }
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data, data)
+
+
+class BulkStreamIterationTest(TestCase):
+    """
+    Test module to test the bulk creation of stream iterations
+    """
+    def setUp(self):
+        self.storage = Storage.objects.create(url='https://xyz.com')
+        self.session_1 = StreamerSession.objects.create(id=1, storage=self.storage)
+        self.iterations_data = [
+            {
+                'feedback': FACE_DETECTED,
+                'input_frame_key': f'test{i}.jpg',
+                'output_frame_key': f'testoutput{i}.jpg',
+                'detected_face_key': f'testdetected{i}.jpg',
+            }
+            for i in range(3)
+        ]
+
+    def test_create_iterations_from_json_list(self):
+        response = client.post(
+            '/api/stream-sessions/1/iterations/bulk', self.iterations_data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 3)
+        self.assertEqual([result['index'] for result in response.data['results']], [0, 1, 2])
+        self.assertEqual(self.session_1.stream_iterations.count(), 3)
+
+    def test_create_iterations_from_ndjson(self):
+        body = '\n'.join(json.dumps(iteration) for iteration in self.iterations_data)
+        response = client.post(
+            '/api/stream-sessions/1/iterations/bulk', body, content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.session_1.stream_iterations.count(), 3)
+
+    def test_create_iterations_reports_invalid_rows(self):
+        self.iterations_data[1]['input_frame_key'] = 'x' * 256
+        response = client.post(
+            '/api/stream-sessions/1/iterations/bulk', self.iterations_data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertIn('input_frame_key', response.data['results'][1]['errors'])
+        self.assertEqual(self.session_1.stream_iterations.count(), 2)
+
+    def test_create_iterations_rejects_local_urls(self):
+        self.iterations_data[0]['input_frame_key'] = 'file:///etc/passwd'
+        self.iterations_data[1]['detected_face_key'] = 'https://abc.com/testdetected1.jpg'
+        response = client.post(
+            '/api/stream-sessions/1/iterations/bulk', self.iterations_data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertIn('input_frame_key', response.data['results'][0]['errors'])
+        self.assertEqual(self.session_1.stream_iterations.count(), 2)
+
+    def test_create_iterations_for_missing_session(self):
+        response = client.post(
+            '/api/stream-sessions/2/iterations/bulk', self.iterations_data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_create_iterations_sent_again(self):
+        for sequence, iteration in enumerate(self.iterations_data):
+            iteration['sequence'] = sequence
+        client.post('/api/stream-sessions/1/iterations/bulk', self.iterations_data[:2], format='json')
+        response = client.post(
+            '/api/stream-sessions/1/iterations/bulk', self.iterations_data, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(
+            [result.get('existing', False) for result in response.data['results']], [True, True, False]
+        )
+        self.assertEqual(self.session_1.stream_iterations.count(), 3)
+        self.session_1.refresh_from_db()
+        self.assertEqual(self.session_1.frame_count, 3)
+
+    def test_create_iteration_with_existing_sequence(self):
+        iteration = dict(self.iterations_data[0], session=1, sequence=0)
+        client.post('/api/stream-iterations/', iteration, format='json')
+        response = client.post('/api/stream-iterations/', iteration, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('sequence', response.data)
+
+
+class OutputFrameTest(TestCase):
+    """
+    Test module to test the rendering of output frames
+    """
+    def setUp(self):
+        self.storage = Storage.objects.create(url='https://xyz.com')
+        self.session_1 = StreamerSession.objects.create(id=1, storage=self.storage)
+        self.iteration_1 = SingleStreamIteration.objects.create(
+            id=1,
+            feedback=FACE_DETECTED,
+            input_frame_key='test1.jpg',
+            detected_face_key='testdetected1.jpg',
+            box_left=10, box_top=10, box_right=50, box_bottom=60, score=1.2,
+            session=self.session_1
+        )
+        self.iteration_2 = SingleStreamIteration.objects.create(
+            id=2,
+            feedback=FACE_DETECTED,
+            input_frame_key='test2.jpg',
+            output_frame_key='testoutput2.jpg',
+            detected_face_key='testdetected2.jpg',
+            session=self.session_1
+        )
+        self.input_image = cv2.imencode('.jpg', np.zeros((120, 160, 3), np.uint8))[1].tobytes()
+        render_iteration.cache_clear()
+
+    @mock.patch('streamer.rendering.fetch_image')
+    def test_render_output_frame(self, fetch_image):
+        fetch_image.return_value = self.input_image
+        response = client.get('/api/stream-iterations/1/output')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        output_frame = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(output_frame.shape, (120, 160, 3))
+
+        # The rendered frame is cached
+        client.get('/api/stream-iterations/1/output')
+        self.assertEqual(fetch_image.call_count, 1)
+
+    @mock.patch('streamer.rendering.fetch_image')
+    def test_render_undecodable_input_frame(self, fetch_image):
+        fetch_image.return_value = b'not an image'
+        response = client.get('/api/stream-iterations/1/output')
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+
+    @mock.patch('streamer.rendering.urllib.request.urlopen')
+    def test_render_only_fetches_from_storage(self, urlopen):
+        self.iteration_1.input_frame_key = 'https://abc.com/test1.jpg'
+        self.iteration_1.save()
+        response = client.get('/api/stream-iterations/1/output')
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        urlopen.assert_not_called()
+
+    @mock.patch('streamer.rendering.urllib.request.urlopen')
+    def test_render_only_fetches_from_storage_hosts(self, urlopen):
+        # Sessions without storage have full URLs, chosen by the client
+        self.session_1.storage = None
+        self.session_1.save()
+        self.iteration_1.input_frame_key = 'http://169.254.169.254/latest/meta-data/test1.jpg'
+        self.iteration_1.save()
+        response = client.get('/api/stream-iterations/1/output')
+        self.assertEqual(response.status_code, status.HTTP_502_BAD_GATEWAY)
+        urlopen.assert_not_called()
+
+    @override_settings(STORAGE_HOSTS=['xyz.com', 'localhost:4572'])
+    @mock.patch('streamer.rendering.urllib.request.urlopen')
+    def test_fetch_image_from_storage_hosts(self, urlopen):
+        urlopen.return_value.__enter__.return_value.read.return_value = b'image'
+        self.assertEqual(fetch_image('https://xyz.com/test1.jpg', 'https://xyz.com'), b'image')
+        self.assertEqual(fetch_image('http://localhost:4572/testBucket/test1.jpg'), b'image')
+        with self.assertRaises(OSError):
+            fetch_image('http://localhost:8000/test1.jpg')
+        with self.assertRaises(OSError):
+            fetch_image('https://user@abc.com/test1.jpg')
+        self.assertEqual(urlopen.call_count, 2)
+
+    def test_redirect_to_saved_output_frame(self):
+        response = client.get('/api/stream-iterations/2/output')
+        self.assertRedirects(response, 'https://xyz.com/testoutput2.jpg', fetch_redirect_response=False)
+
+
+class InputFrameTest(TestCase):
+    """
+    Test module to test the extraction of input frames from video segments
+    """
+    def setUp(self):
+        self.storage = Storage.objects.create(url='https://xyz.com')
+        self.session_1 = StreamerSession.objects.create(id=1, storage=self.storage)
+        self.iteration_1 = SingleStreamIteration.objects.create(
+            id=1,
+            feedback=FACE_DETECTED,
+            input_frame_key='segments/000001.avi',
+            input_frame_offset=2,
+            detected_face_key='testdetected1.jpg',
+            session=self.session_1
+        )
+        self.iteration_2 = SingleStreamIteration.objects.create(
+            id=2,
+            feedback=FACE_DETECTED,
+            input_frame_key='test2.jpg',
+            detected_face_key='testdetected2.jpg',
+            session=self.session_1
+        )
+
+        # A segment of 4 frames, the frame at offset N filled with N * 50
+        segment_file, segment_path = tempfile.mkstemp(suffix='.avi')
+        os.close(segment_file)
+        video_writer = cv2.VideoWriter(segment_path, cv2.VideoWriter_fourcc(*'MJPG'), 15, (160, 120))
+        for offset in range(4):
+            video_writer.write(np.full((120, 160, 3), offset * 50, np.uint8))
+        video_writer.release()
+        with open(segment_path, 'rb') as segment_file:
+            self.segment = segment_file.read()
+        os.remove(segment_path)
+
+    @mock.patch('streamer.rendering.fetch_image')
+    def test_extract_input_frame_from_segment(self, fetch_image):
+        fetch_image.return_value = self.segment
+        response = client.get('/api/stream-iterations/1/input')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        input_frame = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
+        self.assertEqual(input_frame.shape, (120, 160, 3))
+        self.assertAlmostEqual(input_frame.mean(), 100, delta=5)
+
+    @mock.patch('streamer.rendering.fetch_image')
+    def test_segment_downloaded_once_by_concurrent_requests(self, fetch_image):
+        def slow_fetch_image(url, storage_url=None):
+            time.sleep(0.05)
+            return self.segment
+
+        fetch_image.side_effect = slow_fetch_image
+        segment_cache = SegmentCache()
+        paths = []
+
+        def read_segment():
+            with segment_cache.local_copy('https://xyz.com/segments/000001.avi') as path:
+                paths.append(path)
+
+        threads = [threading.Thread(target=read_segment) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(fetch_image.call_count, 1)
+        self.assertEqual(len(set(paths)), 1)
+
+    @mock.patch('streamer.rendering.fetch_image')
+    def test_segment_kept_while_read(self, fetch_image):
+        fetch_image.return_value = self.segment
+        segment_cache = SegmentCache(size=1)
+        with segment_cache.local_copy('https://xyz.com/segments/000001.avi') as path:
+            # Evicted by the next segment, but still being read
+            with segment_cache.local_copy('https://xyz.com/segments/000002.avi'):
+                pass
+            self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(path))
+
+    def test_redirect_to_saved_input_frame(self):
+        response = client.get('/api/stream-iterations/2/input')
+        self.assertRedirects(response, 'https://xyz.com/test2.jpg', fetch_redirect_response=False)
+
+
+class CachingTest(TestCase):
+    """
+    Test module to test the conditional requests and the cache of closed sessions
+    """
+    def setUp(self):
+        self.storage = Storage.objects.create(url='https://xyz.com')
+        cache.clear()
+        self.session_1 = StreamerSession.objects.create(id=1, storage=self.storage)
+        self.session_2 = StreamerSession.objects.create(id=2, storage=self.storage)
+        self.iteration_1 = SingleStreamIteration.objects.create(
+            id=1,
+            feedback=FACE_DETECTED,
+            input_frame_key='test1.jpg',
+            detected_face_key='testdetected1.jpg',
+            sequence=1,
+            session=self.session_1
+        )
+        self.session_1.close()
+
+    def test_not_modified_closed_session(self):
+        response = client.get('/api/stream-sessions/1/faces')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        response = client.get('/api/stream-sessions/1/faces', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_closed_session_served_from_cache(self):
+        response = client.get('/api/stream-sessions/1/iterations')
+        # Only the session is read once the response is cached
+        with self.assertNumQueries(1):
+            cached_response = client.get('/api/stream-sessions/1/iterations')
+        self.assertEqual(cached_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(cached_response.data, response.data)
+        self.assertEqual(cached_response['ETag'], response['ETag'])
+
+    @override_settings(CACHE_MAX_RESPONSE_SIZE=100)
+    def test_large_responses_not_cached(self):
+        response = client.get('/api/stream-sessions/1/iterations')
+        # The session, the page and the storage of its URLs are read again
+        with self.assertNumQueries(3):
+            uncached_response = client.get('/api/stream-sessions/1/iterations')
+        self.assertEqual(uncached_response.data, response.data)
+
+    def test_new_iterations_invalidate_cache(self):
+        response = client.get('/api/stream-sessions/1/faces')
+        client.post('/api/stream-sessions/1/iterations/bulk', [{
+            'feedback': FACE_DETECTED,
+            'input_frame_key': 'test2.jpg',
+            'detected_face_key': 'testdetected2.jpg',
+            'sequence': 2,
+        }], format='json')
+
+        new_response = client.get('/api/stream-sessions/1/faces', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(new_response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(new_response['ETag'], response['ETag'])
+        self.assertEqual(
+            new_response.data['extracted_faces_links'],
+            ['https://xyz.com/testdetected1.jpg', 'https://xyz.com/testdetected2.jpg']
+        )
+
+    def test_moving_storage_invalidates_cache(self):
+        response = client.get('/api/stream-sessions/1/faces')
+        self.storage.url = 'https://abc.com/bucket'
+        self.storage.save()
+
+        new_response = client.get('/api/stream-sessions/1/faces', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(new_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(new_response.data['extracted_faces_links'], ['https://abc.com/bucket/testdetected1.jpg'])
+
+    def test_changing_session_storage_invalidates_cache(self):
+        response = client.get('/api/stream-sessions/1/faces')
+        client.patch('/api/stream-sessions/1/', {'storage_url': 'https://abc.com/bucket'}, format='json')
+
+        new_response = client.get('/api/stream-sessions/1/faces', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(new_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(new_response.data['extracted_faces_links'], ['https://abc.com/bucket/testdetected1.jpg'])
+
+    def test_not_modified_open_session(self):
+        response = client.get('/api/stream-sessions/2/iterations')
+        self.assertIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        response = client.get('/api/stream-sessions/2/iterations', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_open_session_not_validated_by_date(self):
+        # Iterations added in the same second as the date of the client are still returned
+        response = client.get(
+            '/api/stream-sessions/2/iterations', HTTP_IF_MODIFIED_SINCE='Tue, 01 Jan 2030 00:00:00 GMT'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SessionSummaryTest(TestCase):
+    """
+    Test module to test the summary statistics of stream sessions
+    """
+    def setUp(self):
+        self.storage = Storage.objects.create(url='https://xyz.com')
+        self.session_1 = StreamerSession.objects.create(id=1, storage=self.storage)
+        # A session created before the sessions were counted
+        self.session_2 = StreamerSession.objects.create(id=2, storage=self.storage, frame_count=None, face_count=None)
+        for i in range(4):
+            SingleStreamIteration.objects.create(
+                feedback=FACE_DETECTED if i % 2 else NO_FACE_IN_FRAME,
+                input_frame_key=f'test{i}.jpg',
+                session=self.session_2
+            )
+        self.iterations_data = [
+            {
+                'feedback': FACE_DETECTED if i < 3 else NO_FACE_IN_FRAME,
+                'input_frame_key': f'test{i}.jpg',
+                'detected_face_key': f'testdetected{i}.jpg',
+            }
+            for i in range(4)
+        ]
+
+    def test_summary_counted_on_ingestion(self):
+        client.post('/api/stream-sessions/1/iterations/bulk', self.iterations_data, format='json')
+        client.post('/api/stream-sessions/1/close')
+        session = StreamerSession.objects.get(id=1)
+        self.assertEqual((session.frame_count, session.face_count), (4, 3))
+
+        with self.assertNumQueries(1):
+            response = client.get('/api/stream-sessions/1/summary')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['frame_count'], 4)
+        self.assertEqual(response.data['face_count'], 3)
+        self.assertEqual(response.data['face_ratio'], 0.75)
+        self.assertFalse(response.data['is_open'])
+
+    def test_summary_counted_on_single_iteration_changes(self):
+        response = client.post('/api/stream-iterations/', dict(self.iterations_data[0], session=1), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        client.patch(f'/api/stream-iterations/{response.data["id"]}/', {'feedback': NO_FACE_IN_FRAME}, format='json')
+        session = StreamerSession.objects.get(id=1)
+        self.assertEqual((session.frame_count, session.face_count), (1, 0))
+
+        client.delete(f'/api/stream-iterations/{response.data["id"]}/')
+        session = StreamerSession.objects.get(id=1)
+        self.assertEqual((session.frame_count, session.face_count), (0, 0))
+
+    def test_summary_of_open_session_not_validated(self):
+        response = client.get('/api/stream-sessions/1/summary')
+        self.assertNotIn('ETag', response)
+        # Its duration grows while it is open, whatever the validators of the client
+        response = client.get(
+            '/api/stream-sessions/1/summary', HTTP_IF_MODIFIED_SINCE='Tue, 01 Jan 2030 00:00:00 GMT'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['is_open'])
+
+    def test_summary_of_legacy_session(self):
+        response = client.get('/api/stream-sessions/2/summary')
+        self.assertEqual(response.data['frame_count'], 4)
+        self.assertEqual(response.data['face_count'], 2)
+        self.assertEqual(response.data['face_ratio'], 0.5)
+
+    def test_summaries_of_many_sessions(self):
+        client.post('/api/stream-sessions/1/iterations/bulk', self.iterations_data, format='json')
+        StreamerSession.objects.create(id=3, storage=self.storage)
+        # The sessions and the iterations of the legacy sessions
+        with self.assertNumQueries(2):
+            response = client.get('/api/stream-sessions/summaries', {'ids': '1,2'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(summary['session_id'], summary['frame_count']) for summary in response.data['results']],
+            [(1, 4), (2, 4)]
+        )
+
+        response = client.get('/api/stream-sessions/summaries')
+        self.assertEqual(len(response.data['results']), 3)
+
+    def test_summaries_with_invalid_ids(self):
+        response = client.get('/api/stream-sessions/summaries', {'ids': '1,x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -18,10 +18,52 @@ urlpatterns = [
         views.get_extracted_faces,
         name='get_extracted_faces',
     ),
+    # Summary statistics of many stream sessions
+    path(
+        'stream-sessions/summaries',
+        views.get_session_summaries,
+        name='get_session_summaries',
+    ),
+    # Summary statistics of single stream session
+    path(
+        'stream-sessions/<int:stream_session_id>/summary',
+        views.get_session_summary,
+        name='get_session_summary',
+    ),
     # Iterated frames for single stream session
     path(
         'stream-sessions/<int:stream_session_id>/iterations',
         views.get_stream_iterations,
         name='get_stream_iterations',
     ),
+    # Every iterated frame for single stream session, streamed as NDJSON
+    path(
+        'stream-sessions/<int:stream_session_id>/iterations/export',
+        views.export_stream_iterations,
+        name='export_stream_iterations',
+    ),
+    # Close a running stream session
+    path(
+        'stream-sessions/<int:stream_session_id>/close',
+        views.close_stream_session,
+        name='close_stream_session',
+    ),
+    # Input frame of a single iteration, extracted from its video segment
+    path(
+        'stream-iterations/<int:stream_iteration_id>/input',
+        views.get_input_frame,
+        name='get_input_frame',
+    ),
+    # Output frame of a single iteration, rendered on request
+    path(
+        'stream-iterations/<int:stream_iteration_id>/output',
+        views.get_output_frame,
+        name='get_output_frame',
+    ),
+    # Create many iterations of a single stream session at once
+    path(
+        'stream-sessions/<int:stream_session_id>/iterations/bulk',
+        views.create_stream_iterations,
+        name='create_stream_iterations',
+    ),
 ]
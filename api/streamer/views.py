@@ -1,25 +1,65 @@
+import json
+
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 
-from .serializers import StreamerSessionSerializer, StreamIterationSerializer
-from .models import StreamerSession, SingleStreamIteration
+from .parsers import NDJSONParser
+from .pagination import IterationCursorPagination, SessionCursorPagination, FrameOrderPagination
+from .caching import session_response
+from .summaries import session_summaries
+from .serializers import StreamerSessionSerializer, StreamIterationSerializer, BulkStreamIterationSerializer
+from .models import StreamerSession, SingleStreamIteration, object_url
 from . import constants
+from .rendering import render_iteration, extract_frame
+
+# Number of iterations fetched at once from the server-side cursor of an export
+EXPORT_CHUNK_SIZE = 2000
 
 
 class StreamerSessionViewSet(viewsets.ModelViewSet):
     """
     List all stream sessions
     """
-    queryset = StreamerSession.objects.all().order_by('start_time')
+    # The storage of the sessions gives their storage URL
+    queryset = StreamerSession.objects.select_related('storage').order_by('start_time')
     serializer_class = StreamerSessionSerializer
 
 
 class SingleStreamIterationViewSet(viewsets.ModelViewSet):
 
-    queryset = SingleStreamIteration.objects.all()
+    # The storage of the session builds the URLs of the images
+    queryset = SingleStreamIteration.objects.select_related('session__storage')
     serializer_class = StreamIterationSerializer
+    pagination_class = IterationCursorPagination
+
+    # The counters of the sessions are updated with their iterations, which also invalidates
+    # their cached responses
+    @transaction.atomic
+    def perform_create(self, serializer):
+        stream_iteration = serializer.save()
+        stream_iteration.session.count_iterations(1, int(stream_iteration.has_face))
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        previous_session = serializer.instance.session
+        previous_face = int(serializer.instance.has_face)
+        stream_iteration = serializer.save()
+        if previous_session.id == stream_iteration.session_id:
+            previous_session.count_iterations(0, int(stream_iteration.has_face) - previous_face)
+        else:
+            previous_session.count_iterations(-1, -previous_face)
+            stream_iteration.session.count_iterations(1, int(stream_iteration.has_face))
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        instance.session.count_iterations(-1, -int(instance.has_face))
 
 
 @api_view(['GET'])
@@ -37,32 +77,271 @@ def get_extracted_faces(request, stream_session_id):
     # We fetch the requested Streaming session
     stream_session = get_object_or_404(StreamerSession, id=stream_session_id)
 
-    # We can now start building the response data.
-    stream_iterations = stream_session.stream_iterations
-
-    # Get all the output frame from the stream iterations
-    faces_data = {
-        'session_id': stream_session_id,
-        'extracted_faces_links': [],
-    }
+    def build_response():
+        # Only the keys of the iterations with a face are read, in frame order, using the
+        # (session, feedback, sequence) index
+        extracted_faces_keys = (
+            SingleStreamIteration.objects
+            .filter(session=stream_session, feedback=constants.FACE_DETECTED)
+            .order_by(*SingleStreamIteration.FRAME_ORDER)
+            .values_list('detected_face_key', flat=True)
+        )
+        faces_data = {
+            'session_id': stream_session_id,
+            'extracted_faces_links': [object_url(stream_session.storage, key) for key in extracted_faces_keys],
+        }
+        return Response(faces_data)
 
-    for single_stream_iteration in stream_iterations.all():
-        # If there was a face detected, we add the URL of the detected image in the face data
-        if single_stream_iteration.feedback == constants.FACE_DETECTED:
-            faces_data['extracted_faces_links'].append(single_stream_iteration.detected_face_url)
-
-    return Response(faces_data)
+    return session_response(request, stream_session, 'faces', build_response)
 
 
 @api_view(['GET'])
 def get_stream_iterations(request, stream_session_id):
     """
-    Returns the frame iteration lists for one session
+    Returns the frame iteration lists for one session, in frame order, by pages.
+    The session may still be open, in which case the iterations received so far are returned.
+
+    :parameter
+    request: API Request, with the `cursor` of the page, from the `next` link of the
+    previous page, and optionally its `page_size`
+    stream_session_id: ID of the stream session
+
+    :return:
+    Returns the iterations of the page as `results`, and the `next` page link, null on the
+    last page.
     """
     # We fetch the requested Streaming session
     stream_session = get_object_or_404(StreamerSession, id=stream_session_id)
 
-    # We can now start building the response data.
-    stream_iterations = stream_session.stream_iterations
-    serializer = StreamIterationSerializer(stream_iterations, many=True)
-    return Response(serializer.data)
+    def build_response():
+        # We can now start building the response data.
+        paginator = FrameOrderPagination()
+        page = paginator.paginate_queryset(stream_session.stream_iterations.all(), request)
+        serializer = StreamIterationSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    return session_response(request, stream_session, 'iterations', build_response)
+
+
+@api_view(['GET'])
+def get_session_summary(request, stream_session_id):
+    """
+    Returns the summary statistics of a stream session, from its counters.
+
+    :parameter
+    request: API Request
+    stream_session_id: ID of the stream session
+
+    :return:
+    Returns the frame and face counts of the session, the ratio of frames with a face, its
+    duration and its effective frame rate.
+    """
+    stream_session = get_object_or_404(StreamerSession, id=stream_session_id)
+
+    def build_response():
+        return Response(session_summaries([stream_session])[0])
+
+    if stream_session.is_open:
+        # The duration and the frame rate of an open session change with time, not only with
+        # its iterations, so its summary is never validated by its last modification
+        return build_response()
+    return session_response(request, stream_session, 'summary', build_response)
+
+
+@api_view(['GET'])
+def get_session_summaries(request):
+    """
+    Returns the summary statistics of many stream sessions at once, by pages.
+
+    :parameter
+    request: API Request, optionally with the comma separated `ids` of the sessions, every
+    session otherwise, and the `cursor` of the page, from the `next` link of the previous page
+
+    :return:
+    Returns the summaries of the sessions of the page as `results`, by ID, and the `next`
+    page link.
+    """
+    stream_sessions = StreamerSession.objects.all()
+    if 'ids' in request.query_params:
+        try:
+            ids = [int(session_id) for session_id in request.query_params['ids'].split(',') if session_id]
+        except ValueError:
+            return Response({'ids': ['Expected comma separated IDs.']}, status=status.HTTP_400_BAD_REQUEST)
+        stream_sessions = stream_sessions.filter(id__in=ids)
+
+    paginator = SessionCursorPagination()
+    page = paginator.paginate_queryset(stream_sessions, request)
+    return paginator.get_paginated_response(session_summaries(page))
+
+
+@api_view(['GET'])
+def export_stream_iterations(request, stream_session_id):
+    """
+    Streams every iteration of one session, in frame order, as newline delimited JSON.
+
+    The iterations are read with a server-side cursor, serialized and sent chunk by chunk,
+    so a whole session is exported with constant memory however long it is.
+
+    :parameter
+    request: API Request
+    stream_session_id: ID of the stream session
+
+    :return:
+    Returns one JSON iteration per line (`application/x-ndjson`).
+    """
+    stream_session = get_object_or_404(StreamerSession, id=stream_session_id)
+    stream_iterations = stream_session.stream_iterations.order_by(*SingleStreamIteration.FRAME_ORDER)
+
+    def lines():
+        serializer = StreamIterationSerializer()
+        for stream_iteration in stream_iterations.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield json.dumps(serializer.to_representation(stream_iteration), cls=JSONEncoder) + '\n'
+
+    response = StreamingHttpResponse(lines(), content_type=NDJSONParser.media_type)
+    response['Content-Disposition'] = f'attachment; filename="session-{stream_session.id}.ndjson"'
+    return response
+
+
+@api_view(['POST'])
+def close_stream_session(request, stream_session_id):
+    """
+    Marks the stream session as finished. Closing a closed session does nothing.
+
+    :parameter
+    request: API Request, whose body may have the summary of the metrics of the
+    streamer for the session, as a `metrics` object
+    stream_session_id: ID of the stream session to close
+
+    :return:
+    Returns the closed stream session.
+    """
+    stream_session = get_object_or_404(StreamerSession, id=stream_session_id)
+    metrics = request.data.get('metrics') if isinstance(request.data, dict) else None
+    if metrics is not None and not isinstance(metrics, dict):
+        return Response({'metrics': ['Expected an object.']}, status=status.HTTP_400_BAD_REQUEST)
+
+    if stream_session.is_open:
+        stream_session.close(metrics)
+    return Response(StreamerSessionSerializer(stream_session).data)
+
+
+@api_view(['POST'])
+@parser_classes([JSONParser, NDJSONParser])
+def create_stream_iterations(request, stream_session_id):
+    """
+    Creates many iterations of one stream session at once.
+
+    :parameter
+    request: API Request, whose body is either a JSON list of iterations or
+    newline delimited JSON (`application/x-ndjson`) with one iteration per line.
+    stream_session_id: ID of the stream session the iterations belong to
+
+    :return:
+    Returns one result per row, in the order of the request: the ID and unique token of
+    the created iteration, or the validation errors of the row. Rows whose sequence the
+    session already has are not created again, their result is the existing iteration,
+    flagged as `existing`, and they are not counted again.
+    The status is 201 if every row was created or existed, 207 if only some were and 400
+    if none.
+    """
+    serializer = BulkStreamIterationSerializer(data=request.data, many=True)
+    serializer.is_valid(raise_exception=True)
+    # The counters of the session are updated with the iterations, or not at all
+    with transaction.atomic():
+        # The session is locked until the iterations are created, so that concurrent requests
+        # can't both create the same sequence
+        stream_session = get_object_or_404(StreamerSession.objects.select_for_update(), id=stream_session_id)
+        stream_iterations = serializer.save(session=stream_session)
+        if stream_iterations:
+            stream_session.count_iterations(
+                len(stream_iterations),
+                sum(stream_iteration.has_face for stream_iteration in stream_iterations),
+            )
+
+    results = [
+        {'index': index, 'errors': errors}
+        for index, errors in serializer.row_errors.items()
+    ]
+    for row, (index, stream_iteration) in enumerate(zip(serializer.valid_indexes, serializer.row_iterations)):
+        result = {'index': index, 'id': stream_iteration.id, 'unique_token': stream_iteration.unique_token}
+        if row in serializer.existing_rows:
+            result['existing'] = True
+        results.append(result)
+    results.sort(key=lambda result: result['index'])
+
+    if not serializer.row_errors:
+        response_status = status.HTTP_201_CREATED
+    elif serializer.row_iterations:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+
+    return Response(
+        {
+            'session_id': stream_session_id,
+            'created': len(stream_iterations),
+            'results': results,
+        },
+        status=response_status,
+    )
+
+
+def get_output_frame(request, stream_iteration_id):
+    """
+    Returns the output frame of an iteration: its input frame with the feedback and
+    the bounding box of the face drawn on top.
+
+    :parameter
+    request: API Request
+    stream_iteration_id: ID of the iteration
+
+    :return:
+    Returns the JPEG image of the output frame, rendered from the input frame. Older
+    iterations whose output frame was saved on S3 are redirected to it.
+    """
+    stream_iteration = get_object_or_404(
+        SingleStreamIteration.objects.select_related('session__storage'), id=stream_iteration_id
+    )
+    if stream_iteration.output_frame_url:
+        return HttpResponseRedirect(stream_iteration.output_frame_url)
+
+    try:
+        output_image = render_iteration(
+            stream_iteration.input_frame_url,
+            stream_iteration.feedback,
+            stream_iteration.bounding_box,
+            stream_iteration.input_frame_offset,
+            stream_iteration.session.storage_url,
+        )
+    except OSError:
+        return HttpResponse('The input frame could not be fetched.', status=status.HTTP_502_BAD_GATEWAY)
+
+    return HttpResponse(output_image, content_type='image/jpeg')
+
+
+def get_input_frame(request, stream_iteration_id):
+    """
+    Returns the input frame of an iteration.
+
+    :parameter
+    request: API Request
+    stream_iteration_id: ID of the iteration
+
+    :return:
+    Returns the JPEG image of the input frame, extracted from its video segment. Iterations
+    whose input frame is saved as an image are redirected to it.
+    """
+    stream_iteration = get_object_or_404(
+        SingleStreamIteration.objects.select_related('session__storage'), id=stream_iteration_id
+    )
+    if stream_iteration.input_frame_offset is None:
+        return HttpResponseRedirect(stream_iteration.input_frame_url)
+
+    try:
+        input_image = extract_frame(
+            stream_iteration.input_frame_url, stream_iteration.input_frame_offset, stream_iteration.session.storage_url
+        )
+    except OSError:
+        return HttpResponse('The input frame could not be extracted.', status=status.HTTP_502_BAD_GATEWAY)
+
+    return HttpResponse(input_image, content_type='image/jpeg')
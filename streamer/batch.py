@@ -0,0 +1,267 @@
+import os
+import sys
+import cv2
+import json
+import time
+import boto3
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import wait
+
+from src.video import count_frames, read_frames, encode_jpeg
+from src.face import FaceTracker, FACE_DETECTED
+from src.s3 import FrameUploader, new_session_key, INPUT_FRAME, DETECTED_FACE
+from src.api import ApiClient
+from src.dynamodb import BatchWriter, ensure_table
+from main import (
+    iteration_from_item, detection_attributes, save_session, S3_BUCKET_NAME, S3_ENDPOINT, S3_STORAGE_URL,
+    DYNAMODB_TABLE_NAME, DYNAMODB_ENDPOINT,
+)
+
+# Number of frames processed by a worker at once
+SEGMENT_SIZE = 300
+
+logger = logging.getLogger()
+
+# Resources of a worker process, loaded once by `init_worker`
+_worker = {}
+
+
+class LocalStorage:
+    """
+    Saves the images in a local directory instead of the S3 bucket.
+    Images of a session are saved in a sub-directory named after the session key.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def save(self, image_string, sequence, kind, session_key):
+        path = os.path.join(session_key, f'{sequence:08d}_{kind}.jpg')
+        with open(os.path.join(self.output_dir, path), 'wb') as image_file:
+            image_file.write(image_string)
+        return path
+
+    def put_item(self, item):
+        # the items are written to the session index by the main process
+        pass
+
+    def flush(self):
+        return 0
+
+
+class RemoteStorage:
+    """
+    Saves the images in the S3 bucket and the iterations in the dynamoDB table,
+    with the same clients as the streamer.
+    """
+
+    def __init__(self):
+        self.uploader = FrameUploader(S3_BUCKET_NAME, endpoint_url=S3_ENDPOINT)
+        dynamodb = boto3.resource('dynamodb', endpoint_url=DYNAMODB_ENDPOINT)
+        self.writer = BatchWriter(dynamodb, DYNAMODB_TABLE_NAME)
+        self.futures = []
+        # Items the writer gave up on, already reported
+        self._items_failed = 0
+
+    def save(self, image_string, sequence, kind, session_key):
+        future = self.uploader.upload(image_string, sequence, kind, session_key)
+        self.futures.append(future)
+        return future.key
+
+    def put_item(self, item):
+        self.writer.put(item)
+
+    def flush(self):
+        """
+        Wait for the images and the items of the segment to be saved.
+
+        Returns
+        -------
+        failed: int
+            The number of images and items that could not be saved, after every retry.
+        """
+        wait(self.futures)
+        failed = sum(future.exception() is not None for future in self.futures)
+        self.futures = []
+        self.writer.flush()
+        failed += self.writer.failed - self._items_failed
+        self._items_failed = self.writer.failed
+        return failed
+
+
+def init_worker(output_dir):
+    """
+    Load the resources of a worker process, once.
+    OpenCV is limited to one thread, the parallelism comes from the processes.
+    """
+    cv2.setNumThreads(1)
+    _worker['face_tracker'] = FaceTracker(render=False)
+    _worker['storage'] = LocalStorage(output_dir) if output_dir else RemoteStorage()
+
+
+def process_segment(task):
+    """
+    Run the face tracker on a segment of a source and save the results.
+
+    Parameters
+    ----------
+    task: dict
+        The source, its session key, and the first frame and number of frames of the segment.
+
+    Returns
+    -------
+    source: str
+        The source of the segment.
+    items: list of dict
+        The items of the iterations of the segment, as saved in the dynamoDB table.
+    failed: int
+        The number of images and items of the segment that could not be saved.
+    """
+    face_tracker = _worker['face_tracker']
+    storage = _worker['storage']
+    session_key = task['session_key']
+
+    # The segments of a video are not processed in order, don't track across them
+    face_tracker.reset()
+
+    items = []
+    for index, frame in read_frames(task['source'], task['start'], task['count']):
+        # Sequences start at 1, and unreadable images leave a gap rather than shifting the next frames
+        sequence = index + 1
+        feedback, _, detected_face = face_tracker.run(frame)
+
+        detected_face_path = 'empty_image'
+        if feedback == FACE_DETECTED:
+            detected_face_path = storage.save(encode_jpeg(detected_face), sequence, DETECTED_FACE, session_key)
+
+        item = {
+            'session_key': session_key,
+            'sequence': sequence,
+            'input_frame_path': storage.save(encode_jpeg(frame), sequence, INPUT_FRAME, session_key),
+            'feedback': feedback,
+            'detected_face_path': detected_face_path,
+        }
+        item.update(detection_attributes(face_tracker.last_bounding_box, face_tracker.last_score))
+        storage.put_item(item)
+        items.append(item)
+
+    failed = storage.flush()
+    return task['source'], items, failed
+
+
+def run(sources, workers, output_dir=None, segment_size=SEGMENT_SIZE):
+    """
+    Process video files or image directories, headless, on a pool of processes.
+
+    Every source is a session. Its frames are split in segments processed in parallel.
+    With an output directory, the images and an `iterations.jsonl` index are written
+    there. Otherwise the results are saved like the streamer does, in the S3 bucket,
+    the dynamoDB table and the API. A session the API could not create when it started
+    is replayed from the table once its frames are processed.
+
+    Parameters
+    ----------
+    sources: list of str
+        Paths of video files or image directories.
+    workers: int
+        Number of processes.
+    output_dir: str
+        Local directory to save the results in, None to save them remotely.
+    segment_size: int
+        Number of frames processed by a worker at once.
+
+    Returns
+    -------
+    frames: int
+        The number of frames processed.
+    failed: int
+        The number of images, items and iterations that could not be saved, and of sessions
+        that could not be saved in the API.
+    """
+    api = None
+    if not output_dir:
+        api = ApiClient()
+        # Created before the workers write to it
+        table = ensure_table(boto3.resource('dynamodb', endpoint_url=DYNAMODB_ENDPOINT), DYNAMODB_TABLE_NAME)
+    sessions = {}
+    tasks = []
+    for source in sources:
+        session_key = new_session_key()
+        # The iterations whose batch failed to be sent are sent again once every frame is processed
+        session = {'session_key': session_key, 'session_id': None, 'index': None, 'failed': []}
+        if output_dir:
+            os.makedirs(os.path.join(output_dir, session_key), exist_ok=True)
+            session['index'] = open(os.path.join(output_dir, session_key, 'iterations.jsonl'), 'w')
+        else:
+            session['session_id'] = api.create_session(S3_STORAGE_URL)
+        sessions[source] = session
+
+        frame_count = count_frames(source)
+        for start in range(0, frame_count, segment_size):
+            tasks.append({
+                'source': source,
+                'session_key': session_key,
+                'start': start,
+                'count': min(segment_size, frame_count - start),
+            })
+
+    frames = 0
+    failed = 0
+    start_time = time.time()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(output_dir,)) as pool:
+        for source, items, segment_failed in pool.imap_unordered(process_segment, tasks):
+            frames += len(items)
+            failed += segment_failed
+            session = sessions[source]
+            if session['index'] is not None:
+                for item in items:
+                    session['index'].write(json.dumps(item, default=float) + '\n')
+            elif session['session_id'] is not None:
+                api.create_iterations(
+                    session['session_id'], (iteration_from_item(session['session_id'], item) for item in items),
+                    on_failed=session['failed'].extend,
+                )
+    elapsed = time.time() - start_time
+
+    for source, session in sessions.items():
+        if session['index'] is not None:
+            session['index'].close()
+        elif session['session_id'] is not None:
+            if session['failed']:
+                unsent = []
+                api.create_iterations(session['session_id'], session['failed'], on_failed=unsent.extend)
+                failed += len(unsent)
+            if not api.close_session(session['session_id']):
+                failed += 1
+        else:
+            # The API was not reachable when the session was created, its items are in the table
+            session['session_id'] = save_session(api, table, session['session_key'])
+            if session['session_id'] is None:
+                failed += 1
+                logger.error(f"{source} could not be saved in the API, its items are kept in the table")
+        logger.info(f"{source} saved as session {session['session_id'] or session['session_key']}")
+    if api is not None:
+        api.close()
+
+    logger.info(
+        f'Processed {frames} frames from {len(sources)} sources in {elapsed:.1f}s: '
+        f'{frames / max(elapsed, 1e-9):.1f} frames/s with {workers} workers'
+    )
+    if failed:
+        logger.error(f'{failed} images, items, iterations or sessions could not be saved')
+    return frames, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the face detector on recorded videos or image directories.')
+    parser.add_argument('sources', nargs='+', help='video files or image directories')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--output-dir', help='save the results in this directory instead of S3/dynamoDB/API')
+    parser.add_argument('--segment-size', type=int, default=SEGMENT_SIZE, help='frames processed by a worker at once')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    _, failed = run(args.sources, args.workers, args.output_dir, args.segment_size)
+    sys.exit(1 if failed else 0)
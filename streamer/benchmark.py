@@ -0,0 +1,417 @@
+import os
+import cv2
+import json
+import time
+import queue
+import random
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+
+import numpy as np
+
+from src.video import compress, encode_jpeg, read_frames
+from src.face import FaceTracker
+from src.s3 import FrameUploader, INPUT_FRAME
+from src.dynamodb import BatchWriter
+from src.pipeline import BLOCK
+from main import build_pipeline, detect_iteration, encode_iteration, persist_iteration
+
+# (height, width) of the synthetic frames
+RESOLUTIONS = {
+    '240p': (240, 320),
+    '480p': (480, 640),
+    '720p': (720, 1280),
+}
+FACE_COUNTS = (0, 1, 3)
+
+# Number of frames of every benchmark case
+FRAMES = 60
+
+# Relative slowdown of a median latency, or of a throughput, reported as a regression
+REGRESSION_THRESHOLD = 0.1
+
+logger = logging.getLogger()
+
+
+class InMemoryS3:
+    """
+    In-process stand-in of the S3 client: objects are kept in memory.
+
+    Attributes
+    ----------
+    latency: float
+        Seconds every call waits, to simulate the network.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body):
+        time.sleep(self.latency)
+        with self._lock:
+            self.objects[(Bucket, Key)] = len(Body)
+        return {}
+
+
+class InMemoryDynamoDB:
+    """
+    In-process stand-in of the dynamoDB resource: items are kept in memory.
+
+    Attributes
+    ----------
+    latency: float
+        Seconds every call waits, to simulate the network.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.items = []
+        self._lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems):
+        time.sleep(self.latency)
+        with self._lock:
+            for requests in RequestItems.values():
+                self.items.extend(request['PutRequest']['Item'] for request in requests)
+        return {'UnprocessedItems': {}}
+
+
+def synthetic_frames(resolution, faces, count=FRAMES, seed=0):
+    """
+    Deterministic frames of a textured background with drawn faces moving slowly, so
+    that consecutive frames differ like a camera feed.
+
+    The drawn faces give the detector the edges and contrasts of a face, but they are not
+    always detected as faces: use recorded frames to benchmark real detections.
+
+    Parameters
+    ----------
+    resolution: tuple
+        (height, width) of the frames.
+    faces: int
+        Number of faces in every frame.
+    count: int
+        Number of frames.
+    seed: int
+        Seed of the positions of the faces and of the background.
+
+    Returns
+    -------
+    frames: np.array
+        The frames, as one (count, height, width, 3) array.
+    """
+    height, width = resolution
+    rng = np.random.RandomState(seed)
+    background = cv2.GaussianBlur(rng.randint(0, 255, (height, width, 3), np.uint8), (0, 0), 3)
+    size = height // 5
+    positions = rng.uniform((size, size), (width - size, height - size), (faces, 2))
+    directions = rng.uniform(-1, 1, (faces, 2))
+
+    frames = np.empty((count, height, width, 3), np.uint8)
+    for index in range(count):
+        frame = frames[index]
+        frame[:] = background
+        for x, y in (positions + directions * index * size / 20.0).astype(int):
+            cv2.ellipse(frame, (x, y), (size // 2, size * 2 // 3), 0, 0, 360, (140, 170, 210), -1)
+            for eye_x in (x - size // 5, x + size // 5):
+                cv2.circle(frame, (eye_x, y - size // 6), size // 12, (40, 40, 40), -1)
+            cv2.line(frame, (x, y - size // 10), (x, y + size // 8), (90, 110, 150), 2)
+            cv2.ellipse(frame, (x, y + size // 3), (size // 5, size // 12), 0, 0, 180, (60, 60, 140), 2)
+    return frames
+
+
+def recorded_frames(source, resolution, count=FRAMES):
+    """
+    Frames of a video file or an image directory, resized to the resolution.
+    """
+    height, width = resolution
+    frames = [cv2.resize(frame, (width, height)) for _, frame in read_frames(source, 0, count)]
+    return np.array(frames)
+
+
+def timed(func, items):
+    """
+    Returns
+    -------
+    durations: list of float
+        Seconds of every call of `func` on the items.
+    """
+    durations = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(durations, total=None):
+    """
+    Latency percentiles of a benchmark, in milliseconds, and its throughput.
+
+    Parameters
+    ----------
+    durations: list of float
+        Seconds of every call.
+    total: float
+        Seconds the whole benchmark took, the sum of the durations if not given, e.g.
+        when the calls overlap.
+    """
+    milliseconds = np.array(durations) * 1000
+    total = sum(durations) if total is None else total
+    return {
+        'mean_ms': round(float(milliseconds.mean()), 4),
+        'p50_ms': round(float(np.percentile(milliseconds, 50)), 4),
+        'p90_ms': round(float(np.percentile(milliseconds, 90)), 4),
+        'p99_ms': round(float(np.percentile(milliseconds, 99)), 4),
+        'max_ms': round(float(milliseconds.max()), 4),
+        'fps': round(len(durations) / max(total, 1e-9), 2),
+    }
+
+
+def throughput(count, total):
+    """
+    Throughput of a benchmark whose items are not timed one by one, e.g. when they go
+    through a batch or a pipeline together. It has no latency percentiles.
+    """
+    return {'fps': round(count / max(total, 1e-9), 2)}
+
+
+def candidate_boxes(resolution, count, rng):
+    """Random candidate bounding boxes, as an array of (left, top, right, bottom) rows"""
+    height, width = resolution
+    lefts = rng.randint(0, width // 2, count)
+    tops = rng.randint(0, height // 2, count)
+    sizes = rng.randint(20, min(height, width) // 2, count)
+    return np.stack([lefts, tops, lefts + sizes, tops + sizes], axis=1)
+
+
+def run_case(frames, latency=0.0):
+    """
+    Benchmark every piece of the detection loop, then the whole loop, on the frames.
+
+    Returns
+    -------
+    results: dict
+        The summary of every benchmark, by name.
+    """
+    results = {}
+    resolution = frames.shape[1:3]
+    gray_frame = cv2.cvtColor(frames[0], cv2.COLOR_BGR2GRAY)
+
+    results['compress'] = summarize(timed(lambda frame: compress(frame, 2.0), frames))
+
+    face_tracker = FaceTracker()
+    results['face_tracker.run'] = summarize(timed(face_tracker.run, frames))
+    face_tracker = FaceTracker(render=False)
+    results['face_tracker.run(render=False)'] = summarize(timed(face_tracker.run, frames))
+    face_tracker = FaceTracker(tracking=False, roi_search=False, render=False)
+    results['face_tracker.run(detect every frame)'] = summarize(timed(face_tracker.run, frames))
+
+    start = time.perf_counter()
+    face_tracker.run_batch(frames)
+    batch_duration = time.perf_counter() - start
+    results['face_tracker.run_batch'] = throughput(len(frames), batch_duration)
+
+    rng = np.random.RandomState(0)
+    candidates = [(candidate_boxes(resolution, 5, rng), rng.uniform(0, 2, 5)) for _ in frames]
+    results['find_best_bounding_box'] = summarize(timed(
+        lambda candidate: face_tracker.find_best_bounding_box(candidate[0], candidate[1], gray_frame), candidates
+    ))
+
+    images = [encode_jpeg(frame) for frame in frames]
+    results['encode_jpeg'] = summarize(timed(encode_jpeg, frames))
+
+    uploader = FrameUploader('benchmark', session_key='benchmark', client=InMemoryS3(latency))
+    start = time.perf_counter()
+    durations = timed(lambda sequence: uploader.upload(images[sequence], sequence, INPUT_FRAME), range(len(frames)))
+    uploader.close()
+    results['s3.upload'] = summarize(durations, time.perf_counter() - start)
+
+    writer = BatchWriter(InMemoryDynamoDB(latency), 'benchmark')
+    start = time.perf_counter()
+    durations = timed(
+        lambda sequence: writer.put({'session_key': 'benchmark', 'sequence': sequence}), range(len(frames))
+    )
+    writer.close()
+    results['dynamodb.put'] = summarize(durations, time.perf_counter() - start)
+
+    # The whole loop, one frame after the other. Every frame is detected: the synthetic frames
+    # barely change, the change detector would skip the detection of nearly all of them.
+    face_tracker = FaceTracker()
+    uploader = FrameUploader('benchmark', session_key='benchmark', client=InMemoryS3(latency))
+    writer = BatchWriter(InMemoryDynamoDB(latency), 'benchmark')
+    previous = {}
+
+    def save_iteration(sequence):
+        iteration = {'id': sequence, 'frame': frames[sequence]}
+        detect_iteration(iteration, face_tracker, None, previous)
+        persist_iteration(encode_iteration(iteration), uploader, writer)
+
+    start = time.perf_counter()
+    durations = timed(save_iteration, range(len(frames)))
+    uploader.close()
+    writer.close()
+    results['end_to_end.sequential'] = summarize(durations, time.perf_counter() - start)
+
+    # The whole loop as the streamer runs it, every frame going through the pipeline
+    uploader = FrameUploader('benchmark', session_key='benchmark', client=InMemoryS3(latency))
+    writer = BatchWriter(InMemoryDynamoDB(latency), 'benchmark')
+    pipeline = build_pipeline(
+        FaceTracker(), None, uploader, writer, None, queue.Queue(maxsize=1), detection_policy=BLOCK
+    )
+    start = time.perf_counter()
+    pipeline.start()
+    for sequence, frame in enumerate(frames):
+        pipeline.feed({'id': sequence, 'frame': frame})
+    pipeline.drain()
+    uploader.close()
+    writer.close()
+    # The stages overlap, so only the throughput is measured
+    results['end_to_end.pipeline'] = throughput(len(frames), time.perf_counter() - start)
+
+    return results
+
+
+def environment():
+    """Describe where the benchmark ran, so that only comparable results are compared"""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        commit = commit.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare results to baseline ones, benchmark by benchmark.
+
+    A benchmark regresses when its median latency grows, or its throughput drops, by more
+    than `threshold`, relatively. Only the throughput of the benchmarks without latencies
+    is compared.
+
+    Returns
+    -------
+    regressions: list of str
+        The description of every regression.
+    """
+    regressions = []
+    for case, benchmarks in results['cases'].items():
+        for name, summary in benchmarks.items():
+            reference = baseline['cases'].get(case, {}).get(name)
+            if reference is None:
+                continue
+            throughput_drop = 1 - summary['fps'] / max(reference['fps'], 1e-9)
+            if 'p50_ms' not in summary or 'p50_ms' not in reference:
+                if throughput_drop > threshold:
+                    regressions.append(f"{case} {name}: {reference['fps']:.1f} -> {summary['fps']:.1f} fps")
+                continue
+            slowdown = summary['p50_ms'] / max(reference['p50_ms'], 1e-9) - 1
+            if slowdown > threshold or throughput_drop > threshold:
+                regressions.append(
+                    f"{case} {name}: p50 {reference['p50_ms']:.3f}ms -> {summary['p50_ms']:.3f}ms, "
+                    f"{reference['fps']:.1f} -> {summary['fps']:.1f} fps"
+                )
+    return regressions
+
+
+def run(resolutions, face_counts, frame_count=FRAMES, source=None, latency=0.0):
+    """
+    Benchmark the streamer hot path on synthetic or recorded frames, at several resolutions
+    and numbers of faces, with in-process stand-ins of S3 and dynamoDB.
+
+    Parameters
+    ----------
+    resolutions: list of str
+        Names of the resolutions, keys of RESOLUTIONS.
+    face_counts: list of int
+        Numbers of faces in the synthetic frames. Ignored with recorded frames.
+    frame_count: int
+        Number of frames of every case.
+    source: str
+        Video file or image directory to use instead of synthetic frames.
+    latency: float
+        Seconds every call to the storage stand-ins waits.
+
+    Returns
+    -------
+    results: dict
+        The environment, the parameters and the results of every case.
+    """
+    # The benchmark must be reproducible, including the jitter of the retries
+    random.seed(0)
+    results = {
+        'environment': environment(),
+        'parameters': {'frames': frame_count, 'source': source, 'latency': latency},
+        'cases': {},
+    }
+    for resolution in resolutions:
+        for faces in ([None] if source else face_counts):
+            if source:
+                case = f'{resolution} recorded'
+                frames = recorded_frames(source, RESOLUTIONS[resolution], frame_count)
+            else:
+                case = f'{resolution} {faces} faces'
+                frames = synthetic_frames(RESOLUTIONS[resolution], faces, frame_count)
+            logger.info(f'Benchmarking {case}')
+            results['cases'][case] = run_case(frames, latency)
+    return results
+
+
+def print_results(results):
+    for case, benchmarks in results['cases'].items():
+        print(case)
+        for name, summary in benchmarks.items():
+            if 'p50_ms' not in summary:
+                print(f"  {name:40} {'':51}{summary['fps']:10.1f} fps")
+                continue
+            print(
+                f"  {name:40} p50 {summary['p50_ms']:9.3f}ms  p90 {summary['p90_ms']:9.3f}ms  "
+                f"p99 {summary['p99_ms']:9.3f}ms  {summary['fps']:10.1f} fps"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the streamer hot path, without camera nor storage.')
+    parser.add_argument(
+        '--resolutions', nargs='+', default=list(RESOLUTIONS), choices=list(RESOLUTIONS), help='frame resolutions'
+    )
+    parser.add_argument('--faces', nargs='+', type=int, default=list(FACE_COUNTS), help='faces per synthetic frame')
+    parser.add_argument('--frames', type=int, default=FRAMES, help='frames of every case')
+    parser.add_argument('--source', help='video file or image directory to use instead of synthetic frames')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds of every S3/dynamoDB call')
+    parser.add_argument('--output', help='save the results in this JSON file')
+    parser.add_argument('--compare', help='JSON file of baseline results, exits with 1 on a regression')
+    parser.add_argument(
+        '--threshold', type=float, default=REGRESSION_THRESHOLD, help='relative slowdown reported as a regression'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    benchmark_results = run(args.resolutions, args.faces, args.frames, args.source, args.latency)
+    print_results(benchmark_results)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(benchmark_results, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            found_regressions = compare(benchmark_results, json.load(baseline_file), args.threshold)
+        for regression in found_regressions:
+            print(f'REGRESSION {regression}')
+        if found_regressions:
+            raise SystemExit(1)
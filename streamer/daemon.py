@@ -0,0 +1,378 @@
+import cv2
+import json
+import time
+import dlib
+import queue
+import boto3
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler
+
+from src.face import FaceTracker
+from src.video import capture_frames
+from src.motion import ChangeDetector
+from src.config import load_algorithm_params
+from src.segments import SegmentWriter
+from src.s3 import FrameUploader, new_session_key
+from src.api import ApiClient, IterationPublisher
+from src.dynamodb import BatchWriter, ensure_table
+from src.metrics import metrics, Metrics, MetricsServer, METRICS_PORT, _ThreadingHTTPServer
+from main import (
+    build_pipeline, save_session, S3_BUCKET_NAME, S3_ENDPOINT, S3_STORAGE_URL,
+    DYNAMODB_TABLE_NAME, DYNAMODB_ENDPOINT, SEGMENT_DURATION,
+)
+
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = 9200
+
+# Number of finished sessions whose status is kept
+FINISHED_SESSIONS = 100
+
+# States of a session
+RUNNING = 'running'
+STOPPING = 'stopping'
+FINISHED = 'finished'
+
+logger = logging.getLogger()
+
+
+class StreamSession:
+    """
+    A camera or video streamed by the daemon in its own session: a capture thread feeds
+    the frames to a detection pipeline of its own, which saves them with the clients of
+    the daemon.
+
+    The session finishes at the end of the video, or when it is stopped. The frames
+    already captured are then detected and saved, and once their images are uploaded the
+    session is closed in the API, with its own metrics.
+
+    Attributes
+    ----------
+    source: int or str
+        Camera index or path/URL of the video.
+    session_key: str
+        Key of the session, prefix of its images and partition of its items.
+    session_id: int
+        ID of the session in the API, None if the API could not be reached.
+    state: str
+        RUNNING, STOPPING while the last frames are saved, or FINISHED.
+    captured: int
+        Number of frames captured.
+    metrics: Metrics
+        What the threads of the session recorded, on top of the metrics of the daemon.
+    """
+
+    def __init__(self, streamer, source, fps_cap=None, segments=False):
+        """
+        Parameters
+        ----------
+        streamer: StreamerDaemon
+            The daemon whose detectors and clients are used.
+        fps_cap: float
+            Maximum number of frames per second captured, None for no limit. Video files are
+            read at this rate, or at their own frame rate without limit.
+        segments: bool
+            Whether to save the input frames in video segments rather than as JPEG images.
+        """
+        self.streamer = streamer
+        self.source = source
+        self.fps_cap = fps_cap
+        self.session_key = new_session_key()
+        self.session_id = None
+        self.state = RUNNING
+        self.captured = 0
+        self.started = time.time()
+        self.finished = None
+        self.metrics = Metrics()
+
+        self.segments = segments
+        self.publisher = None
+        self.segment_writer = None
+        self.detector = None
+        self.stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'session-{self.session_key}', daemon=True)
+
+    def start(self):
+        """
+        Open the source, create the session in the API and start streaming.
+        Raises a ValueError if the source can't be opened.
+        """
+        try:
+            self.video_capture = cv2.VideoCapture(self.source)
+        except cv2.error as exc:
+            raise ValueError(f'Could not open the source {self.source}: {exc}')
+        if not self.video_capture.isOpened():
+            self.video_capture.release()
+            raise ValueError(f'Could not open the source {self.source}')
+
+        streamer = self.streamer
+        if self.segments:
+            self.segment_writer = SegmentWriter(
+                streamer.uploader, self.session_key, segment_duration=SEGMENT_DURATION
+            )
+        self.session_id = streamer.api.create_session(S3_STORAGE_URL)
+        if self.session_id is not None:
+            self.publisher = IterationPublisher(streamer.api, self.session_id)
+
+        # The detector is only used by the detection thread of this session until it finishes.
+        # Nothing is displayed, only the latest output frame is kept.
+        self.detector = streamer.acquire_detector()
+        self.pipeline = build_pipeline(
+            FaceTracker(detector=self.detector, render=False), ChangeDetector(), streamer.uploader,
+            streamer.writer, self.publisher, queue.Queue(maxsize=1), self.segment_writer,
+            session_key=self.session_key, session_metrics=self.metrics,
+        )
+        self.pipeline.start()
+        self._thread.start()
+
+    def stop(self):
+        """Stop capturing, and wait for the frames already captured to be saved"""
+        self.stopping.set()
+        self._thread.join()
+
+    def status(self):
+        """The live status of the session, JSON serializable"""
+        elapsed = (self.finished or time.time()) - self.started
+        return {
+            'session_key': self.session_key,
+            'session_id': self.session_id,
+            'source': self.source,
+            'state': self.state,
+            'started': self.started,
+            'elapsed_s': round(elapsed, 3),
+            'frames_captured': self.captured,
+            # Frames the detection could not keep up with
+            'frames_dropped': self.pipeline.stages[0].dropped,
+            'fps': round(self.captured / elapsed, 2) if elapsed > 0 else None,
+        }
+
+    def _run(self):
+        video_capture = self.video_capture
+        with metrics.recording_to(self.metrics):
+            try:
+                self._capture(video_capture)
+            except Exception:
+                logger.exception(f'Session {self.session_key}: capture failed')
+            finally:
+                video_capture.release()
+                self._finish()
+
+    def _capture(self, video_capture):
+        for frame in capture_frames(video_capture, self.stopping, self.fps_cap):
+            self.captured += 1
+            self.pipeline.feed({'id': self.captured, 'frame': frame})
+
+    def _finish(self):
+        self.state = STOPPING
+        streamer = self.streamer
+        try:
+            self.pipeline.drain()
+            streamer.release_detector(self.detector)
+            if self.segment_writer is not None:
+                self.segment_writer.close()
+            # The uploader keeps saving the other sessions, only the uploads of this one are waited for
+            streamer.uploader.wait_session(self.session_key)
+            # The items of the session are read back if some of its iterations were not sent
+            streamer.writer.flush()
+            # A session the API could not create is only replayed if it has frames
+            if self.publisher is not None or self.captured:
+                self.session_id = save_session(
+                    streamer.api, streamer.table, self.session_key, self.publisher, self.metrics.summary()
+                )
+        except Exception:
+            logger.exception(f'Session {self.session_key}: failed to save the last frames')
+        self.finished = time.time()
+        self.state = FINISHED
+        logger.info(f'Session {self.session_key} {self.state}: {self.captured} frames captured')
+
+
+class StreamerDaemon:
+    """
+    Keeps the face detectors, the algorithm parameters and the S3, dynamoDB and API clients
+    loaded between sessions, so that starting a session only costs creating it in the API.
+
+    Sessions run concurrently, each one from its own threads, sharing the clients. A detector
+    must not run in several threads at once, so each running session checks one out of a
+    pool of detectors, created as more sessions run at once.
+    """
+
+    def __init__(self, uploader_workers=16):
+        load_algorithm_params()
+        self._detectors = queue.LifoQueue()
+        self._detectors.put(dlib.get_frontal_face_detector())
+        self.uploader = FrameUploader(S3_BUCKET_NAME, endpoint_url=S3_ENDPOINT, workers=uploader_workers)
+        dynamodb = boto3.resource('dynamodb', endpoint_url=DYNAMODB_ENDPOINT)
+        self.table = ensure_table(dynamodb, DYNAMODB_TABLE_NAME)
+        self.writer = BatchWriter(dynamodb, DYNAMODB_TABLE_NAME)
+        self.api = ApiClient()
+        self.started = time.time()
+        # The sessions by key, in the order they started
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start_session(self, source, fps_cap=None, segments=False):
+        """
+        Start streaming a source in a new session.
+        Raises a ValueError if the source can't be opened.
+
+        Returns
+        -------
+        session: StreamSession
+            The session, streaming.
+        """
+        session = StreamSession(self, source, fps_cap, segments)
+        session.start()
+        with self._lock:
+            self.sessions[session.session_key] = session
+            finished = [key for key, other in self.sessions.items() if other.finished is not None]
+            for key in finished[:len(finished) - FINISHED_SESSIONS]:
+                del self.sessions[key]
+        logger.info(f'Session {session.session_key} started on {source}, with ID {session.session_id}')
+        return session
+
+    def acquire_detector(self):
+        """A detector used by no other session, created if every detector is in use"""
+        try:
+            return self._detectors.get_nowait()
+        except queue.Empty:
+            return dlib.get_frontal_face_detector()
+
+    def release_detector(self, detector):
+        """Give back the detector of a finished session, for the next sessions"""
+        self._detectors.put(detector)
+
+    def get_session(self, session_key):
+        with self._lock:
+            return self.sessions.get(session_key)
+
+    def status(self):
+        with self._lock:
+            sessions = list(self.sessions.values())
+        return {
+            'uptime_s': round(time.time() - self.started, 3),
+            'running': sum(session.finished is None for session in sessions),
+            'sessions': [session.status() for session in sessions],
+        }
+
+    def close(self):
+        """Stop every session, then wait for the uploads and the writes"""
+        with self._lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.stop()
+        self.uploader.close()
+        self.writer.close()
+        self.api.close()
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    """
+    - `GET /sessions`: status of the daemon and of its sessions
+    - `POST /sessions` with `{"source": 0, "fps": 10, "segments": false}`: start a session
+    - `GET /sessions/<key>`: status of a session
+    - `POST /sessions/<key>/stop`: stop a session, once its frames are saved
+    """
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['sessions']:
+            self._respond(200, self.server.streamer.status())
+        elif len(parts) == 2 and parts[0] == 'sessions':
+            session = self.server.streamer.get_session(parts[1])
+            if session is None:
+                self._respond(404, {'error': 'Unknown session'})
+            else:
+                self._respond(200, session.status())
+        else:
+            self._respond(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['sessions']:
+            self._start_session()
+        elif len(parts) == 3 and parts[0] == 'sessions' and parts[2] == 'stop':
+            session = self.server.streamer.get_session(parts[1])
+            if session is None:
+                self._respond(404, {'error': 'Unknown session'})
+            else:
+                session.stop()
+                self._respond(200, session.status())
+        else:
+            self._respond(404, {'error': 'Not found'})
+
+    def _start_session(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length).decode() or '{}')
+            source = body['source']
+            fps_cap = float(body['fps']) if body.get('fps') else None
+        except (ValueError, TypeError, KeyError):
+            self._respond(400, {'error': 'Expected a JSON object with a source, and optionally fps and segments'})
+            return
+        # A camera index or a path/URL, anything else makes OpenCV fail
+        if isinstance(source, bool) or not isinstance(source, (int, str)):
+            self._respond(400, {'error': 'The source must be a camera index or a path/URL'})
+            return
+        if isinstance(source, str) and source.isdigit():
+            source = int(source)
+
+        try:
+            session = self.server.streamer.start_session(source, fps_cap, bool(body.get('segments')))
+        except ValueError as exc:
+            self._respond(400, {'error': str(exc)})
+            return
+        self._respond(201, session.status())
+
+    def _respond(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info('Control API: ' + format % args)
+
+
+def run(host=CONTROL_HOST, port=CONTROL_PORT, metrics_port=METRICS_PORT):
+    """
+    Load the detector and the clients, then serve the control API until interrupted
+    with Ctrl+C. The running sessions are stopped and saved before exiting.
+
+    The metrics served on `metrics_port` are the ones of every session together, each
+    session saves its own metrics when it is closed.
+    """
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = MetricsServer(port=metrics_port)
+        metrics_server.start()
+
+    streamer = StreamerDaemon()
+    server = _ThreadingHTTPServer((host, port), _ControlHandler)
+    server.streamer = streamer
+    logger.info(f'Control API served on http://{host}:{port}/sessions')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+    streamer.close()
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Keep the streamer loaded, and start sessions from a local API.')
+    parser.add_argument('--host', default=CONTROL_HOST, help='address of the control API')
+    parser.add_argument('--port', type=int, default=CONTROL_PORT, help='port of the control API')
+    parser.add_argument(
+        '--metrics-port', type=int, default=METRICS_PORT, help='local port of the metrics endpoint, 0 to disable it'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(args.host, args.port, args.metrics_port or None)
@@ -1,94 +1,586 @@
 import cv2
-import time
+import dlib
+import numpy as np
+import queue
 import boto3
-import botocore
-import requests
 import logging
+import argparse
+import threading
+import multiprocessing
+from decimal import Decimal
 
-from src.video import compress
+from src.video import capture_frames, encode_jpeg
 from src.face import FaceTracker, FACE_DETECTED
+from src.motion import ChangeDetector
+from src.segments import SegmentWriter
+from src.ring import FrameRing
+from src.detectors import DetectorProcesses
+from src.s3 import FrameUploader, INPUT_FRAME, DETECTED_FACE
+from src.api import ApiClient, IterationPublisher
+from src.dynamodb import BatchWriter, ensure_table, session_items
+from src.pipeline import Pipeline, Stage, DROP_OLDEST, put_with_policy
+from src.metrics import metrics, MetricsServer, METRICS_PORT
 
 WINDOW_NAME = "Face Window"
 S3_BUCKET_NAME = "testBucket"
 S3_ENDPOINT = "http://localhost:4572"
+# Base URL of the objects of the bucket, the storage of the sessions in the API
+S3_STORAGE_URL = f"{S3_ENDPOINT}/{S3_BUCKET_NAME}"
 DYNAMODB_TABLE_NAME = "testDB"
 DYNAMODB_ENDPOINT = "http://localhost:4569"
 
+# Number of seconds of frames in a video segment, in segments storage
+SEGMENT_DURATION = 10.0
+
+# Sizes of the queues between the stages of the pipeline
+DETECTION_QUEUE_SIZE = 2
+ENCODING_QUEUE_SIZE = 32
+PERSISTENCE_QUEUE_SIZE = 32
+
+# Number of frame slots shared with the detector processes, about 1MB each at 640x480
+RING_SLOTS = 48
+
 logger = logging.getLogger()
 
 
-def save_frame_to_s3_bucket_with_timestamp(frame, bucket, is_output=False):
+def detect_iteration(iteration, face_tracker, change_detector=None, previous=None):
     """
-    Save the frame to s3 bucket with a timestamp in the name of image.
-    This will always save the image as a JPEG file.
+    Run the face tracker on the frame of an iteration, in place.
+
+    If the frame didn't change since the previous detected frame, the detection is
+    skipped: the previous feedback and output frame are reused, and the iteration is
+    recorded as a reference to the previous frame, whose images are not saved again.
 
     Parameters
     ----------
-    frame: np.ndarray
-        CV2 captured frame object
-    bucket: str
-        The name of the bucket we want to access.
-    is_output: bool
-        Boolean to tell if the frame is an output file or not
+    iteration: dict
+        The iteration, with its sequence number as `id` and its frame
+    face_tracker: FaceTracker
+        The detector used on the frame
+    change_detector: ChangeDetector
+        Detects static frames, None to detect every frame
+    previous: dict
+        The `id`, `feedback`, `output_frame`, `bounding_box` and `score` of the previous
+        detected frame. It is updated when the frame is detected.
 
     Returns
     -------
-    path: str
-        The path of image on the S3 bucket.
+    iteration: dict
+        The iteration, with its feedback, output frame, detected face, and the bounding box
+        of the face and its detection score
     """
-    # Create a name for image to be created with a timestamp in it
-    if is_output:
-        image_name = 'output_%s.jpg' % time.strftime('%Y%m%d-%H%M%S')
-    else:
-        image_name = '%s.jpg' % time.strftime('%Y%m%d-%H%M%S')
+    static = change_detector is not None and change_detector.is_static(iteration['frame'])
+    if static and previous:
+        iteration.update(
+            feedback=previous['feedback'],
+            output_frame=previous['output_frame'],
+            detected_face=None,
+            bounding_box=previous['bounding_box'],
+            score=previous['score'],
+            reference_id=previous['id'],
+        )
+        metrics.increment('frames_static')
+        return iteration
+
+    # feedback is the status of face detected and output_frame is the grayframe with text on it
+    with metrics.span('detection'):
+        feedback, output_frame, detected_face = face_tracker.run(iteration['frame'])
+    metrics.increment('frames_detected')
+    iteration.update(
+        feedback=feedback,
+        output_frame=output_frame,
+        detected_face=detected_face,
+        bounding_box=face_tracker.last_bounding_box,
+        score=face_tracker.last_score,
+    )
+    if previous is not None:
+        previous.update(
+            id=iteration['id'],
+            feedback=feedback,
+            output_frame=output_frame,
+            bounding_box=iteration['bounding_box'],
+            score=iteration['score'],
+        )
+    return iteration
+
+
+def detection_attributes(bounding_box, score):
+    """
+    The attributes of the detection saved with an iteration, instead of the output frame.
+    The output frame can be rendered again from the input frame and these attributes.
+
+    Parameters
+    ----------
+    bounding_box: dlib.rectangle
+        The bounding box of the face, None if there is no face
+    score: float
+        The score of the detection of the face
+
+    Returns
+    -------
+    attributes: dict
+        The bounding box as [left, top, right, bottom] and the score, empty if there is no face
+    """
+    if bounding_box is None:
+        return {}
+    attributes = {
+        'bounding_box': [bounding_box.left(), bounding_box.top(), bounding_box.right(), bounding_box.bottom()],
+    }
+    if score is not None:
+        # dynamoDB doesn't accept floats
+        attributes['score'] = Decimal(str(round(score, 4)))
+    return attributes
+
+
+@metrics.timed('encoding')
+def encode_iteration(iteration, encode_input=True):
+    """
+    Encode the frames of a detected iteration as JPEG images, in place.
+
+    Parameters
+    ----------
+    iteration: dict
+        The iteration, with its frame, output frame, feedback and detected face
+    encode_input: bool
+        Whether to encode the input frame. It is kept as is when it is written in a
+        video segment instead.
+
+    Returns
+    -------
+    iteration: dict
+        The iteration, with the images instead of the frames
+    """
+    # The output frame is not saved, it can be rendered again from the input frame
+    # and the bounding box
+    iteration.pop('output_frame')
+    if 'reference_id' in iteration:
+        # The images of the referenced frame are saved already
+        iteration.pop('frame')
+        iteration.pop('detected_face')
+        return iteration
+
+    if encode_input:
+        iteration['input_image'] = encode_jpeg(iteration.pop('frame'))
+    detected_face = iteration.pop('detected_face')
+    iteration['detected_face_image'] = None
+    if iteration['feedback'] == FACE_DETECTED:
+        iteration['detected_face_image'] = encode_jpeg(detected_face)
+    return iteration
+
+
+@metrics.timed('persistence')
+def persist_iteration(iteration, uploader, writer, publisher=None, session_key=None, segment_writer=None):
+    """
+    Save the images of an encoded iteration to S3, without waiting for the uploads,
+    and queue its item for dynamoDB and the API.
+
+    Parameters
+    ----------
+    iteration: dict
+        The encoded iteration, with its sequence number as `id`
+    uploader: FrameUploader
+        The uploader saving the images in the bucket
+    writer: BatchWriter
+        The writer saving the iterations in the dynamoDB table, in batches
+    publisher: IterationPublisher
+        The publisher sending the iterations to the API while the session runs,
+        None if the session could not be created in the API
+    session_key: str
+        Key of the session, defaults to the session of the uploader
+    segment_writer: SegmentWriter
+        The writer saving the input frames in video segments, None to save them
+        as JPEG images
+
+    Returns
+    -------
+    item: dict
+        The item saved in the dynamoDB table
+    """
+    sequence = iteration['id']
+    session_key = session_key or uploader.session_key
+    if 'reference_id' in iteration:
+        return persist_reference(iteration, uploader, writer, publisher, session_key, segment_writer)
+
+    # Save the frames to S3 and get the paths, without waiting for the uploads
+    input_frame_offset = None
+    if segment_writer is not None:
+        frame = iteration.pop('frame')
+        try:
+            input_frame_path, input_frame_offset = segment_writer.write(frame, sequence)
+        except OSError as exc:
+            # The frame is saved as a JPEG image rather than lost
+            logger.error(f'Failed to write frame {sequence} in a segment: {exc}')
+            metrics.increment('segment_errors')
+            iteration['input_image'] = encode_jpeg(frame)
+    if input_frame_offset is None:
+        input_frame_path = uploader.upload(iteration['input_image'], sequence, INPUT_FRAME, session_key).key
+
+    detected_face_path = 'empty_image'
+    # If there is a face detected, save the detected face image to S3 and get the path
+    if iteration['detected_face_image'] is not None:
+        detected_face_path = uploader.upload(
+            iteration['detected_face_image'], sequence, DETECTED_FACE, session_key
+        ).key
+
+    item = {
+        'session_key': session_key,
+        'sequence': sequence,
+        'input_frame_path': input_frame_path,
+        'feedback': iteration['feedback'],
+        'detected_face_path': detected_face_path,
+    }
+    if input_frame_offset is not None:
+        item['input_frame_offset'] = input_frame_offset
+    item.update(detection_attributes(iteration['bounding_box'], iteration['score']))
+    # Add data to dynamoDB Table and send it to the API, both with the next batch
+    writer.put(item)
+    if publisher is not None:
+        publisher.put(iteration_from_item(publisher.session_id, item))
+    return item
+
+
+def persist_reference(iteration, uploader, writer, publisher, session_key, segment_writer=None):
+    """
+    Queue the item of an iteration referencing a previous frame for dynamoDB and the API.
+    Its paths are the ones of the referenced frame, nothing is uploaded.
+    """
+    reference_id = iteration['reference_id']
+    detected_face_path = 'empty_image'
+    if iteration['feedback'] == FACE_DETECTED:
+        detected_face_path = uploader.object_key(reference_id, DETECTED_FACE, session_key)
+
+    item = {
+        'session_key': session_key,
+        'sequence': iteration['id'],
+        'input_frame_path': uploader.object_key(reference_id, INPUT_FRAME, session_key),
+        'feedback': iteration['feedback'],
+        'detected_face_path': detected_face_path,
+        'reference_sequence': reference_id,
+    }
+    # The referenced frame is saved as a JPEG image if it could not be written in a segment
+    if segment_writer is not None and reference_id in segment_writer.index:
+        item['input_frame_path'], item['input_frame_offset'] = segment_writer.index[reference_id]
+    item.update(detection_attributes(iteration['bounding_box'], iteration['score']))
+    writer.put(item)
+    if publisher is not None:
+        publisher.put(iteration_from_item(publisher.session_id, item))
+    return item
+
+
+def build_pipeline(
+    face_tracker, change_detector, uploader, writer, publisher, display_queue, segment_writer=None,
+    detection_policy=DROP_OLDEST, session_key=None, session_metrics=None,
+):
+    """
+    Build the detection -> encoding -> persistence pipeline fed by the capture loop.
+
+    - Detection drops the oldest frames when it can't keep up with the camera, so it
+      always works on a recent frame and never slows down the capture.
+    - Encoding and persistence apply backpressure: every detected frame is saved, and
+      the bounded queues are the only memory we allow S3/DynamoDB to fall behind by.
+      Images are uploaded in the background by the uploader, so persisting a frame
+      only waits for S3 when too many uploads are pending.
+
+    Parameters
+    ----------
+    face_tracker: FaceTracker
+        The detector used on every frame
+    change_detector: ChangeDetector
+        Detects static frames, whose detection and upload are skipped
+    uploader: FrameUploader
+        The uploader saving the images in the bucket
+    writer: BatchWriter
+        The writer saving the iterations in the dynamoDB table, in batches
+    publisher: IterationPublisher
+        The publisher sending the iterations to the API while the session runs,
+        None if the session could not be created in the API
+    display_queue: queue.Queue
+        Queue of the latest output frame, read by the capture loop to show it
+    segment_writer: SegmentWriter
+        The writer saving the input frames in video segments, None to save them
+        as JPEG images
+    detection_policy: str
+        What to do with new frames when the detection is behind, BLOCK to detect every
+        frame e.g. in benchmarks
+    session_key: str
+        Key of the session, defaults to the session of the uploader, which may be shared
+        by several sessions
+    session_metrics: Metrics
+        Metrics of the session, recording the detection and the saving of its frames on
+        top of the metrics of the process, None if the process runs only this session
+
+    Returns
+    -------
+    pipeline: Pipeline
+        The pipeline, not started yet
+    """
+    # The previous detected frame, reused for static frames
+    previous = {}
+
+    def detect(iteration):
+        with metrics.recording_to(session_metrics):
+            detect_iteration(iteration, face_tracker, change_detector, previous)
+        put_with_policy(display_queue, iteration['output_frame'], DROP_OLDEST)
+        return iteration
+
+    detection = Stage('detection', detect, maxsize=DETECTION_QUEUE_SIZE, policy=detection_policy)
+    saving_stages = build_saving_stages(
+        uploader, writer, publisher, segment_writer, session_key=session_key, session_metrics=session_metrics
+    )
+    detection.connect(saving_stages[0])
+
+    return Pipeline([detection] + saving_stages)
+
+
+def build_saving_stages(
+    uploader, writer, publisher, segment_writer=None, on_saved=None, session_key=None, session_metrics=None,
+):
+    """
+    Build the encoding -> persistence stages saving the detected iterations.
+
+    Parameters
+    ----------
+    on_saved: callable
+        Called with every iteration once it is saved, or failed to be, e.g. to release
+        the memory of its frame. None if there is nothing to do.
+    session_key: str
+        Key of the session, defaults to the session of the uploader
+    session_metrics: Metrics
+        Metrics of the session, see `build_pipeline`
+
+    Returns
+    -------
+    stages: list of Stage
+        The encoding and persistence stages, connected, not started yet
+    """
+    def encode(iteration):
+        try:
+            with metrics.recording_to(session_metrics):
+                # The video segments encode the input frames themselves
+                return encode_iteration(iteration, encode_input=segment_writer is None)
+        except Exception:
+            if on_saved is not None:
+                on_saved(iteration)
+            raise
+
+    def persist(iteration):
+        try:
+            with metrics.recording_to(session_metrics):
+                # Segments are written in order as there is only one persistence worker
+                persist_iteration(iteration, uploader, writer, publisher, session_key, segment_writer)
+        finally:
+            if on_saved is not None:
+                on_saved(iteration)
+
+    encoding = Stage('encoding', encode, maxsize=ENCODING_QUEUE_SIZE)
+    persistence = encoding.connect(Stage('persistence', persist, maxsize=PERSISTENCE_QUEUE_SIZE))
+    return [encoding, persistence]
+
+
+def capture_to_ring(video_capture, ring, sequence, frame=None):
+    """
+    Read the next frame of the camera directly in a free slot of the ring, and publish it
+    to the detector processes.
+
+    Parameters
+    ----------
+    frame: numpy.ndarray
+        A frame already read from the camera, copied in the slot instead of reading one.
+
+    Returns
+    -------
+    ret: bool
+        False once the camera has no more frames
+    """
+    slot = ring.acquire()
+    if slot is None:
+        # Every slot is in use: drop the frame, but keep the camera buffer fresh
+        metrics.increment('ring_overruns')
+        return video_capture.grab()
+
+    slot_frame = ring.frame(slot)
+    with metrics.span('capture'):
+        if frame is None:
+            ret, frame = video_capture.read(slot_frame)
+        else:
+            ret = True
+    if not ret:
+        ring.release(slot)
+        return False
+    # OpenCV only decodes in the given array if it has the shape of the frame, it returns
+    # a new array otherwise
+    if not np.shares_memory(frame, slot_frame):
+        if frame.shape != slot_frame.shape:
+            ring.release(slot)
+            raise RuntimeError(f'The camera frames changed from {slot_frame.shape} to {frame.shape}')
+        slot_frame[...] = frame
+    metrics.increment('frames_captured')
+    ring.publish(slot, sequence)
+    return True
+
+
+def collect_detections(detectors, pipeline, display_queue):
+    """
+    Turn the results of the detector processes into iterations and feed them to the
+    saving pipeline, until the processes are stopped.
 
-    # Convert the frame image to string. This is dirty but useful as we don't
-    # need to save the image on local disk
-    image_string = cv2.imencode('.jpg', frame)[1].tostring()
+    The iterations keep the frame as a view on its slot of the ring. The slot is released
+    once the iteration is saved.
+    """
+    ring = detectors.ring
+    for slot, sequence, feedback, box, score in detectors.iter_results():
+        frame = ring.frame(slot)
+        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        bounding_box = dlib.rectangle(*box) if box is not None else None
+        iteration = {
+            'id': sequence,
+            'slot': slot,
+            'frame': frame,
+            'feedback': feedback,
+            'output_frame': FaceTracker.render(gray_frame, feedback, bounding_box),
+            'detected_face': FaceTracker.crop_face(gray_frame, bounding_box) if bounding_box is not None else None,
+            'bounding_box': bounding_box,
+            'score': score,
+        }
+        put_with_policy(display_queue, iteration['output_frame'], DROP_OLDEST)
+        pipeline.feed(iteration)
 
-    # Put the image and the body of image on the designated path
-    bucket.put_object(Key=image_name, Body=image_string)
 
-    return image_name
+def iteration_from_item(session_id, item):
+    """
+    Build the data of a stream iteration for the API from a dynamoDB item.
+
+    Parameters
+    ----------
+    session_id: int
+        The ID of the stream session
+    item: dict
+        The dynamoDB item of the iteration
+
+    Returns
+    -------
+    data: dict
+        The stream iteration data
+    """
+    # The images are given by their keys in the storage of the session. There is no
+    # detected face image when no face is detected.
+    detected_face_key = None
+    if item['feedback'] == FACE_DETECTED:
+        detected_face_key = item['detected_face_path']
+
+    data = {
+        'session': session_id,
+        'sequence': int(item['sequence']),
+        'feedback': item['feedback'],
+        'input_frame_key': item['input_frame_path'],
+        'detected_face_key': detected_face_key,
+    }
+    if 'bounding_box' in item:
+        data['box_left'], data['box_top'], data['box_right'], data['box_bottom'] = (
+            int(coordinate) for coordinate in item['bounding_box']
+        )
+    if 'score' in item:
+        data['score'] = float(item['score'])
+    if 'input_frame_offset' in item:
+        data['input_frame_offset'] = int(item['input_frame_offset'])
+    return data
+
+
+def replay_session(api, table, session_key):
+    """
+    Save a session in the API from the dynamoDB table, e.g. when the API was not reachable
+    while it ran. Its items are read back in frame order from the partition of the session,
+    with a paginated query, so long sessions are read completely.
 
+    Returns
+    -------
+    session_id: int
+        The ID of the session created in the API, None if it could not be created.
+    """
+    session_id = api.create_session(S3_STORAGE_URL)
+    if session_id is not None:
+        with metrics.span('api_replay'):
+            api.create_iterations(
+                session_id, (iteration_from_item(session_id, item) for item in session_items(table, session_key))
+            )
+    return session_id
+
+
+def close_published_session(api, table, session_key, publisher, summary=None):
+    """
+    Send the last iterations of a session published to the API while it ran, send again
+    the ones that failed to be sent from the dynamoDB table, then close the session.
+    The items of the session must be written in the table already.
+
+    Returns
+    -------
+    closed: bool
+        Whether the session was closed in the API.
+    """
+    # Only the last batch of iterations is left to send
+    publisher.close()
+    failed_sequences = publisher.failed_sequences
+    if failed_sequences:
+        with metrics.span('api_replay'):
+            created = api.create_iterations(publisher.session_id, (
+                iteration_from_item(publisher.session_id, item) for item in session_items(table, session_key)
+                if int(item['sequence']) in failed_sequences
+            ))
+        logger.info(f'{created} of the {len(failed_sequences)} iterations which failed to be sent were sent again')
+    return api.close_session(publisher.session_id, summary)
+
+
+def save_session(api, table, session_key, publisher=None, summary=None):
+    """
+    Save a finished session in the API, once its items are written in the dynamoDB table:
+    close the session published while it ran, or replay it from the table if the API was
+    not reachable when it started.
+
+    Returns
+    -------
+    session_id: int
+        The ID of the session in the API, None if it could not be created.
+    """
+    if publisher is not None:
+        close_published_session(api, table, session_key, publisher, summary)
+        return publisher.session_id
+    session_id = replay_session(api, table, session_key)
+    if session_id is not None:
+        api.close_session(session_id, summary)
+    return session_id
 
-def run():
-    # Get the s3 resource
-    s3 = boto3.resource('s3', endpoint_url=S3_ENDPOINT)
-    # Get the bucket.
-    bucket = s3.Bucket(S3_BUCKET_NAME)
+
+def run(segments=False, processes=0, metrics_port=METRICS_PORT):
+    """
+    Stream the webcam until `q` is pressed.
+
+    Parameters
+    ----------
+    segments: bool
+        Whether to save the input frames in video segments rather than as JPEG images
+    processes: int
+        Number of processes running the face detector, 0 to run it in a thread of this
+        process. With detector processes, the frames are shared with them through a
+        ring of shared memory slots, and every frame is detected on its own: there is
+        no tracking, and static frames are detected too.
+    metrics_port: int
+        Local port serving the metrics of the streamer while it runs, None not to serve them.
+        They are saved with the session once it is closed either way.
+    """
+    metrics.reset()
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = MetricsServer(port=metrics_port)
+        metrics_server.start()
+
+    # Uploads the images to the s3 bucket
+    uploader = FrameUploader(S3_BUCKET_NAME, endpoint_url=S3_ENDPOINT)
+    segment_writer = SegmentWriter(uploader, segment_duration=SEGMENT_DURATION) if segments else None
 
     # Get the dynamodb resource
     dynamodb = boto3.resource('dynamodb', endpoint_url=DYNAMODB_ENDPOINT)
-    # Get the table
-    table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-
-    # Delete old dynamoDB table if exists
-    try:
-        table.delete()
-    except botocore.exceptions.ResourceNotFoundException:
-        pass
-
-    # Create new table
-    table = dynamodb.create_table(
-        TableName=DYNAMODB_TABLE_NAME,
-        KeySchema=[
-            {
-                'AttributeName': 'id',
-                'KeyType': 'HASH'
-            },
-        ],
-        AttributeDefinitions=[
-            {
-                'AttributeName': 'id',
-                'AttributeType': 'S'
-            },
-        ],
-        ProvisionedThroughput={
-            'ReadCapacityUnits': 5,
-            'WriteCapacityUnits': 5
-        }
-    )
+    # The table is shared by the sessions, it is only created the first time
+    table = ensure_table(dynamodb, DYNAMODB_TABLE_NAME)
 
     # Counter which we will use as ID
     counter = 1
@@ -97,101 +589,110 @@ def run():
     cv2.namedWindow(WINDOW_NAME)
     # capture the video from the webcam
     video_capture = cv2.VideoCapture(0)
-    face_tracker = FaceTracker()
 
+    # Only the latest output frame is worth showing
+    display_queue = queue.Queue(maxsize=1)
+
+    detectors = None
+    first_frame = None
+    if processes:
+        # The ring is sized from the first frame, as the frame size reported by the camera
+        # may be 0 or wrong. Without a frame, the capture loop stops right away.
+        ret, first_frame = video_capture.read()
+    if first_frame is not None:
+        # The camera writes its frames directly in the shared memory read by the detectors
+        context = multiprocessing.get_context('spawn')
+        ring = FrameRing(RING_SLOTS, first_frame.shape, context=context)
+        detectors = DetectorProcesses(ring, processes, context)
+        detectors.start()
+    # Writes the iterations to the table in batches
+    writer = BatchWriter(dynamodb, DYNAMODB_TABLE_NAME)
+
+    # Create the StreamerSession object now, so its iterations are saved in Postgres while it runs
+    api = ApiClient()
+    session_id = api.create_session(S3_STORAGE_URL)
+    publisher = None
+    if session_id is not None:
+        logger.info(f'Stream session with ID {session_id} created')
+        publisher = IterationPublisher(api, session_id)
+
+    if detectors is None:
+        pipeline = build_pipeline(
+            FaceTracker(), ChangeDetector(), uploader, writer, publisher, display_queue, segment_writer
+        )
+    else:
+        pipeline = Pipeline(build_saving_stages(
+            uploader, writer, publisher, segment_writer, on_saved=lambda iteration: ring.release(iteration['slot'])
+        ))
+        collector = threading.Thread(
+            target=collect_detections, args=(detectors, pipeline, display_queue), name='collector', daemon=True
+        )
+        collector.start()
+    pipeline.start()
+
+    # Frames are read from the camera as it produces them, until `q` is pressed
+    frames = capture_frames(video_capture, threading.Event()) if detectors is None else None
     while True:
-        start_time = time.time()
-        # Get the coloured frame (ndarray) of the video captured
-        ret, frame = video_capture.read()
-        frame = compress(frame, 2)  # to make it run faster
+        if detectors is None:
+            # Get the coloured frame (ndarray) of the video captured
+            frame = next(frames, None)
+            ret = frame is not None
+            if ret:
+                pipeline.feed({'id': counter, 'frame': frame})
+        else:
+            ret = capture_to_ring(video_capture, ring, counter, first_frame)
+            first_frame = None
 
         if not ret:
             break
 
-        # Save the frame to S3 and get the path
-        input_frame_path = save_frame_to_s3_bucket_with_timestamp(frame, bucket)
-
-        # feedback is the status of face detected and output_frame is the grayframe with text on it
-        feedback, output_frame, detected_face = face_tracker.run(frame)
-
-        # Save the output frame to S3 and get the path
-        output_frame_path = save_frame_to_s3_bucket_with_timestamp(output_frame, bucket, True)
-
-        detected_face_path = 'empty_image'
-        # If there is a face detected, save the detected face image to S3 and get the path
-        if feedback == FACE_DETECTED:
-            detected_face_path = save_frame_to_s3_bucket_with_timestamp(detected_face, bucket)
-
-        # show frames
-        cv2.imshow(WINDOW_NAME, output_frame)
-
-        # Add data to dynamoDB Table
-        if detected_face_path:
-            table.put_item(
-                Item={
-                    'id': str(counter),
-                    'input_frame_path': input_frame_path,
-                    'output_frame_path': output_frame_path,
-                    'feedback': feedback,
-                    'detected_face_path': detected_face_path
-                }
-            )
-        else:
-            table.put_item(
-                Item={
-                    'id': str(counter),
-                    'input_frame_path': input_frame_path,
-                    'output_frame_path': output_frame_path,
-                    'feedback': feedback,
-                }
-            )
         # Increase the counter
         counter += 1
 
+        # show frames
+        try:
+            cv2.imshow(WINDOW_NAME, display_queue.get_nowait())
+        except queue.Empty:
+            pass
+
         if cv2.waitKey(1) & 0xFF == ord("q"):
             break
 
-    stop_time = time.time()
+    # Wait for the frames already captured to be detected and saved
+    if detectors is not None:
+        detectors.stop()
+        collector.join()
+    pipeline.drain()
+    if detectors is not None:
+        detectors.join()
+        if ring.overruns:
+            logger.info(f'{ring.overruns} frames dropped, every frame slot was in use')
+    if segment_writer is not None:
+        segment_writer.close()
+    uploader.close()
+    writer.close()
     # Release video_capture if job/streaming is finished
     video_capture.release()
 
-    # Since for every single stream we have a new table, hence all the data in the table
-    # is required to be saved in postgres. In this case, we can use `scan` as we don't
-    # remove or filter anything from results.
-    table_data = table.scan()
-
-    # Send API request to save the data in Postgres
-    # Send POST request to API to create StreamerSession object
-    session_data = {
-        'start_time': start_time,
-        'stop_time': stop_time,
-    }
-    response = requests.post(
-        'http://localhost:8000/api/stream-sessions/',
-        data=session_data
-    )
-
-    # Get the stream session ID if we have successful response
-    if response.status_code == 201:
-        session_id = response.json()['id']
-        logger.info(f'Stream session with ID {session_id} created')
-        # Create new Stream Iteration objects for every iterations using POST request
-        for item in table_data['Items']:
-            # Create the detected face URL. It will be empty string in case no face detected
-            if item['detected_face_path']:
-                detected_face_url = f"{S3_ENDPOINT}/{S3_BUCKET_NAME}/{item['detected_face_path']}"
-            else:
-                detected_face_url = ''
-
-            data = {
-                'session': session_id,
-                'feedback': item['feedback'],
-                'input_frame_url': f"{S3_ENDPOINT}/{S3_BUCKET_NAME}/{item['input_frame_path']}",
-                'output_frame_url': f"{S3_ENDPOINT}/{S3_BUCKET_NAME}/{item['output_frame_path']}",
-                'detected_face_url': detected_face_url,
-            }
-            requests.post('http://localhost:8000/api/stream-iterations/', data=data)
+    # Every data in the table is required to be saved in postgres
+    save_session(api, table, uploader.session_key, publisher, metrics.summary())
+    api.close()
+    if metrics_server is not None:
+        metrics_server.close()
 
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description='Detect faces on the webcam.')
+    parser.add_argument(
+        '--segments', action='store_true', help='save the input frames in video segments instead of JPEG images'
+    )
+    parser.add_argument(
+        '--processes', type=int, default=0, help='number of processes running the face detector, 0 for a thread'
+    )
+    parser.add_argument(
+        '--metrics-port', type=int, default=METRICS_PORT, help='local port of the metrics endpoint, 0 to disable it'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(args.segments, args.processes, args.metrics_port or None)
@@ -0,0 +1,195 @@
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.metrics import metrics
+from src.pipeline import Batcher
+
+API_URL = "http://localhost:8000/api"
+
+logger = logging.getLogger()
+
+
+class ApiClient:
+    """
+    Client of the django API.
+    Every request goes through one `requests.Session`, so the connections are reused.
+
+    Attributes
+    ----------
+    api_url: str
+        Root URL of the API.
+    batch_size: int
+        Maximum number of iterations sent by one bulk request.
+    timeout: float
+        Number of seconds a request waits for the API to connect and then to answer, before
+        failing. A hung API would otherwise block the streamer forever.
+    """
+
+    def __init__(self, api_url=API_URL, batch_size=500, pool_size=4, timeout=10.0):
+        self.api_url = api_url
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def create_session(self, storage_url=None):
+        """
+        Create an open StreamerSession object, started now.
+
+        Parameters
+        ----------
+        storage_url: str
+            Base URL of the storage of the images of the session, which the keys of its
+            iterations are relative to.
+
+        Returns
+        -------
+        session_id: int
+            The ID of the created session, None if it could not be created.
+        """
+        try:
+            response = self.session.post(
+                f'{self.api_url}/stream-sessions/',
+                json={'storage_url': storage_url} if storage_url is not None else None,
+                timeout=self.timeout,
+            )
+        except requests.RequestException as exc:
+            logger.error(f'Failed to create the stream session: {exc}')
+            return None
+        if response.status_code != 201:
+            logger.error(f'Failed to create the stream session: {response.status_code} {response.text}')
+            return None
+        return response.json()['id']
+
+    def close_session(self, session_id, summary=None):
+        """
+        Mark the StreamerSession as finished, now.
+
+        Parameters
+        ----------
+        session_id: int
+            The ID of the session.
+        summary: dict
+            The metrics of the session, see `Metrics.summary`, saved with it.
+
+        Returns
+        -------
+        closed: bool
+            Whether the session was closed. It stays open otherwise, e.g. if the API is down.
+        """
+        try:
+            response = self.session.post(
+                f'{self.api_url}/stream-sessions/{session_id}/close',
+                json={'metrics': summary} if summary is not None else None,
+                timeout=self.timeout,
+            )
+        except requests.RequestException as exc:
+            logger.error(f'Failed to close the stream session {session_id}: {exc}')
+            return False
+        if response.status_code != 200:
+            logger.error(f'Failed to close the stream session {session_id}: {response.status_code} {response.text}')
+            return False
+        return True
+
+    def create_iterations(self, session_id, iterations, on_failed=None):
+        """
+        Create the iterations of a session, sending them in batches.
+
+        Parameters
+        ----------
+        session_id: int
+            The ID of the session the iterations belong to.
+        iterations: iterable of dict
+            The iterations. They are consumed lazily, one batch at a time.
+        on_failed: callable
+            Called with every batch that could not be sent, or that the API failed to save,
+            e.g. to send it again later. Batches whose rows are invalid are not sent again.
+
+        Returns
+        -------
+        created: int
+            The number of iterations created.
+        """
+        created = 0
+        batch = []
+        for iteration in iterations:
+            batch.append(iteration)
+            if len(batch) >= self.batch_size:
+                created += self._post_iterations(session_id, batch, on_failed)
+                batch = []
+        if batch:
+            created += self._post_iterations(session_id, batch, on_failed)
+        return created
+
+    def close(self):
+        self.session.close()
+
+    def _post_iterations(self, session_id, batch, on_failed=None):
+        try:
+            with metrics.span('api_post'):
+                response = self.session.post(
+                    f'{self.api_url}/stream-sessions/{session_id}/iterations/bulk', json=batch,
+                    timeout=self.timeout,
+                )
+        except requests.RequestException as exc:
+            logger.error(f'Failed to send {len(batch)} iterations: {exc}')
+            return self._batch_failed(batch, on_failed)
+        if response.status_code not in (200, 201, 207):
+            logger.error(f'Failed to create {len(batch)} iterations: {response.status_code} {response.text}')
+            # A 400 means that every row is invalid, they would fail again
+            return self._batch_failed(batch, on_failed if response.status_code != 400 else None)
+
+        data = response.json()
+        invalid = 0
+        for result in data['results']:
+            if 'errors' in result:
+                invalid += 1
+                logger.error(f"Iteration {result['index']} of the batch is invalid: {result['errors']}")
+        # Iterations saved by an earlier request, whose response was lost, are neither
+        # published nor failed
+        metrics.increment('iterations_published', data['created'])
+        metrics.increment('iterations_failed', invalid)
+        return data['created']
+
+    @staticmethod
+    def _batch_failed(batch, on_failed):
+        metrics.increment('iterations_failed', len(batch))
+        # The API doesn't create the frames it has already saved, so a batch whose response
+        # was lost can be sent again
+        if on_failed is not None:
+            on_failed(batch)
+        return 0
+
+
+class IterationPublisher(Batcher):
+    """
+    Send the iterations of an open session to the API in micro-batches, while it runs.
+
+    Iterations are sent as soon as a batch is full or the oldest one has waited for
+    `flush_interval` seconds, so closing the session only has to send the last batch.
+    The batches that could not be sent are not retried while the session runs, their
+    iterations are sent again from dynamoDB once it finishes.
+
+    Attributes
+    ----------
+    session_id: int
+        The ID of the session the iterations belong to.
+    failed_sequences: set of int
+        Sequence numbers of the iterations that could not be sent.
+    """
+
+    def __init__(self, api, session_id, batch_size=100, flush_interval=2.0):
+        self.api = api
+        self.session_id = session_id
+        self.failed_sequences = set()
+        super().__init__('api-publisher', self._write_batch, batch_size, flush_interval)
+
+    def _write_batch(self, batch):
+        self.api.create_iterations(self.session_id, batch, on_failed=self._batch_failed)
+
+    def _batch_failed(self, batch):
+        self.failed_sequences.update(iteration['sequence'] for iteration in batch)
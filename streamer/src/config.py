@@ -1,7 +1,14 @@
+import functools
+
 import yaml
 
 
-def get_algorithm_params(key):
+@functools.lru_cache(maxsize=None)
+def load_algorithm_params():
+    """The parameters of every algorithm, read once per process"""
     with open("src/algorithms.yaml", "r") as stream:
-        params = yaml.load(stream)
-        return params[key]
+        return yaml.load(stream)
+
+
+def get_algorithm_params(key):
+    return load_algorithm_params()[key]
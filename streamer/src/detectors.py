@@ -0,0 +1,109 @@
+import logging
+
+import cv2
+
+from src.face import FaceTracker
+
+logger = logging.getLogger()
+
+
+def detect_slots(ring, results):
+    """
+    Run the face detector on the slots of a frame ring, in a detector process, until the
+    ring is closed.
+
+    Frames are read from the shared memory, with no copy. Only the detection results
+    are sent back: the slot is released by the process consuming them, once it is done
+    with the frame.
+    """
+    # The parallelism comes from the processes
+    cv2.setNumThreads(1)
+    # Consecutive frames go to different processes, so every frame is detected on its own
+    face_tracker = FaceTracker(tracking=False, roi_search=False, render=False)
+    while True:
+        slot, sequence = ring.get()
+        if slot is None:
+            break
+
+        bounding_box = None
+        try:
+            feedback, _, _ = face_tracker.run(ring.frame(slot))
+        except Exception:
+            logger.exception(f'Failed to detect frame {sequence}')
+            ring.release(slot)
+            continue
+        if face_tracker.last_bounding_box is not None:
+            box = face_tracker.last_bounding_box
+            bounding_box = (box.left(), box.top(), box.right(), box.bottom())
+        results.put((slot, sequence, feedback, bounding_box, face_tracker.last_score))
+
+    # Tell the consumer this process is done
+    results.put(None)
+
+
+class DetectorProcesses:
+    """
+    A pool of processes running the face detector on the frames of a FrameRing, so that
+    detection uses several cores at live frame rates.
+
+    Results come in the order the detections finish, not in the order of the frames.
+
+    Attributes
+    ----------
+    ring: FrameRing
+        The ring the frames are read from.
+    processes: int
+        Number of detector processes.
+    """
+
+    def __init__(self, ring, processes, context):
+        """
+        Parameters
+        ----------
+        context: multiprocessing context
+            Context the ring was created with.
+        """
+        self.ring = ring
+        self.processes = processes
+        self.results = context.Queue()
+        self._processes = [
+            context.Process(target=detect_slots, args=(ring, self.results), name=f'detector-{i}', daemon=True)
+            for i in range(processes)
+        ]
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+
+    def iter_results(self):
+        """
+        Yield the detection results until every process is done, i.e. after `stop`.
+
+        Yields
+        ------
+        slot: int
+            Index of the slot of the frame, to release once it is not used anymore.
+        sequence: int
+            Sequence number of the frame.
+        feedback: str
+            Feedback of the detection.
+        bounding_box: tuple
+            (left, top, right, bottom) of the face, None if there is no face.
+        score: float
+            Score of the detection of the face, None if there is no face.
+        """
+        running = self.processes
+        while running:
+            result = self.results.get()
+            if result is None:
+                running -= 1
+                continue
+            yield result
+
+    def stop(self):
+        """Stop the processes, once every frame already published is detected"""
+        self.ring.close(self.processes)
+
+    def join(self):
+        for process in self._processes:
+            process.join()
@@ -0,0 +1,254 @@
+import time
+import queue
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+from src.metrics import metrics
+from src.pipeline import Batcher
+
+# Maximum number of items in one `batch_write_item` call, set by DynamoDB
+MAX_BATCH_SIZE = 25
+
+# The items of a session are stored together, ordered by frame sequence number
+TABLE_KEY_SCHEMA = [
+    {'AttributeName': 'session_key', 'KeyType': 'HASH'},
+    {'AttributeName': 'sequence', 'KeyType': 'RANGE'},
+]
+TABLE_ATTRIBUTES = [
+    {'AttributeName': 'session_key', 'AttributeType': 'S'},
+    {'AttributeName': 'sequence', 'AttributeType': 'N'},
+]
+
+logger = logging.getLogger()
+
+# Marks the end of a scan segment in the queue of pages
+_SEGMENT_DONE = object()
+
+
+def ensure_table(dynamodb, table_name, read_capacity=5, write_capacity=5):
+    """
+    Create the table of the iterations if it doesn't exist yet, and wait for it to be active.
+
+    The table is shared by every session, so several streamers may run at once: it is
+    never deleted, and a table created concurrently by another streamer is used as is.
+
+    Parameters
+    ----------
+    dynamodb: dynamodb.ServiceResource
+        The dynamodb resource.
+    table_name: str
+        The name of the table.
+
+    Returns
+    -------
+    table: dynamodb.Table
+        The table, ready to be written to.
+    """
+    table = dynamodb.Table(table_name)
+    try:
+        dynamodb.create_table(
+            TableName=table_name,
+            KeySchema=TABLE_KEY_SCHEMA,
+            AttributeDefinitions=TABLE_ATTRIBUTES,
+            ProvisionedThroughput={
+                'ReadCapacityUnits': read_capacity,
+                'WriteCapacityUnits': write_capacity,
+            },
+        )
+        logger.info(f'Created the dynamoDB table {table_name}')
+    except ClientError as exc:
+        # The table already exists
+        if exc.response['Error']['Code'] != 'ResourceInUseException':
+            raise
+
+    # A new table can't be written to until it is active
+    table.wait_until_exists()
+    if table.key_schema != TABLE_KEY_SCHEMA:
+        raise ValueError(
+            f'The dynamoDB table {table_name} is not keyed by session and sequence, delete it to recreate it'
+        )
+    return table
+
+
+class BatchWriter(Batcher):
+    """
+    Buffer items and write them to a DynamoDB table with `batch_write_item`.
+
+    The buffer is flushed by a background thread as soon as it holds a full batch, or when
+    its oldest item has waited for `flush_interval` seconds. Unprocessed items returned by DynamoDB are
+    retried with a bounded exponential backoff.
+
+    Attributes
+    ----------
+    table_name: str
+        The name of the table the items are written to.
+    written: int
+        Number of items written so far.
+    failed: int
+        Number of items given up on after every retry.
+    """
+
+    def __init__(
+        self, dynamodb, table_name, batch_size=MAX_BATCH_SIZE, flush_interval=1.0,
+        max_attempts=5, base_delay=0.05, max_delay=2.0,
+    ):
+        """
+        Parameters
+        ----------
+        dynamodb: dynamodb.ServiceResource
+            The dynamodb resource, which (de)serializes the items for us.
+        table_name: str
+            The name of the table the items are written to.
+        batch_size: int
+            Number of items flushed at once, at most MAX_BATCH_SIZE.
+        flush_interval: float
+            Maximum number of seconds an item waits in the buffer.
+        """
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.written = 0
+        self.failed = 0
+        super().__init__(
+            f'dynamodb-{table_name}', self._write_batch, min(batch_size, MAX_BATCH_SIZE), flush_interval
+        )
+
+    def _write_batch(self, batch):
+        request_items = {
+            self.table_name: [{'PutRequest': {'Item': item}} for item in batch]
+        }
+        attempt = 1
+        while True:
+            with metrics.span('dynamodb_write'):
+                response = self.dynamodb.batch_write_item(RequestItems=request_items)
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            self.written += len(request_items[self.table_name]) - len(unprocessed)
+            metrics.increment('items_written', len(request_items[self.table_name]) - len(unprocessed))
+            if not unprocessed:
+                return
+
+            if attempt >= self.max_attempts:
+                self.failed += len(unprocessed)
+                metrics.increment('items_failed', len(unprocessed))
+                logger.error(f'Gave up writing {len(unprocessed)} items to {self.table_name}')
+                return
+
+            # Unprocessed items mean the table is throttled, back off before retrying them
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+            time.sleep(random.uniform(delay / 2, delay))
+            request_items = {self.table_name: unprocessed}
+            attempt += 1
+
+
+def _paginate(method, **kwargs):
+    """Call a paginated `scan` or `query` method, yielding the pages in order"""
+    while True:
+        page = method(**kwargs)
+        yield page['Items']
+        if 'LastEvaluatedKey' not in page:
+            return
+        kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+
+def query_items(table, **kwargs):
+    """
+    Yield every item matched by a query, following `LastEvaluatedKey`.
+
+    Parameters
+    ----------
+    table: dynamodb.Table
+        The table to query.
+    kwargs:
+        Arguments of `Table.query`, e.g. `KeyConditionExpression`.
+    """
+    for items in _paginate(table.query, **kwargs):
+        yield from items
+
+
+def session_items(table, session_key, **kwargs):
+    """
+    Yield the items of a session, in frame order, with a query on its partition.
+
+    Parameters
+    ----------
+    table: dynamodb.Table
+        The table of the iterations, see `ensure_table`.
+    session_key: str
+        The key of the session.
+    kwargs:
+        Other arguments of `Table.query`, e.g. `ProjectionExpression`.
+    """
+    return query_items(table, KeyConditionExpression=Key('session_key').eq(session_key), **kwargs)
+
+
+def scan_items(table, segments=1, **kwargs):
+    """
+    Yield every item of a table, following `LastEvaluatedKey`.
+
+    With more than one segment, the segments are scanned in parallel threads and the
+    items are yielded as soon as a page is read, in no particular order.
+
+    Parameters
+    ----------
+    table: dynamodb.Table
+        The table to scan.
+    segments: int
+        Number of segments scanned in parallel.
+    kwargs:
+        Arguments of `Table.scan`, e.g. `FilterExpression`.
+    """
+    if segments <= 1:
+        for items in _paginate(table.scan, **kwargs):
+            yield from items
+        return
+
+    # Resources are not thread safe, so every segment uses its own
+    endpoint_url = table.meta.client.meta.endpoint_url
+    # Bounded so that a slow consumer doesn't make us hold the whole table in memory
+    pages = queue.Queue(maxsize=segments * 2)
+
+    # Set when the consumer stops early, so the segments don't block on a full queue
+    stopped = threading.Event()
+
+    def put_page(page):
+        while not stopped.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def scan_segment(segment):
+        segment_table = boto3.session.Session().resource('dynamodb', endpoint_url=endpoint_url).Table(table.name)
+        try:
+            for items in _paginate(segment_table.scan, Segment=segment, TotalSegments=segments, **kwargs):
+                if not put_page(items):
+                    return
+        finally:
+            put_page(_SEGMENT_DONE)
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        futures = [executor.submit(scan_segment, segment) for segment in range(segments)]
+        try:
+            remaining = segments
+            while remaining:
+                items = pages.get()
+                if items is _SEGMENT_DONE:
+                    remaining -= 1
+                    continue
+                yield from items
+        finally:
+            stopped.set()
+
+        # Raise the error of a failed segment rather than returning partial results
+        for future in futures:
+            future.result()
@@ -1,4 +1,6 @@
 import cv2
+import threading
+import collections
 import numpy as np
 from src.config import get_algorithm_params
 import dlib
@@ -7,19 +9,88 @@ NO_FACE_IN_FRAME = "NO_FACE_IN_FRAME"
 FACE_DETECTED = "FACE_DETECTED"
 FACE_TRACKER = "FACE_TRACKER"
 
+# feedbacks of `run_batch`, stored as their index in this tuple
+FEEDBACKS = (NO_FACE_IN_FRAME, FACE_DETECTED)
+
+# one result of `run_batch` per frame. Frames without a face have a box of -1 and a NaN score.
+BATCH_RESULT_DTYPE = np.dtype([
+    ("feedback", np.uint8),
+    ("left", np.int32),
+    ("top", np.int32),
+    ("right", np.int32),
+    ("bottom", np.int32),
+    ("score", np.float32),
+])
+
 
 class FaceTracker:
-    def __init__(self):
+    """
+    Finds the face closest to the center of the frames.
+
+    In tracking mode, the full detector only runs every `detect_every_n_frames` frames.
+    In between, the face found is followed by a correlation tracker, which is much
+    cheaper. The detector runs again as soon as the tracker loses confidence or the
+    face moves too fast (faster than `valid_speed_distance_to_center` diagonals per
+    frame, averaged over `smooth_on_n_frames` frames).
+
+    In ROI mode, when a face was found in the previous frame, the detector first runs on
+    a window around it. The whole frame is scanned only if the window has no face, or
+    every `full_scan_every_n_frames` frames to catch faces appearing elsewhere.
+
+    The grayscale frame and the downscaled frame given to the detector are kept in
+    buffers reused from one frame to the next, as long as the frame size doesn't change.
+    """
+
+    def __init__(self, tracking=None, roi_search=None, detector=None, render=True):
+        """
+        :param tracking: whether to track the face between detections,
+        defaults to the `tracking` parameter of the algorithm.
+        :param roi_search: whether to search around the previous face first,
+        defaults to the `roi_search` parameter of the algorithm.
+        :param detector: dlib face detector to use, loaded if not given. A detector can be shared
+        by trackers, but it must not run in several threads at once: its results get mixed up.
+        :param render: whether to render the output frame. Without it, `run` returns None
+        as output frame, which saves a copy of the frame when nothing is displayed.
+        """
         self.params = get_algorithm_params(FACE_TRACKER.lower())
+        self.tracking = self.params["tracking"] if tracking is None else tracking
+        self.roi_search = self.params["roi_search"] if roi_search is None else roi_search
+        self.render_output = render
 
         # load dlib detector
-        self.detector = dlib.get_frontal_face_detector()
+        self.detector = detector if detector is not None else dlib.get_frontal_face_detector()
+        # detectors of the threads running `run_batch` detections in parallel
+        self._thread_detectors = threading.local()
+
+        # correlation tracker following the face found by the last detection, if any
+        self.tracker = None
+        self.frames_since_detection = 0
+        # centers of the last tracked bounding boxes, to compute the face speed
+        self.tracked_centers = collections.deque(maxlen=self.params["smooth_on_n_frames"] + 1)
+
+        # bounding box found in the previous frame, if any, and the score of its detection
+        self.last_bounding_box = None
+        self.last_score = None
+        self.frames_since_full_scan = 0
+
+        # buffers reused across frames, reallocated by OpenCV when the frame size changes
+        self._gray_frame = None
+        self._detector_frame = None
+
+    def reset(self):
+        """forget the face tracked, e.g. when a new video starts"""
+        self.tracker = None
+        self.frames_since_detection = 0
+        self.tracked_centers.clear()
+        self.last_bounding_box = None
+        self.last_score = None
+        self.frames_since_full_scan = 0
 
     def run(self, frame):
         # compute the bounding box
         # this algorithm requires grayscale frames
-        gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        return self.compute_bounding_box(gray_frame)
+        self._gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray_frame)
+        return self.compute_bounding_box(self._gray_frame)
 
     def compute_bounding_box(self, gray_frame):
         """
@@ -30,20 +101,36 @@ class FaceTracker:
 
         feedback = NO_FACE_IN_FRAME
 
-        # The second argument is the number of times we will upscale the image (in this case we don't, as
-        # it increase computation time)
-        # The third argument to run is an optional adjustment to the detection threshold,
-        # where a negative value will return more detections and a positive value fewer.
-        candidate_bounding_boxes, scores, idx = self.detector.run(gray_frame, 1, -0.3)
+        best_bounding_box = None
+        if self.tracking:
+            best_bounding_box = self.track(gray_frame)
+
+        if best_bounding_box is None:
+            best_bounding_box = self.detect(gray_frame)
+            if self.tracking:
+                self.start_tracking(gray_frame, best_bounding_box)
 
-        if len(candidate_bounding_boxes) > 0:
+        self.last_bounding_box = best_bounding_box
+        if best_bounding_box is not None:
             feedback = FACE_DETECTED
+        else:
+            self.last_score = None
 
-            # find best bounding box:
-            best_bounding_box = self.find_best_bounding_box(
-                candidate_bounding_boxes, scores, gray_frame
-            )
+        output_frame = None
+        if self.render_output:
+            output_frame = self.render(gray_frame, feedback, best_bounding_box)
+        detected_face = None
+        if feedback == FACE_DETECTED:
+            detected_face = self.crop_face(gray_frame, best_bounding_box)
 
+        return feedback, output_frame, detected_face
+
+    @staticmethod
+    def render(gray_frame, feedback, bounding_box):
+        """
+        renders the output frame: the feedback on top of the frame, and the bounding box of the face
+        :return: the output frame, in RGB
+        """
         color = (0, 255, 0) if feedback == FACE_DETECTED else (0, 0, 255)
         output_frame = cv2.putText(
             cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2RGB),
@@ -55,61 +142,293 @@ class FaceTracker:
             2,
             cv2.LINE_AA,
         )
-
-        detected_face = None
         if feedback == FACE_DETECTED:
             output_frame = cv2.rectangle(
                 output_frame,
-                (best_bounding_box.left(), best_bounding_box.top()),
-                (best_bounding_box.right(), best_bounding_box.bottom()),
+                (bounding_box.left(), bounding_box.top()),
+                (bounding_box.right(), bounding_box.bottom()),
                 (0, 255, 0),
                 1,
             )
-            # Get the detected face, but use the initial gray frame to avoid
-            # having the text on top of the detected face.
-            detected_face = cv2.cvtColor(gray_frame, cv2.COLOR_GRAY2RGB)[
-                            best_bounding_box.top(): best_bounding_box.bottom(),
-                            best_bounding_box.left():best_bounding_box.right()
-                            ]
+        return output_frame
 
-        return feedback, output_frame, detected_face
+    @staticmethod
+    def crop_face(gray_frame, bounding_box):
+        """
+        :return: the face in the bounding box, in RGB. The initial gray frame is used
+        to avoid having the text on top of the detected face. Only the face is converted.
+        """
+        face = gray_frame[bounding_box.top(): bounding_box.bottom(), bounding_box.left():bounding_box.right()]
+        if face.size == 0:
+            return np.empty(face.shape + (3,), face.dtype)
+        return cv2.cvtColor(face, cv2.COLOR_GRAY2RGB)
 
-    def find_best_bounding_box(self, candidate_bounding_boxes, scores, gray_frame):
-        # computes the size of the bounding box diagonal
-        mean_sizes = (
-            np.sum(
-                np.array(
-                    [
-                        [rect.top() - rect.bottom(), rect.left() - rect.right()]
-                        for rect in candidate_bounding_boxes
-                    ]
-                )
-                ** 2,
-                axis=-1,
+    def detect(self, gray_frame):
+        """
+        runs the detector on the frame, first around the previous face in ROI mode
+        :return: the best bounding box, None if there is no face in the frame
+        """
+        height, width = gray_frame.shape[:2]
+
+        if (
+            self.roi_search
+            and self.last_bounding_box is not None
+            and self.frames_since_full_scan < self.params["full_scan_every_n_frames"]
+        ):
+            self.frames_since_full_scan += 1
+            window = self.window_around(self.last_bounding_box, gray_frame)
+            best_bounding_box = self.detect_in_window(gray_frame, window)
+            if best_bounding_box is not None:
+                return best_bounding_box
+
+        self.frames_since_full_scan = 0
+        return self.detect_in_window(gray_frame, dlib.rectangle(0, 0, width - 1, height - 1))
+
+    def window_around(self, bounding_box, gray_frame):
+        """
+        :return: the bounding box expanded by `roi_margin` times its size on each side,
+        inside the frame
+        """
+        height, width = gray_frame.shape[:2]
+        margin_x = int(bounding_box.width() * self.params["roi_margin"])
+        margin_y = int(bounding_box.height() * self.params["roi_margin"])
+        return dlib.rectangle(
+            max(0, bounding_box.left() - margin_x),
+            max(0, bounding_box.top() - margin_y),
+            min(width - 1, bounding_box.right() + margin_x),
+            min(height - 1, bounding_box.bottom() + margin_y),
+        )
+
+    def run_batch(self, frames, executor=None):
+        """
+        runs the detector on a batch of frames, each one on its own: the tracker and the previous
+        face are neither used nor updated.
+        :param frames: the frames, all of the same shape, ideally as one (n, height, width, 3) array
+        :param executor: executor running the detections in parallel, e.g. a ThreadPoolExecutor
+        as dlib releases the GIL while detecting. Each thread of the executor loads its own detector.
+        The detections run one after the other if not given.
+        :return: an array of BATCH_RESULT_DTYPE, with the feedback code, box and score of every frame
+        """
+        return self.detect_batch(self.to_gray_batch(frames), executor)
+
+    @staticmethod
+    def to_gray_batch(frames):
+        """
+        converts a batch of frames to grayscale with one OpenCV call, seeing the batch as one tall frame
+        :return: the gray frames, as one (n, height, width) array
+        """
+        frames = np.ascontiguousarray(frames)
+        count, height, width = frames.shape[:3]
+        gray_frames = cv2.cvtColor(frames.reshape(count * height, width, 3), cv2.COLOR_BGR2GRAY)
+        return gray_frames.reshape(count, height, width)
+
+    def detect_batch(self, gray_frames, executor=None):
+        """
+        runs the detector on every gray frame, then selects the best bounding box of all the frames
+        at once, over the flat array of their candidates
+        :return: an array of BATCH_RESULT_DTYPE, see `run_batch`
+        """
+        count, height, width = gray_frames.shape[:3]
+        window = dlib.rectangle(0, 0, width - 1, height - 1)
+
+        def detect_candidates(gray_frame):
+            if executor is None:
+                return self.detect_candidates(gray_frame, window)
+            # neither the shared buffer nor the detector can be used by concurrent detections
+            return self.detect_candidates(gray_frame, window, reuse_buffer=False, detector=self.thread_detector())
+
+        detections = list((executor.map if executor is not None else map)(detect_candidates, gray_frames))
+
+        results = np.zeros(count, BATCH_RESULT_DTYPE)
+        results["feedback"] = FEEDBACKS.index(NO_FACE_IN_FRAME)
+        for field in ("left", "top", "right", "bottom"):
+            results[field] = -1
+        results["score"] = np.nan
+
+        counts = [len(scores) for _, scores in detections]
+        if not sum(counts):
+            return results
+        boxes = np.concatenate([boxes for boxes, _ in detections])
+        scores = np.concatenate([scores for _, scores in detections])
+        frame_ids = np.repeat(np.arange(count), counts)
+
+        # sort the candidates by frame then distance: the first candidate of each frame is its best
+        order = np.lexsort((self.distances_to_center(boxes, gray_frames.shape[1:3]), frame_ids))
+        detected_frames, first_candidates = np.unique(frame_ids[order], return_index=True)
+        best = order[first_candidates]
+
+        results["feedback"][detected_frames] = FEEDBACKS.index(FACE_DETECTED)
+        for column, field in enumerate(("left", "top", "right", "bottom")):
+            results[field][detected_frames] = boxes[best, column]
+        results["score"][detected_frames] = scores[best]
+        return results
+
+    def thread_detector(self):
+        """
+        :return: the detector of the calling thread, loaded on its first detection
+        """
+        detector = getattr(self._thread_detectors, "detector", None)
+        if detector is None:
+            detector = self._thread_detectors.detector = dlib.get_frontal_face_detector()
+        return detector
+
+    @staticmethod
+    def rectangle_of(result):
+        """
+        :param result: the result of a frame in `run_batch`
+        :return: the bounding box of the result, None if there is no face
+        """
+        if FEEDBACKS[result["feedback"]] != FACE_DETECTED:
+            return None
+        return dlib.rectangle(int(result["left"]), int(result["top"]), int(result["right"]), int(result["bottom"]))
+
+    def detect_in_window(self, gray_frame, window):
+        """
+        runs the full detector on a window of the frame, see `detect_candidates`
+        :return: the best bounding box in the frame coordinates, None if there is no face in the window
+        """
+        boxes, scores = self.detect_candidates(gray_frame, window)
+        if len(boxes) == 0:
+            return None
+
+        # find best bounding box, with respect to the center of the whole frame
+        return self.find_best_bounding_box(boxes, scores, gray_frame)
+
+    def detect_candidates(self, gray_frame, window, reuse_buffer=True, detector=None):
+        """
+        runs the full detector on a window of the frame, downscaled so that its largest side is
+        at most `max_size_face_detector`. This makes the cost of a detection independent of the
+        camera resolution.
+        :param reuse_buffer: whether to downscale the window in the buffer of the tracker
+        :param detector: detector to run, defaults to the detector of the tracker
+        :return: the candidate bounding boxes in the frame coordinates, as an array of
+        (left, top, right, bottom) rows, and their scores
+        """
+        window_frame = gray_frame[window.top():window.bottom() + 1, window.left():window.right() + 1]
+        window_height, window_width = window_frame.shape[:2]
+        scale = min(1.0, self.params["max_size_face_detector"] / max(window_height, window_width))
+        if scale < 1.0:
+            window_frame = cv2.resize(
+                window_frame,
+                (int(window_width * scale), int(window_height * scale)),
+                dst=self._detector_frame if reuse_buffer else None,
+                interpolation=cv2.INTER_AREA,
             )
-            ** 0.5
+            if reuse_buffer:
+                self._detector_frame = window_frame
+
+        # The second argument is the number of times we will upscale the image. Upscaling finds smaller
+        # faces, but each time it increases the computation time about four times.
+        # The third argument to run is an optional adjustment to the detection threshold,
+        # where a negative value will return more detections and a positive value fewer.
+        detector = detector if detector is not None else self.detector
+        candidate_bounding_boxes, scores, idx = detector.run(
+            window_frame,
+            self.params["detector_upsample_num_times"],
+            self.params["detector_adjust_threshold"],
         )
 
-        # computes the position of the middle of bounding boxes with respect to the middle of the image
-        mean_points = np.array(
-            [
-                [(rect.top() + rect.bottom()) / 2.0, (rect.left() + rect.right()) / 2.0]
-                for rect in candidate_bounding_boxes
-            ]
-        ) - np.array([gray_frame.shape[0] / 2.0, gray_frame.shape[1] / 2.0])
+        # map the bounding boxes back to the frame, keeping them inside for cropping
+        height, width = gray_frame.shape[:2]
+        boxes = self.boxes_array(candidate_bounding_boxes)
+        boxes = (boxes / scale).astype(int) + (window.left(), window.top(), window.left(), window.top())
+        np.clip(boxes, 0, (width - 1, height - 1, width - 1, height - 1), out=boxes)
+        return boxes, np.array(scores, dtype=float).reshape(-1)
+
+    def start_tracking(self, gray_frame, bounding_box):
+        """
+        starts following the bounding box found by the detector,
+        stops tracking if there is no bounding box
+        """
+        self.frames_since_detection = 0
+        self.tracked_centers.clear()
+        if bounding_box is None:
+            self.tracker = None
+            return
+
+        self.tracker = dlib.correlation_tracker()
+        self.tracker.start_track(gray_frame, bounding_box)
+        self.tracked_centers.append(self.center_of(bounding_box))
+
+    def track(self, gray_frame):
+        """
+        follows the face with the correlation tracker
+        :return: the tracked bounding box, None if the detector has to run again
+        """
+        if self.tracker is None or self.frames_since_detection >= self.params["detect_every_n_frames"]:
+            return None
+
+        confidence = self.tracker.update(gray_frame)
+        if confidence < self.params["min_tracking_confidence"]:
+            return None
 
-        # computes the distances to center, divided by the bounding box diagonal
-        prop_dist = np.sum(mean_points ** 2, axis=-1) ** 0.5 / mean_sizes
+        position = self.tracker.get_position()
+        # the tracker may drift out of the frame, keep the box inside for cropping
+        height, width = gray_frame.shape[:2]
+        bounding_box = dlib.rectangle(
+            max(0, int(round(position.left()))),
+            max(0, int(round(position.top()))),
+            min(width - 1, int(round(position.right()))),
+            min(height - 1, int(round(position.bottom()))),
+        )
+        if bounding_box.is_empty():
+            return None
+
+        # the face moves too fast for the tracker to be trusted
+        self.tracked_centers.append(self.center_of(bounding_box))
+        if len(self.tracked_centers) == self.tracked_centers.maxlen:
+            diagonal = np.hypot(bounding_box.width(), bounding_box.height())
+            distance = np.hypot(*np.subtract(self.tracked_centers[-1], self.tracked_centers[0]))
+            speed = distance / (len(self.tracked_centers) - 1) / diagonal
+            if speed > self.params["valid_speed_distance_to_center"]:
+                return None
+
+        self.frames_since_detection += 1
+        return bounding_box
 
+    @staticmethod
+    def center_of(bounding_box):
+        return (
+            (bounding_box.top() + bounding_box.bottom()) / 2.0,
+            (bounding_box.left() + bounding_box.right()) / 2.0,
+        )
+
+    @staticmethod
+    def boxes_array(rectangles):
+        """
+        :return: the dlib rectangles as an array of (left, top, right, bottom) rows
+        """
+        return np.array(
+            [(rect.left(), rect.top(), rect.right(), rect.bottom()) for rect in rectangles], dtype=int
+        ).reshape(-1, 4)
+
+    def find_best_bounding_box(self, boxes, scores, gray_frame):
+        """
+        :param boxes: the candidate bounding boxes, as an array of (left, top, right, bottom) rows
+        :param scores: the detection scores of the candidates
+        :return: the bounding box closest to the center of the frame, relative to its size
+        """
         # gets the closer bounding box to the center
-        best_bounding_box_id = np.argmin(prop_dist)
+        best_bounding_box_id = np.argmin(self.distances_to_center(boxes, gray_frame.shape[:2]))
+        # a tracked bounding box keeps the score of the detection it comes from
+        self.last_score = float(scores[best_bounding_box_id])
 
         # compute best bounding box
-        best_bounding_box = dlib.rectangle(
-            int(candidate_bounding_boxes[best_bounding_box_id].left()),
-            int(candidate_bounding_boxes[best_bounding_box_id].top()),
-            int(candidate_bounding_boxes[best_bounding_box_id].right()),
-            int(candidate_bounding_boxes[best_bounding_box_id].bottom()),
-        )
+        return dlib.rectangle(*(int(coordinate) for coordinate in boxes[best_bounding_box_id]))
 
-        return best_bounding_box
+    @staticmethod
+    def distances_to_center(boxes, frame_shape):
+        """
+        :param boxes: bounding boxes, as an array of (left, top, right, bottom) rows
+        :param frame_shape: (height, width) of the frame
+        :return: the distances of the boxes to the center of the frame, divided by their diagonal
+        """
+        # computes the size of the bounding box diagonal
+        mean_sizes = np.hypot(boxes[:, 3] - boxes[:, 1], boxes[:, 2] - boxes[:, 0])
+
+        # computes the position of the middle of bounding boxes with respect to the middle of the image
+        distances = np.hypot(
+            (boxes[:, 1] + boxes[:, 3]) / 2.0 - frame_shape[0] / 2.0,
+            (boxes[:, 0] + boxes[:, 2]) / 2.0 - frame_shape[1] / 2.0,
+        )
+        return distances / mean_sizes
@@ -0,0 +1,251 @@
+import json
+import time
+import bisect
+import logging
+import functools
+import threading
+import contextlib
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9100
+
+logger = logging.getLogger()
+
+
+class Histogram:
+    """
+    Counts of observed durations in fixed buckets, cheap enough to record every frame.
+
+    Attributes
+    ----------
+    buckets: tuple of float
+        Upper bounds of the buckets, in seconds. A last bucket holds the slower durations.
+    count: int
+        Number of durations observed.
+    sum: float
+        Sum of the durations observed, in seconds.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        """
+        Estimate of a percentile: the upper bound of the bucket holding it, at most the
+        slowest duration observed. None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        cumulated = 0
+        for index, count in enumerate(self.counts):
+            cumulated += count
+            if cumulated >= rank and count:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self):
+        """The count, mean, percentiles and max of the durations, in milliseconds"""
+        def milliseconds(seconds):
+            return None if seconds is None else round(seconds * 1000, 3)
+
+        return {
+            'count': self.count,
+            'mean_ms': milliseconds(self.sum / self.count if self.count else None),
+            'p50_ms': milliseconds(self.percentile(50)),
+            'p95_ms': milliseconds(self.percentile(95)),
+            'p99_ms': milliseconds(self.percentile(99)),
+            'max_ms': milliseconds(self.max if self.count else None),
+        }
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the stages of the streamer, shared by its threads.
+
+    Stages are timed with `span`, e.g. `with metrics.span('encoding'): ...`, and events
+    are counted with `increment`, e.g. `metrics.increment('frames_captured')`.
+
+    When several sessions run in one process, what the threads of a session record is
+    also recorded in the metrics of the session, see `recording_to`.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        session_metrics = self.session_metrics
+        if session_metrics is not None:
+            session_metrics.increment(name, value)
+
+    def observe(self, name, seconds):
+        """Record the duration of one run of a stage"""
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+        session_metrics = self.session_metrics
+        if session_metrics is not None:
+            session_metrics.observe(name, seconds)
+
+    @property
+    def session_metrics(self):
+        """The metrics the current thread also records in, None if there are none"""
+        return getattr(self._local, 'session_metrics', None)
+
+    @contextlib.contextmanager
+    def recording_to(self, session_metrics):
+        """
+        Also record what the current thread records during the block in `session_metrics`,
+        e.g. the metrics of the session the thread works for. None records nothing more.
+        """
+        previous = self.session_metrics
+        self._local.session_metrics = session_metrics
+        try:
+            yield
+        finally:
+            self._local.session_metrics = previous
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time the block as one run of the stage `name`, even if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """Decorator timing every call of the function as one run of the stage `name`"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        """Forget everything recorded, e.g. when a new session starts"""
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+
+    def summary(self):
+        """
+        Returns
+        -------
+        summary: dict
+            The counters and the latency summary of every stage, JSON serializable.
+        """
+        with self._lock:
+            return {
+                'duration_s': round(time.time() - self.started, 3),
+                'counters': dict(self.counters),
+                'latencies': {name: histogram.summary() for name, histogram in self.histograms.items()},
+            }
+
+    def exposition(self):
+        """
+        Returns
+        -------
+        text: str
+            The metrics in the Prometheus text format.
+        """
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'# TYPE streamer_{name}_total counter')
+                lines.append(f'streamer_{name}_total {value}')
+
+            for name, histogram in sorted(self.histograms.items()):
+                metric = f'streamer_{name}_seconds'
+                lines.append(f'# TYPE {metric} histogram')
+                cumulated = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulated += count
+                    lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulated}')
+                lines.append(f'{metric}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum {histogram.sum}')
+                lines.append(f'{metric}_count {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+# The metrics of this process, recorded by every stage
+metrics = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._respond(self.server.metrics.exposition(), 'text/plain; version=0.0.4')
+        elif self.path == '/metrics.json':
+            self._respond(json.dumps(self.server.metrics.summary()), 'application/json')
+        else:
+            self.send_error(404)
+
+    def _respond(self, body, content_type):
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are too frequent to be logged
+        pass
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """
+    Serves the metrics on a local HTTP endpoint, from a background thread:
+    `/metrics` in the Prometheus text format, `/metrics.json` as a JSON summary.
+    """
+
+    def __init__(self, metrics=metrics, host=METRICS_HOST, port=METRICS_PORT):
+        self.server = _ThreadingHTTPServer((host, port), _MetricsHandler)
+        self.server.metrics = metrics
+        self._thread = threading.Thread(target=self.server.serve_forever, name='metrics-server', daemon=True)
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def start(self):
+        self._thread.start()
+        logger.info('Metrics served on http://%s:%s/metrics' % self.address)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
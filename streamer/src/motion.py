@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+from src.config import get_algorithm_params
+
+CHANGE_DETECTOR = "CHANGE_DETECTOR"
+
+
+class ChangeDetector:
+    """
+    Tells whether a frame changed since the last frame that was processed.
+
+    Frames are compared on a small grayscale thumbnail: the mean absolute difference of
+    the thumbnails is much cheaper than a detection, and ignores the sensor noise.
+    The reference thumbnail is only replaced when a frame changed, so slow changes add
+    up until they are detected.
+    """
+
+    def __init__(self):
+        self.params = get_algorithm_params(CHANGE_DETECTOR.lower())
+        self.reference = None
+        self.static_frames = 0
+
+    def reset(self):
+        self.reference = None
+        self.static_frames = 0
+
+    def thumbnail(self, frame):
+        """
+        downsampled grayscale copy of the frame, as signed integers to compute differences
+        """
+        width = self.params["thumbnail_width"]
+        height = max(1, frame.shape[0] * width // frame.shape[1])
+        thumbnail = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        if thumbnail.ndim == 3:
+            thumbnail = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+        return thumbnail.astype(np.int16)
+
+    def is_static(self, frame):
+        """
+        :return: True if the frame is the same as the reference frame, in which case
+        the result of the reference frame can be reused. After `max_static_frames` static
+        frames in a row, the frame is processed anyway.
+        """
+        thumbnail = self.thumbnail(frame)
+        if (
+            self.reference is not None
+            and self.reference.shape == thumbnail.shape
+            and self.static_frames < self.params["max_static_frames"]
+            and np.mean(np.abs(thumbnail - self.reference)) < self.params["threshold"]
+        ):
+            self.static_frames += 1
+            return True
+
+        self.reference = thumbnail
+        self.static_frames = 0
+        return False
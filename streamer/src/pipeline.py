@@ -0,0 +1,244 @@
+import time
+import queue
+import logging
+import threading
+
+from src.metrics import metrics
+
+# What to do when a stage's inbound queue is full
+BLOCK = "BLOCK"  # wait for room, i.e. propagate backpressure upstream
+DROP_NEWEST = "DROP_NEWEST"  # discard the item being put
+DROP_OLDEST = "DROP_OLDEST"  # discard the oldest queued item to make room
+
+# Sentinel put on a stage queue once its upstream is finished
+END_OF_STREAM = object()
+
+logger = logging.getLogger()
+
+
+def put_with_policy(bounded_queue, item, policy):
+    """
+    Put an item on a bounded queue, applying a drop policy if it is full.
+
+    Parameters
+    ----------
+    bounded_queue: queue.Queue
+        The queue to put the item on.
+    item: object
+        The item to put.
+    policy: str
+        One of BLOCK, DROP_NEWEST or DROP_OLDEST.
+
+    Returns
+    -------
+    dropped: int
+        The number of items dropped to apply the policy (0 or 1).
+    """
+    if policy == BLOCK:
+        bounded_queue.put(item)
+        return 0
+
+    if policy == DROP_NEWEST:
+        try:
+            bounded_queue.put_nowait(item)
+            return 0
+        except queue.Full:
+            return 1
+
+    dropped = 0
+    while True:
+        try:
+            bounded_queue.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                bounded_queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class Stage:
+    """
+    A pipeline stage: worker threads applying `func` to the items of a bounded queue.
+
+    The result of `func` is put on every connected downstream stage. A `None` result
+    is not forwarded, which lets a stage filter items out.
+
+    Attributes
+    ----------
+    name: str
+        Name of the stage, used for the worker threads and in logs.
+    maxsize: int
+        Size of the inbound queue.
+    policy: str
+        Drop policy applied when the inbound queue is full.
+    dropped: int
+        Number of items dropped by the drop policy.
+    """
+
+    def __init__(self, name, func, maxsize=8, workers=1, policy=BLOCK):
+        self.name = name
+        self.func = func
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.inbox = queue.Queue(maxsize)
+        self.outputs = []
+        self._workers = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        self._lock = threading.Lock()
+
+    def connect(self, stage):
+        """Forward the results of this stage to `stage`"""
+        self.outputs.append(stage)
+        return stage
+
+    def put(self, item):
+        dropped = put_with_policy(self.inbox, item, self.policy)
+        if dropped:
+            with self._lock:
+                self.dropped += dropped
+            metrics.increment(f'{self.name}_dropped', dropped)
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def close(self):
+        """Signal the end of the stream. Items already queued are still processed."""
+        for _ in self._workers:
+            # Never drop the sentinel, whatever the policy
+            self.inbox.put(END_OF_STREAM)
+
+    def join(self):
+        for worker in self._workers:
+            worker.join()
+
+    def _work(self):
+        while True:
+            item = self.inbox.get()
+            if item is END_OF_STREAM:
+                break
+
+            try:
+                result = self.func(item)
+            except Exception:
+                # A failing item must not stop the stream
+                logger.exception(f"Stage {self.name} failed to process an item")
+                continue
+
+            if result is None:
+                continue
+            for stage in self.outputs:
+                stage.put(result)
+
+
+class Pipeline:
+    """
+    A chain of stages joined by bounded queues.
+
+    Stages must be given in topological order (upstream stages first), so that
+    draining closes a stage only once everything feeding it has finished.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def feed(self, item):
+        """Put an item on the first stage"""
+        self.stages[0].put(item)
+
+    def drain(self):
+        """Process every queued item then stop all the workers"""
+        for stage in self.stages:
+            stage.close()
+            stage.join()
+            if stage.dropped:
+                logger.info(f"Stage {stage.name} dropped {stage.dropped} items")
+
+
+class Batcher:
+    """
+    Buffer items and hand them to `write_batch` in batches.
+
+    The buffer is flushed by a background thread as soon as it holds a full batch, or when
+    its oldest item has waited for `flush_interval` seconds. `put` never writes, so a slow
+    or hung `write_batch` doesn't block the thread that produces the items.
+
+    Attributes
+    ----------
+    name: str
+        Name of the batcher, used for the flushing thread and in logs.
+    batch_size: int
+        Maximum number of items given to `write_batch` at once.
+    flush_interval: float
+        Maximum number of seconds an item waits in the buffer.
+    """
+
+    def __init__(self, name, write_batch, batch_size, flush_interval=1.0):
+        self.name = name
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._buffer = []
+        self._buffer_since = None
+        # Only one batch is written at a time, which keeps the items in order
+        self._write_lock = threading.Lock()
+        self._buffer_lock = threading.Lock()
+        self._closed = threading.Event()
+        # Set when the buffer holds a full batch, to wake the flushing thread up early
+        self._full = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_periodically, name=f'{name}-flusher', daemon=True)
+        self._flusher.start()
+
+    def put(self, item):
+        """Buffer an item, the flushing thread writes it"""
+        with self._buffer_lock:
+            if not self._buffer:
+                self._buffer_since = time.monotonic()
+            self._buffer.append(item)
+            if len(self._buffer) >= self.batch_size:
+                self._full.set()
+
+    def flush(self):
+        """Write every buffered item"""
+        with self._write_lock:
+            while True:
+                with self._buffer_lock:
+                    batch = self._buffer[:self.batch_size]
+                    del self._buffer[:self.batch_size]
+                    if not self._buffer:
+                        self._buffer_since = None
+                if not batch:
+                    return
+                self.write_batch(batch)
+
+    def close(self):
+        """Stop the periodic flush and write the remaining items"""
+        self._closed.set()
+        self._full.set()
+        self._flusher.join()
+        self.flush()
+
+    def _flush_periodically(self):
+        while not self._closed.is_set():
+            self._full.wait(self.flush_interval / 2)
+            self._full.clear()
+            with self._buffer_lock:
+                due = self._buffer_since is not None and (
+                    len(self._buffer) >= self.batch_size
+                    or time.monotonic() - self._buffer_since >= self.flush_interval
+                )
+            if due:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception(f'Batcher {self.name} failed to flush')
@@ -0,0 +1,123 @@
+import queue
+import multiprocessing
+
+import numpy as np
+
+from src.pipeline import BLOCK, DROP_NEWEST
+
+# Put on the queue of ready slots to stop a reader
+_STOP_SLOT = -1
+
+
+class FrameRing:
+    """
+    A ring of fixed-shape frame slots in shared memory, to pass frames between
+    processes without pickling them.
+
+    The writer acquires a free slot, writes the frame in place (e.g. with
+    `video_capture.read(ring.frame(slot))`, which only decodes in place if the slot has
+    the shape of the frame) and publishes it. A reader gets the index of
+    a ready slot and reads the frame from the shared memory, with no copy. Only slot
+    indexes go through the queues. A slot is only written again once released, so a
+    frame can't change while it is read.
+
+    When every slot is in use, the writer overruns: with the DROP_NEWEST policy the new
+    frame is dropped and counted in `overruns`, with BLOCK the writer waits for a slot.
+
+    Attributes
+    ----------
+    slots: int
+        Number of frame slots.
+    shape: tuple
+        Shape of the frames.
+    policy: str
+        What to do when there is no free slot, DROP_NEWEST or BLOCK.
+    """
+
+    def __init__(self, slots, shape, dtype=np.uint8, policy=DROP_NEWEST, context=None):
+        """
+        Parameters
+        ----------
+        context: multiprocessing context
+            Context of the processes sharing the ring, the default one if not given.
+        """
+        context = context or multiprocessing.get_context()
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.policy = policy
+
+        slot_size = int(np.prod(self.shape)) * self.dtype.itemsize
+        # Raw arrays have no lock: a slot is owned by one process at a time, through the queues
+        self._buffer = context.RawArray('B', slots * slot_size)
+        self._free = context.Queue()
+        self._ready = context.Queue()
+        self._overruns = context.Value('L', 0)
+        for slot in range(slots):
+            self._free.put(slot)
+        self._frames = None
+
+    def __getstate__(self):
+        # The numpy view is rebuilt on the shared buffer by each process
+        state = self.__dict__.copy()
+        state['_frames'] = None
+        return state
+
+    @property
+    def frames(self):
+        """Every slot, as one numpy array on the shared memory"""
+        if self._frames is None:
+            self._frames = np.frombuffer(self._buffer, self.dtype).reshape((self.slots,) + self.shape)
+        return self._frames
+
+    @property
+    def overruns(self):
+        """Number of frames dropped because every slot was in use"""
+        return self._overruns.value
+
+    def frame(self, slot):
+        """The frame of a slot, a view on the shared memory"""
+        return self.frames[slot]
+
+    def acquire(self):
+        """
+        Returns
+        -------
+        slot: int
+            Index of a free slot to write a frame in, None on overrun with DROP_NEWEST.
+        """
+        try:
+            return self._free.get(block=self.policy == BLOCK)
+        except queue.Empty:
+            with self._overruns.get_lock():
+                self._overruns.value += 1
+            return None
+
+    def publish(self, slot, sequence):
+        """Hand a written slot to the readers, with the sequence number of its frame"""
+        self._ready.put((slot, sequence))
+
+    def get(self):
+        """
+        Wait for a published slot.
+
+        Returns
+        -------
+        slot: int
+            Index of the slot, None once the ring is closed.
+        sequence: int
+            Sequence number of the frame of the slot.
+        """
+        slot, sequence = self._ready.get()
+        if slot == _STOP_SLOT:
+            return None, None
+        return slot, sequence
+
+    def release(self, slot):
+        """Hand a slot back to the writer, once its frame is not used anymore"""
+        self._free.put(slot)
+
+    def close(self, readers):
+        """Stop `readers` readers, once they got every slot already published"""
+        for _ in range(readers):
+            self._ready.put((_STOP_SLOT, None))
@@ -0,0 +1,191 @@
+import time
+import uuid
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from src.metrics import metrics
+
+# Kinds of images saved for every frame
+INPUT_FRAME = "input"
+OUTPUT_FRAME = "output"
+DETECTED_FACE = "face"
+
+logger = logging.getLogger()
+
+
+def new_session_key():
+    """
+    Unique prefix for the objects of one streaming session.
+    It starts with a timestamp so that the sessions are listed in order in the bucket.
+    """
+    return '%s-%s' % (time.strftime('%Y%m%d-%H%M%S'), uuid.uuid4().hex[:8])
+
+
+class FrameUploader:
+    """
+    Upload JPEG images to a S3 bucket from a pool of threads.
+
+    All the threads share one boto3 client (clients are thread safe, resources are not)
+    whose connection pool is sized to the number of threads. Each upload is retried
+    with a bounded exponential backoff.
+
+    Attributes
+    ----------
+    bucket_name: str
+        The name of the bucket we want to access.
+    session_key: str
+        Prefix of every key uploaded, unique to the streaming session.
+    failed: int
+        Number of uploads that failed after every retry.
+    """
+
+    def __init__(
+        self, bucket_name, endpoint_url=None, session_key=None, workers=8,
+        max_pending=64, max_attempts=4, base_delay=0.05, max_delay=1.0, client=None,
+    ):
+        """
+        Parameters
+        ----------
+        client: S3.Client
+            The client to upload with, e.g. a stand-in in benchmarks. Created if not given.
+        """
+        self.bucket_name = bucket_name
+        self.session_key = session_key or new_session_key()
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failed = 0
+
+        self.client = client or boto3.client(
+            's3', endpoint_url=endpoint_url,
+            config=Config(max_pool_connections=workers),
+        )
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        # Bound the uploads waiting for a thread, so a slow bucket can't fill the memory
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        # The uploads not finished yet, by session key
+        self._session_uploads = {}
+
+    def object_key(self, sequence, kind, session_key=None):
+        """
+        Key of an image, unique per session, frame sequence number and kind of image.
+
+        Parameters
+        ----------
+        sequence: int
+            Sequence number of the frame in the session.
+        kind: str
+            One of INPUT_FRAME, OUTPUT_FRAME or DETECTED_FACE.
+        session_key: str
+            Prefix of the session, defaults to the session of the uploader.
+        """
+        return f'{session_key or self.session_key}/{sequence:08d}_{kind}.jpg'
+
+    def upload(self, image_string, sequence, kind, session_key=None):
+        """
+        Upload an image in the background.
+        Blocks only if too many uploads are already pending.
+
+        Parameters
+        ----------
+        image_string: bytes
+            JPEG encoded image
+        sequence: int
+            Sequence number of the frame in the session.
+        kind: str
+            One of INPUT_FRAME, OUTPUT_FRAME or DETECTED_FACE.
+        session_key: str
+            Prefix of the session, defaults to the session of the uploader.
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            Future resolving to the key once the image is uploaded. Its `key` attribute
+            is set straight away, so the key can be recorded without waiting.
+        """
+        return self.upload_object(image_string, self.object_key(sequence, kind, session_key))
+
+    def upload_object(self, body, key):
+        """
+        Upload any object in the background, under the given key.
+        Blocks only if too many uploads are already pending.
+
+        Returns
+        -------
+        future: concurrent.futures.Future
+            Future resolving to the key once the object is uploaded, with a `key` attribute.
+        """
+        self._pending.acquire()
+        try:
+            # The upload is recorded in the metrics of the session uploading it, if any
+            future = self._executor.submit(self._put_object, key, body, metrics.session_metrics)
+        except Exception:
+            self._pending.release()
+            raise
+        future.key = key
+        with self._lock:
+            self._session_uploads.setdefault(key.split('/', 1)[0], set()).add(future)
+        future.add_done_callback(self._upload_done)
+        return future
+
+    def wait_session(self, session_key=None):
+        """
+        Wait for the pending uploads of one session, e.g. before closing it while the
+        uploader keeps saving other sessions.
+
+        Parameters
+        ----------
+        session_key: str
+            Prefix of the session, defaults to the session of the uploader.
+        """
+        with self._lock:
+            futures = list(self._session_uploads.get(session_key or self.session_key, ()))
+        wait(futures)
+
+    def close(self):
+        """Wait for every pending upload to finish"""
+        self._executor.shutdown(wait=True)
+
+    def _put_object(self, key, body, session_metrics=None):
+        with metrics.recording_to(session_metrics):
+            return self._put_object_with_retries(key, body)
+
+    def _put_object_with_retries(self, key, body):
+        attempt = 1
+        while True:
+            try:
+                with metrics.span('s3_put'):
+                    self.client.put_object(Bucket=self.bucket_name, Key=key, Body=body)
+                metrics.increment('objects_uploaded')
+                metrics.increment('bytes_uploaded', len(body))
+                return key
+            except (BotoCoreError, ClientError):
+                metrics.increment('s3_put_errors')
+                if attempt >= self.max_attempts:
+                    raise
+                # Exponential backoff with jitter, capped to max_delay
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+                time.sleep(random.uniform(delay / 2, delay))
+                attempt += 1
+
+    def _upload_done(self, future):
+        self._pending.release()
+        session_key = future.key.split('/', 1)[0]
+        with self._lock:
+            session_uploads = self._session_uploads.get(session_key)
+            if session_uploads is not None:
+                session_uploads.discard(future)
+                if not session_uploads:
+                    del self._session_uploads[session_key]
+        if future.exception() is not None:
+            with self._lock:
+                self.failed += 1
+            metrics.increment('uploads_failed')
+            logger.error(f'Failed to upload {future.key}: {future.exception()}')
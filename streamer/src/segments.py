@@ -0,0 +1,109 @@
+import os
+import cv2
+import json
+import time
+import shutil
+import tempfile
+
+
+class SegmentWriter:
+    """
+    Writes the input frames of a session in fixed duration MJPEG video segments,
+    instead of one JPEG object per frame.
+
+    A segment is written to a local file, then uploaded once it is complete. The index
+    maps the sequence number of every frame to its segment key and its offset (frame
+    number) in the segment. It is uploaded with the last segment as `index.json`.
+
+    Attributes
+    ----------
+    session_key: str
+        Key of the session, prefix of the segment keys.
+    index: dict
+        Segment key and offset of every frame written, by sequence number.
+    """
+
+    def __init__(self, uploader, session_key=None, segment_duration=10.0, fps=15.0):
+        """
+        Parameters
+        ----------
+        uploader: FrameUploader
+            The uploader saving the segments in the bucket.
+        session_key: str
+            Key of the session, defaults to the session of the uploader.
+        segment_duration: float
+            Number of seconds of frames written in a segment.
+        fps: float
+            Frame rate written in the segments, only used to play them.
+        """
+        self.uploader = uploader
+        self.session_key = session_key or uploader.session_key
+        self.segment_duration = segment_duration
+        self.fps = fps
+        self.index = {}
+
+        self._directory = tempfile.mkdtemp(prefix='segments-')
+        self._number = 0
+        self._video_writer = None
+        self._path = None
+        self._key = None
+        self._offset = 0
+        self._started = None
+
+    def segment_key(self, number):
+        return f'{self.session_key}/segments/{number:06d}.avi'
+
+    def write(self, frame, sequence):
+        """
+        Append a frame to the current segment, starting a new one if it is complete.
+        Raises an OSError if no segment can be written, e.g. without the MJPEG codec.
+
+        Returns
+        -------
+        segment_key: str
+            Key of the segment of the frame.
+        offset: int
+            Frame number of the frame in the segment.
+        """
+        if self._video_writer is None or time.monotonic() - self._started >= self.segment_duration:
+            self._start_segment(frame)
+
+        self._video_writer.write(frame)
+        entry = (self._key, self._offset)
+        self.index[sequence] = entry
+        self._offset += 1
+        return entry
+
+    def close(self):
+        """Upload the current segment and the index, without waiting for the uploads"""
+        self._finish_segment()
+        index = {sequence: list(entry) for sequence, entry in self.index.items()}
+        self.uploader.upload_object(json.dumps(index).encode(), f'{self.session_key}/segments/index.json')
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _start_segment(self, frame):
+        self._finish_segment()
+        self._number += 1
+        self._key = self.segment_key(self._number)
+        self._path = os.path.join(self._directory, f'{self._number:06d}.avi')
+        height, width = frame.shape[:2]
+        # Every MJPEG frame is a JPEG image, so any frame can be read without the previous ones
+        video_writer = cv2.VideoWriter(
+            self._path, cv2.VideoWriter_fourcc(*'MJPG'), self.fps, (width, height), frame.ndim == 3
+        )
+        # OpenCV doesn't raise when the codec or the file is not available, it writes nothing
+        if not video_writer.isOpened():
+            video_writer.release()
+            raise OSError(f'Could not open the video segment {self._path}')
+        self._video_writer = video_writer
+        self._started = time.monotonic()
+        self._offset = 0
+
+    def _finish_segment(self):
+        if self._video_writer is None:
+            return
+        self._video_writer.release()
+        self._video_writer = None
+        with open(self._path, 'rb') as segment_file:
+            self.uploader.upload_object(segment_file.read(), self._key)
+        os.remove(self._path)
@@ -1,6 +1,10 @@
+import os
+import time
 import numpy as np
 import cv2
 
+from src.metrics import metrics
+
 
 def compress(frame: np.array, compression_factor: float) -> np.array:
     """
@@ -14,3 +18,99 @@ def compress(frame: np.array, compression_factor: float) -> np.array:
     frame = cv2.resize(frame, compressed_shape)
 
     return frame
+
+
+def encode_jpeg(frame: np.array) -> bytes:
+    """
+    Encode a frame as a JPEG image, in memory.
+    This is dirty but useful as we don't need to save the image on local disk
+    """
+    return cv2.imencode('.jpg', frame)[1].tobytes()
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def list_images(directory: str) -> list:
+    """
+    List the images of a directory, sorted by name so that they are read in order.
+    """
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def count_frames(source: str) -> int:
+    """
+    Number of frames of a video file, or of images in a directory.
+    """
+    if os.path.isdir(source):
+        return len(list_images(source))
+
+    video_capture = cv2.VideoCapture(source)
+    try:
+        return int(video_capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        video_capture.release()
+
+
+def read_frames(source: str, start: int, count: int):
+    """
+    Yield `(index, frame)` for `count` frames of a video file or an image directory, from
+    the frame `start`. The index is the position of the frame in the source, from 0: the
+    images that can't be read are skipped without shifting the index of the next ones.
+    """
+    if os.path.isdir(source):
+        for index, path in enumerate(list_images(source)[start:start + count], start=start):
+            frame = cv2.imread(path)
+            if frame is not None:
+                yield index, frame
+        return
+
+    video_capture = cv2.VideoCapture(source)
+    try:
+        video_capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        for index in range(start, start + count):
+            ret, frame = video_capture.read()
+            if not ret:
+                break
+            yield index, frame
+    finally:
+        video_capture.release()
+
+
+def capture_frames(video_capture, stopping, fps_cap=None):
+    """
+    Yield the frames of a camera or a video file, until it has no more frames or `stopping`
+    (a threading.Event) is set.
+
+    A live source produces frames at its own rate: with `fps_cap`, the frames in between
+    are grabbed without being decoded, which is cheap and keeps the camera buffer fresh.
+    A video file would be read as fast as it is decoded, and most of its frames dropped
+    by a consumer only keeping the latest one: none of its frames is skipped, they are
+    paced at `fps_cap`, or at the frame rate of the video.
+    """
+    # Cameras and live streams have no frame count
+    is_file = video_capture.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+    fps = fps_cap or (video_capture.get(cv2.CAP_PROP_FPS) if is_file else None)
+    min_interval = 1.0 / fps if fps and fps > 0 else 0
+    last_frame_time = next_frame_time = time.monotonic()
+    while not stopping.is_set():
+        if not video_capture.grab():
+            return
+        now = time.monotonic()
+        if is_file:
+            if next_frame_time > now and stopping.wait(next_frame_time - now):
+                return
+            next_frame_time = max(next_frame_time, now) + min_interval
+        elif now - last_frame_time < min_interval:
+            continue
+        with metrics.span('capture'):
+            ret, frame = video_capture.retrieve()
+        if not ret:
+            return
+        metrics.increment('frames_captured')
+        last_frame_time = now
+        yield frame
@@ -0,0 +1,273 @@
+import os
+import cv2
+import dlib
+import queue
+import boto3
+import logging
+import argparse
+import threading
+
+from src.face import FaceTracker
+from src.video import capture_frames
+from src.motion import ChangeDetector
+from src.s3 import FrameUploader, new_session_key
+from src.api import ApiClient, IterationPublisher
+from src.dynamodb import BatchWriter, ensure_table
+from src.pipeline import Pipeline, Stage
+from src.metrics import MetricsServer, METRICS_PORT
+from main import (
+    detect_iteration, encode_iteration, persist_iteration, save_session,
+    ENCODING_QUEUE_SIZE, PERSISTENCE_QUEUE_SIZE,
+    S3_BUCKET_NAME, S3_ENDPOINT, S3_STORAGE_URL, DYNAMODB_TABLE_NAME, DYNAMODB_ENDPOINT,
+)
+
+logger = logging.getLogger()
+
+# Put on the queue of ready sources to stop a detector worker
+_STOP = object()
+
+
+class FrameSource:
+    """
+    A camera or video file, with its own session and face tracker state.
+
+    Only the latest captured frame is kept: if the detectors fall behind, older frames
+    are dropped. At most one frame of a source is detected at a time, which keeps the
+    tracker state consistent and gives every source its turn.
+
+    Attributes
+    ----------
+    source: int or str
+        Camera index or path/URL of the video.
+    session_key: str
+        Key of the session of the source.
+    fps_cap: float
+        Maximum number of frames per second detected, None for no limit. Video files are
+        read at this rate, or at their own frame rate without limit.
+    captured: int
+        Number of frames captured.
+    dropped: int
+        Number of frames replaced by a newer one before being detected.
+    """
+
+    def __init__(self, source, face_tracker, session_key, publisher=None, fps_cap=None, change_detector=None):
+        self.source = source
+        self.face_tracker = face_tracker
+        self.change_detector = change_detector
+        # The previous detected frame, reused for static frames
+        self.previous = {}
+        self.session_key = session_key
+        self.publisher = publisher
+        self.fps_cap = fps_cap
+        self.sequence = 0
+        self.captured = 0
+        self.dropped = 0
+
+        self.latest_frame = None
+        # Whether the source is in the queue of ready sources, or being detected
+        self.scheduled = False
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def __str__(self):
+        return f'Source {self.source} ({self.session_key})'
+
+
+class Supervisor:
+    """
+    Runs many frame sources concurrently, sharing a pool of detector threads and the
+    upload and database clients.
+
+    Sources with a frame to detect wait in a FIFO queue: a source goes back to the end
+    of the queue after each detection, so every source gets its turn whatever its frame
+    rate. The detected frames are encoded and persisted by a shared pipeline.
+
+    A dlib detector can't run in several threads at once, so every detector thread has
+    its own, given to the tracker of the source it detects.
+    """
+
+    def __init__(self, sources, uploader, writer, detector_workers=4):
+        """
+        Parameters
+        ----------
+        sources: list of FrameSource
+            The sources, not started yet.
+        uploader: FrameUploader
+            The uploader saving the images in the bucket, shared by all the sessions.
+        writer: BatchWriter
+            The writer saving the iterations in the dynamoDB table, shared by all the sessions.
+        detector_workers: int
+            Number of threads running the face detector.
+        """
+        self.sources = sources
+        self.uploader = uploader
+        self.writer = writer
+        self.ready = queue.Queue()
+        self.stopping = threading.Event()
+
+        self._capture_threads = [
+            threading.Thread(target=self._capture, args=(source,), name=f'capture-{i}', daemon=True)
+            for i, source in enumerate(sources)
+        ]
+        self._detector_threads = [
+            threading.Thread(
+                target=self._detect, args=(dlib.get_frontal_face_detector(),), name=f'detector-{i}', daemon=True
+            )
+            for i in range(detector_workers)
+        ]
+
+        encoding = Stage('encoding', encode_iteration, maxsize=ENCODING_QUEUE_SIZE, workers=2)
+        encoding.connect(Stage('persistence', self._persist, maxsize=PERSISTENCE_QUEUE_SIZE))
+        self.pipeline = Pipeline([encoding] + encoding.outputs)
+
+    def start(self):
+        self.pipeline.start()
+        for thread in self._detector_threads + self._capture_threads:
+            thread.start()
+
+    def wait(self):
+        """Wait for every source to finish, e.g. the end of the video files"""
+        for source in self.sources:
+            while not source.finished.wait(0.5):
+                pass
+
+    def stop(self):
+        """Stop capturing, then detect and save the frames already captured"""
+        self.stopping.set()
+        for thread in self._capture_threads:
+            thread.join()
+
+        # Every source put on the queue is marked done once detected, including the ones
+        # put back because a frame arrived during their detection
+        self.ready.join()
+        for _ in self._detector_threads:
+            self.ready.put(_STOP)
+        for thread in self._detector_threads:
+            thread.join()
+
+        self.pipeline.drain()
+        for source in self.sources:
+            logger.info(f'{source}: {source.sequence} frames detected, {source.dropped} dropped')
+
+    def _capture(self, source):
+        video_capture = cv2.VideoCapture(source.source)
+        try:
+            for frame in capture_frames(video_capture, self.stopping, source.fps_cap):
+                self._offer(source, frame)
+        finally:
+            video_capture.release()
+            source.finished.set()
+
+    def _offer(self, source, frame):
+        with source.lock:
+            source.captured += 1
+            if source.latest_frame is not None:
+                source.dropped += 1
+            source.latest_frame = frame
+            if source.scheduled:
+                return
+            source.scheduled = True
+        self.ready.put(source)
+
+    def _detect(self, detector):
+        while True:
+            source = self.ready.get()
+            if source is _STOP:
+                self.ready.task_done()
+                return
+
+            with source.lock:
+                frame = source.latest_frame
+                source.latest_frame = None
+                source.sequence += 1
+                sequence = source.sequence
+
+            try:
+                # Only this thread detects the frames of the source until it is put back
+                source.face_tracker.detector = detector
+                iteration = detect_iteration(
+                    {'id': sequence, 'frame': frame}, source.face_tracker, source.change_detector, source.previous
+                )
+                iteration['source'] = source
+                self.pipeline.feed(iteration)
+            except Exception:
+                logger.exception(f'{source}: failed to detect frame {sequence}')
+
+            with source.lock:
+                # A new frame arrived meanwhile, back to the end of the queue
+                if source.latest_frame is not None:
+                    self.ready.put(source)
+                else:
+                    source.scheduled = False
+            self.ready.task_done()
+
+    def _persist(self, iteration):
+        source = iteration.pop('source')
+        persist_iteration(iteration, self.uploader, self.writer, source.publisher, source.session_key)
+
+
+def run(sources, detector_workers, fps_cap=None, metrics_port=METRICS_PORT):
+    """
+    Stream many cameras or videos at once, each one in its own session.
+    Runs until every source is finished, or until interrupted with Ctrl+C.
+
+    The metrics served on `metrics_port` are the ones of every source together, so they
+    are not saved with the sessions.
+    """
+    metrics_server = None
+    if metrics_port is not None:
+        metrics_server = MetricsServer(port=metrics_port)
+        metrics_server.start()
+
+    # The clients are created once and shared by the sources
+    uploader = FrameUploader(S3_BUCKET_NAME, endpoint_url=S3_ENDPOINT, workers=8 * len(sources))
+    dynamodb = boto3.resource('dynamodb', endpoint_url=DYNAMODB_ENDPOINT)
+    table = ensure_table(dynamodb, DYNAMODB_TABLE_NAME)
+    writer = BatchWriter(dynamodb, DYNAMODB_TABLE_NAME)
+    api = ApiClient()
+    detector = dlib.get_frontal_face_detector()
+
+    frame_sources = []
+    for source in sources:
+        session_id = api.create_session(S3_STORAGE_URL)
+        publisher = IterationPublisher(api, session_id) if session_id is not None else None
+        # The detector is replaced by the one of the thread detecting each frame
+        face_tracker = FaceTracker(detector=detector, render=False)
+        frame_sources.append(FrameSource(
+            source, face_tracker, new_session_key(), publisher, fps_cap, ChangeDetector()
+        ))
+
+    supervisor = Supervisor(frame_sources, uploader, writer, detector_workers)
+    supervisor.start()
+    try:
+        supervisor.wait()
+    except KeyboardInterrupt:
+        pass
+    supervisor.stop()
+
+    uploader.close()
+    writer.close()
+    for source in frame_sources:
+        # A source the API could not create the session of is only replayed if it has frames
+        if source.publisher is not None or source.sequence:
+            save_session(api, table, source.session_key, source.publisher)
+    api.close()
+    if metrics_server is not None:
+        metrics_server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Stream many cameras or videos at once.')
+    parser.add_argument('sources', nargs='+', help='camera indexes, video files or stream URLs')
+    parser.add_argument('--detectors', type=int, default=os.cpu_count(), help='number of detector threads')
+    parser.add_argument('--fps', type=float, help='maximum frames per second detected for each source')
+    parser.add_argument(
+        '--metrics-port', type=int, default=METRICS_PORT, help='local port of the metrics endpoint, 0 to disable it'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run(
+        [int(source) if source.isdigit() else source for source in args.sources],
+        args.detectors, args.fps, args.metrics_port or None,
+    )
@@ -0,0 +1,52 @@
+import unittest
+
+from src.dynamodb import BatchWriter
+from benchmark import InMemoryDynamoDB
+
+
+class ThrottledDynamoDB(InMemoryDynamoDB):
+    """The in-memory dynamoDB, leaving the last item of the first `throttled` calls unprocessed"""
+
+    def __init__(self, throttled):
+        super().__init__()
+        self.throttled = throttled
+        self.calls = []
+
+    def batch_write_item(self, RequestItems):
+        self.calls.append(sum(len(requests) for requests in RequestItems.values()))
+        if len(self.calls) > self.throttled:
+            return super().batch_write_item(RequestItems)
+        unprocessed = {}
+        for table_name, requests in RequestItems.items():
+            super().batch_write_item({table_name: requests[:-1]})
+            unprocessed[table_name] = requests[-1:]
+        return {'UnprocessedItems': unprocessed}
+
+
+class BatchWriterTest(unittest.TestCase):
+    """
+    Test module to check the retries of the items left unprocessed by dynamoDB
+    """
+    def test_unprocessed_items_retried(self):
+        dynamodb = ThrottledDynamoDB(throttled=2)
+        writer = BatchWriter(dynamodb, 'table', batch_size=3, flush_interval=60, base_delay=0.001)
+        for sequence in range(3):
+            writer.put({'sequence': sequence})
+        writer.close()
+        # The unprocessed item is sent again alone, until it is written
+        self.assertEqual(dynamodb.calls, [3, 1, 1])
+        self.assertEqual(sorted(item['sequence'] for item in dynamodb.items), [0, 1, 2])
+        self.assertEqual((writer.written, writer.failed), (3, 0))
+
+    def test_unprocessed_items_given_up(self):
+        dynamodb = ThrottledDynamoDB(throttled=10)
+        writer = BatchWriter(dynamodb, 'table', batch_size=3, flush_interval=60, max_attempts=3, base_delay=0.001)
+        for sequence in range(3):
+            writer.put({'sequence': sequence})
+        writer.close()
+        self.assertEqual(dynamodb.calls, [3, 1, 1])
+        self.assertEqual((writer.written, writer.failed), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from src.face import FaceTracker, FEEDBACKS
+from benchmark import synthetic_frames, RESOLUTIONS
+
+
+class RunBatchTest(unittest.TestCase):
+    """
+    Test module to check the detections of `run_batch`, with and without a thread pool
+    """
+    def setUp(self):
+        self.frames = np.stack(synthetic_frames(RESOLUTIONS['480p'], 2, count=10))
+        self.face_tracker = FaceTracker(tracking=False, roi_search=False, render=False)
+
+    def assertSameResults(self, results, expected):
+        for field in ('feedback', 'left', 'top', 'right', 'bottom'):
+            np.testing.assert_array_equal(results[field], expected[field], err_msg=field)
+        np.testing.assert_allclose(results['score'], expected['score'], err_msg='score')
+
+    def test_run_batch_matches_run(self):
+        results = self.face_tracker.run_batch(self.frames)
+        for frame, result in zip(self.frames, results):
+            feedback, _, _ = self.face_tracker.run(frame)
+            self.assertEqual(FEEDBACKS[result['feedback']], feedback)
+            self.assertEqual(FaceTracker.rectangle_of(result), self.face_tracker.last_bounding_box)
+
+    def test_run_batch_with_thread_pool(self):
+        expected = self.face_tracker.run_batch(self.frames)
+        with ThreadPoolExecutor(4) as executor:
+            results = self.face_tracker.run_batch(self.frames, executor)
+        self.assertSameResults(results, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import time
+import queue
+import threading
+import unittest
+
+from src.pipeline import put_with_policy, Batcher, Pipeline, Stage, BLOCK, DROP_NEWEST, DROP_OLDEST
+
+
+class PutWithPolicyTest(unittest.TestCase):
+    """
+    Test module to check the drop policies applied when a queue is full
+    """
+    def setUp(self):
+        self.queue = queue.Queue(maxsize=2)
+        self.queue.put(1)
+        self.queue.put(2)
+
+    def test_drop_newest(self):
+        self.assertEqual(put_with_policy(self.queue, 3, DROP_NEWEST), 1)
+        self.assertEqual(list(self.queue.queue), [1, 2])
+
+    def test_drop_oldest(self):
+        self.assertEqual(put_with_policy(self.queue, 3, DROP_OLDEST), 1)
+        self.assertEqual(list(self.queue.queue), [2, 3])
+
+    def test_block_waits_for_room(self):
+        putter = threading.Thread(target=put_with_policy, args=(self.queue, 3, BLOCK))
+        putter.start()
+        putter.join(0.1)
+        self.assertTrue(putter.is_alive())
+        self.assertEqual(self.queue.get(), 1)
+        putter.join(1)
+        self.assertFalse(putter.is_alive())
+        self.assertEqual(list(self.queue.queue), [2, 3])
+
+
+class PipelineTest(unittest.TestCase):
+    """
+    Test module to check that draining a pipeline processes every queued item
+    """
+    def test_drain_processes_queued_items(self):
+        results = []
+        release = threading.Event()
+
+        def slow_double(item):
+            release.wait()
+            return item * 2
+
+        first = Stage('double', slow_double, maxsize=16, workers=2)
+        last = first.connect(Stage('collect', results.append, maxsize=1))
+        pipeline = Pipeline([first, last])
+        pipeline.start()
+        for item in range(10):
+            pipeline.feed(item)
+        release.set()
+        pipeline.drain()
+        self.assertEqual(sorted(results), [item * 2 for item in range(10)])
+
+    def test_drain_counts_dropped_items(self):
+        release = threading.Event()
+        stage = Stage('wait', lambda item: release.wait(), maxsize=1, policy=DROP_NEWEST)
+        pipeline = Pipeline([stage])
+        pipeline.start()
+        for item in range(5):
+            pipeline.feed(item)
+        release.set()
+        pipeline.drain()
+        # One item is processed, one is queued, the others are dropped
+        self.assertGreaterEqual(stage.dropped, 3)
+
+
+class BatcherTest(unittest.TestCase):
+    """
+    Test module to check when the buffer of a Batcher is written
+    """
+    def setUp(self):
+        self.batches = []
+        self.written = threading.Event()
+
+    def write_batch(self, batch):
+        self.batches.append(batch)
+        self.written.set()
+
+    def test_flush_after_interval(self):
+        batcher = Batcher('test', self.write_batch, batch_size=10, flush_interval=0.1)
+        batcher.put(1)
+        batcher.put(2)
+        self.assertTrue(self.written.wait(1))
+        self.assertEqual(self.batches, [[1, 2]])
+        batcher.close()
+        self.assertEqual(self.batches, [[1, 2]])
+
+    def test_full_batch_written_by_flusher(self):
+        batcher = Batcher('test', self.write_batch, batch_size=2, flush_interval=60)
+        batcher.put(1)
+        batcher.put(2)
+        self.assertTrue(self.written.wait(1))
+        self.assertEqual(self.batches, [[1, 2]])
+        batcher.close()
+
+    def test_put_never_writes(self):
+        def hung_write_batch(batch):
+            self.batches.append(batch)
+            time.sleep(0.5)
+
+        batcher = Batcher('test', hung_write_batch, batch_size=1, flush_interval=60)
+        started = time.monotonic()
+        for item in range(5):
+            batcher.put(item)
+        self.assertLess(time.monotonic() - started, 0.2)
+        batcher.close()
+        self.assertEqual(sum(self.batches, []), [0, 1, 2, 3, 4])
+
+    def test_close_writes_remaining_items(self):
+        batcher = Batcher('test', self.write_batch, batch_size=2, flush_interval=60)
+        for item in range(5):
+            batcher.put(item)
+        batcher.close()
+        self.assertEqual(sum(self.batches, []), [0, 1, 2, 3, 4])
+        self.assertTrue(all(len(batch) <= 2 for batch in self.batches))
+
+
+if __name__ == '__main__':
+    unittest.main()
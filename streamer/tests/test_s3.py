@@ -0,0 +1,71 @@
+import unittest
+
+from botocore.exceptions import ClientError
+
+from src.s3 import FrameUploader, INPUT_FRAME, DETECTED_FACE
+from benchmark import InMemoryS3
+
+
+class FlakyS3(InMemoryS3):
+    """The in-memory S3, failing the first `failures` calls"""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.calls = 0
+
+    def put_object(self, Bucket, Key, Body):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ClientError({'Error': {'Code': 'SlowDown'}}, 'PutObject')
+        return super().put_object(Bucket, Key, Body)
+
+
+class FrameUploaderTest(unittest.TestCase):
+    """
+    Test module to check the keys of the uploaded images and the retries of the uploads
+    """
+    def test_object_keys(self):
+        s3 = InMemoryS3()
+        uploader = FrameUploader('bucket', session_key='session', client=s3)
+        futures = [
+            uploader.upload(b'input', 12, INPUT_FRAME),
+            uploader.upload(b'face', 12, DETECTED_FACE, session_key='other'),
+        ]
+        uploader.close()
+        self.assertEqual([future.key for future in futures], ['session/00000012_input.jpg', 'other/00000012_face.jpg'])
+        self.assertEqual([future.result() for future in futures], [future.key for future in futures])
+        self.assertEqual(
+            set(s3.objects), {('bucket', 'session/00000012_input.jpg'), ('bucket', 'other/00000012_face.jpg')}
+        )
+
+    def test_upload_retried(self):
+        s3 = FlakyS3(failures=2)
+        uploader = FrameUploader('bucket', session_key='session', workers=1, base_delay=0.001, client=s3)
+        future = uploader.upload(b'input', 1, INPUT_FRAME)
+        uploader.close()
+        self.assertEqual(future.result(), 'session/00000001_input.jpg')
+        self.assertEqual(s3.calls, 3)
+        self.assertEqual(uploader.failed, 0)
+
+    def test_upload_failed_after_every_attempt(self):
+        s3 = FlakyS3(failures=10)
+        uploader = FrameUploader('bucket', workers=1, max_attempts=3, base_delay=0.001, client=s3)
+        future = uploader.upload(b'input', 1, INPUT_FRAME)
+        uploader.close()
+        self.assertIsInstance(future.exception(), ClientError)
+        self.assertEqual(s3.calls, 3)
+        self.assertEqual(uploader.failed, 1)
+        self.assertEqual(s3.objects, {})
+
+    def test_wait_session(self):
+        s3 = InMemoryS3(latency=0.05)
+        uploader = FrameUploader('bucket', session_key='session', client=s3)
+        futures = [uploader.upload(b'input', sequence, INPUT_FRAME) for sequence in range(4)]
+        uploader.wait_session('session')
+        self.assertTrue(all(future.done() for future in futures))
+        uploader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
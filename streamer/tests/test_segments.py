@@ -0,0 +1,41 @@
+import os
+import unittest
+
+import numpy as np
+
+from src.s3 import FrameUploader
+from src.segments import SegmentWriter
+from benchmark import InMemoryS3
+
+
+class SegmentWriterTest(unittest.TestCase):
+    """
+    Test module to check the frames written in video segments
+    """
+    def setUp(self):
+        self.s3 = InMemoryS3()
+        self.uploader = FrameUploader('bucket', session_key='session', client=self.s3)
+        self.frame = np.zeros((48, 64, 3), np.uint8)
+
+    def test_write_segment(self):
+        segment_writer = SegmentWriter(self.uploader)
+        self.assertEqual(segment_writer.write(self.frame, 1), ('session/segments/000001.avi', 0))
+        self.assertEqual(segment_writer.write(self.frame, 2), ('session/segments/000001.avi', 1))
+        segment_writer.close()
+        self.uploader.close()
+        self.assertEqual(
+            set(self.s3.objects), {('bucket', 'session/segments/000001.avi'), ('bucket', 'session/segments/index.json')}
+        )
+
+    def test_segment_not_opened(self):
+        segment_writer = SegmentWriter(self.uploader)
+        segment_writer._directory = os.path.join(segment_writer._directory, 'missing')
+        with self.assertRaises(OSError):
+            segment_writer.write(self.frame, 1)
+        self.assertEqual(segment_writer.index, {})
+        segment_writer.close()
+        self.uploader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()